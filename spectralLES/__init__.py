@@ -1 +1,4 @@
 from .spectralLES import spectralLES
+from .ensembleLES import ensembleLES
+from .runController import runController
+from .insituLink import insituLink
@@ -0,0 +1,122 @@
+"""
+Fused time-integration kernels for the spectralLES solver.
+
+Description:
+============
+Each Runge-Kutta stage of spectralLES.RK4_integrate dealiases the RHS,
+applies the Leray-Hopf projection, and updates both the stage solution
+and the RK4 accumulation register. Written as numpy expressions these
+four operations make separate passes over the 3-component complex field
+and allocate several field-sized temporaries.
+
+If numba is installed, rk4_stage_update() performs all four operations
+in a single, threaded (numba.prange) sweep over the wavenumbers without
+any temporaries. Otherwise it falls back to the equivalent numpy
+expressions.
+
+Notes:
+======
+numba uses every core of the node by default. When running more than one
+MPI task per node, set NUMBA_NUM_THREADS (e.g. to the number of cores
+per task) to avoid oversubscribing the cores.
+
+Authors:
+========
+Colin Towery (colin.towery@colorado.edu)
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+https://github.com/teslacu/spectralLES.git
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+__all__ = ['rk4_stage_update']
+
+
+def rk4_stage_update(dU, U_hat, U_hat0, U_hat1, dealias, K, K_Ksq, adt,
+                     bdt=None):
+    """
+    Dealias and solenoidally project the RHS, dU, then update the stage
+    solution and RK4 accumulation register in-place, i.e.
+
+        dU *= dealias
+        dU -= (dU.K/K^2)K
+        U_hat = U_hat0 + bdt*dU  (skipped if bdt is None)
+        U_hat1 += adt*dU
+
+    Arguments:
+    ----------
+    dU: RHS accumulator, shape (..., 3, nz, nny, nk), where any leading
+        axes are ensemble members
+    U_hat, U_hat0, U_hat1: stage solution, RK4 initial value, and RK4
+        accumulation register, same shape as dU
+    dealias: dealiasing filter kernel, shape (nz, nny, nk)
+    K, K_Ksq: wavevector and wavevector over k^2, shape (3, nz, nny, nk)
+    adt: RK4 accumulation weight times dt
+    bdt: (optional) RK4 stage weight times dt
+    """
+    if numba is None or not _contiguous(dU, U_hat, U_hat0, U_hat1, dealias,
+                                        K, K_Ksq):
+        dU *= dealias
+        dU -= np.sum(dU*K_Ksq, axis=-4, keepdims=True)*K
+        if bdt is not None:
+            U_hat[:] = U_hat0 + bdt*dU
+        U_hat1 += adt*dU
+
+        return
+
+    M = dealias.size
+    shape = (-1, 3, M)  # (members, components, wavenumbers)
+    _fused_stage(dU.reshape(shape), U_hat.reshape(shape),
+                 U_hat0.reshape(shape), U_hat1.reshape(shape),
+                 dealias.reshape(M), K.reshape(3, M), K_Ksq.reshape(3, M),
+                 adt, 0.0 if bdt is None else bdt, bdt is not None)
+
+    return
+
+
+def _contiguous(*arrays):
+    return all(a.flags.c_contiguous for a in arrays)
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _fused_stage(dU, U_hat, U_hat0, U_hat1, G, K, K_Ksq, adt, bdt,
+                     update):
+        """
+        Single-sweep numba kernel of rk4_stage_update(). Arrays are
+        flattened views with shapes (nens, 3, M), (M, ), and (3, M).
+        """
+        nens = dU.shape[0]
+        for n in numba.prange(G.shape[0]):
+            g = G[n]
+            for e in range(nens):
+                d0 = dU[e, 0, n]*g
+                d1 = dU[e, 1, n]*g
+                d2 = dU[e, 2, n]*g
+
+                p = d0*K_Ksq[0, n] + d1*K_Ksq[1, n] + d2*K_Ksq[2, n]
+                d0 -= p*K[0, n]
+                d1 -= p*K[1, n]
+                d2 -= p*K[2, n]
+
+                dU[e, 0, n] = d0
+                dU[e, 1, n] = d1
+                dU[e, 2, n] = d2
+
+                if update:
+                    U_hat[e, 0, n] = U_hat0[e, 0, n] + bdt*d0
+                    U_hat[e, 1, n] = U_hat0[e, 1, n] + bdt*d1
+                    U_hat[e, 2, n] = U_hat0[e, 2, n] + bdt*d2
+
+                U_hat1[e, 0, n] += adt*d0
+                U_hat1[e, 1, n] += adt*d1
+                U_hat1[e, 2, n] += adt*d2
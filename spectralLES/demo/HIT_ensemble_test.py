@@ -0,0 +1,148 @@
+"""
+Description:
+------------
+Ensemble of forced homogeneous isotropic turbulence LES realisations
+using the spectralLES ensembleLES solver. Every ensemble member uses its
+own random seed and Smagorinsky constant, and each group of MPI tasks
+advances nens//ngroups members together.
+
+Notes:
+------
+To run an ensemble of 8 realisations split into 2 groups of 2 tasks, run
+`mpiexec -n 4 python HIT_ensemble_test.py -f HIT_demo_inputs.txt \
+              --nens 8 --ngroups 2`.
+
+Authors:
+--------
+Colin Towery, colin.towery@colorado.edu
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+https://github.com/teslacu/teslapy.git
+https://github.com/teslacu/spectralLES.git
+"""
+
+from mpi4py import MPI
+import numpy as np
+import sys
+import time
+from math import sqrt, pi
+import argparse
+from spectralLES import ensembleLES
+
+comm = MPI.COMM_WORLD
+
+
+def timeofday():
+    return time.strftime("%H:%M:%S")
+
+
+def HIT_ensemble_test(pp=None, sp=None):
+    """
+    Arguments:
+    ----------
+    pp: (optional) program parameters, parsed by argument parser
+        provided by this file
+    sp: (optional) solver parameters, parsed by ensembleLES.parser
+    """
+
+    if pp is None:
+        pp = ens_parser.parse_known_args()[0]
+
+    if sp is None:
+        sp = ensembleLES.parser.parse_known_args()[0]
+
+    if comm.rank == 0:
+        print("Python MPI spectralLES ensemble of {} realisations of "
+              "`Homogeneous Isotropic Turbulence' started with {} tasks "
+              "in {} groups at {}."
+              .format(sp.nens, comm.size, sp.ngroups, timeofday()))
+
+    N = sp.N[0]
+    L = sp.L[0]
+
+    if (N*sp.ngroups) % comm.size > 0:
+        if comm.rank == 0:
+            print('Error: job started with improper number of MPI tasks for '
+                  'the size of the data and number of groups specified!')
+        MPI.Finalize()
+        sys.exit(1)
+
+    # -------------------------------------------------------------------------
+    # Configure the solver
+
+    solver = ensembleLES(comm, **vars(sp))
+    solver.computeAD = solver.computeAD_vorticity_form
+    Sources = [solver.computeSource_linear_forcing,
+               solver.computeSource_Smagorinksy_SGS]
+
+    # -- each member gets its own seed and a Smagorinsky constant spread
+    #    evenly about the Ck = 1.6 value used in the HIT demo
+    seeds = pp.rseed + np.arange(sp.nens)
+    Ck = 1.6
+    Cs = sqrt((pi**-2)*((3*Ck)**-1.5))*np.linspace(0.5, 1.5, sp.nens)
+    kwargs = {'Cs': Cs[solver.members], 'dvScale': None}
+
+    Urms = 1.2*(sp.epsilon*L)**(1./3.)
+    solver.initialize_HIT_random_spectrum(Urms**2, -1./3., N//4, rseed=seeds)
+
+    # -------------------------------------------------------------------------
+    # Run the simulation
+
+    t_sim = 0.0
+    tstep = 0
+    start = time.time()
+
+    while t_sim < pp.tlimit-1.e-8:
+
+        dt = solver.new_dt_constant_nu(pp.cfl)
+
+        KE = 0.5*solver.member_sum(np.square(solver.U, dtype=np.float64))
+        KE /= solver.Nx
+        if solver.comm.rank == 0:
+            print("group = %3d  cycle = %7d  time = %15.8e  dt = %15.8e  "
+                  "KE = %s" % (solver.group, tstep, t_sim, dt, KE))
+
+        if tstep % pp.nsteps_drv == 0:
+            kwargs['dvScale'] = Sources[0](computeRHS=False)
+
+        solver.RK4_integrate(dt, *Sources, **kwargs)
+
+        t_sim += dt
+        tstep += 1
+
+        sys.stdout.flush()  # forces Python 3 to flush print statements
+
+    KE = 0.5*solver.member_sum(np.square(solver.U, dtype=np.float64))
+    KE /= solver.Nx
+    KE = np.concatenate(comm.allgather(KE if solver.comm.rank == 0 else []))
+
+    if comm.rank == 0:
+        print("Time = %12.8f" % (time.time()-start))
+        for m in range(sp.nens):
+            print("member = %3d  Cs = %10.8f  KE = %15.8e" % (m, Cs[m], KE[m]))
+
+    return
+
+
+###############################################################################
+ens_parser = argparse.ArgumentParser(prog='HIT Ensemble Test',
+                                     parents=[ensembleLES.parser])
+
+ens_parser.description = ("An ensemble large eddy simulation model testing "
+                          "script for homogeneous isotropic turbulence")
+
+ens_parser.add_argument('--cfl', type=float, default=0.5, help='CFL number')
+ens_parser.add_argument('-t', '--tlimit', type=float, default=1.0,
+                        help='solution time limit')
+ens_parser.add_argument('--rseed', type=int, default=1,
+                        help='random seed of the first ensemble member')
+ens_parser.add_argument('--nsteps_drv', type=int, default=10,
+                        help='number of steps between forcing updates')
+
+
+###############################################################################
+if __name__ == "__main__":
+    HIT_ensemble_test()
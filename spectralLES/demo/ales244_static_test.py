@@ -155,7 +155,7 @@ def ales244_static_les_test(pp=None, sp=None):
         t_test = t_sim + 0.5*dt
 
         # -- output log messages every step if needed/wanted
-        KE = 0.5*comm.allreduce(psum(np.square(U)))/solver.Nx
+        KE = 0.5*comm.allreduce(psum(np.square(U, dtype=np.float64)))/solver.Nx
         if comm.rank == 0:
             print("cycle = %7d  time = %15.8e  dt = %15.8e  KE = %15.8e"
                   % (tstep, t_sim, dt, KE))
@@ -238,7 +238,7 @@ class ales244_solver(spectralLES):
         nnz, ny, nx = self.nnx
         nz, nny, nk = self.nnk
 
-        self.tau_hat = np.empty((6, nz, nny, nk), dtype=complex)
+        self.tau_hat = np.empty((6, nz, nny, nk), dtype=self.ctype)
         self.UU_hat = np.empty_like(self.tau_hat)
 
     # Instance Methods --------------------------------------------------------
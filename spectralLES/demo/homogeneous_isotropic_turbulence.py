@@ -30,25 +30,29 @@ https://github.com/teslacu/spectralLES.git
 from mpi4py import MPI
 import numpy as np
 import sys
+import os
+import pickle
 import time
 from math import sqrt, pi
 import argparse
-from spectralLES import spectralLES
+from spectralLES import spectralLES, runController, insituLink
 from teslacu import mpiAnalyzer, mpiWriter
-from teslacu.fft import irfft3  # FFT transforms
+from teslacu.misc import timers  # per-phase profiling timers
 
 comm = MPI.COMM_WORLD
 
 
 # -----------------------------------------------------------------------------
-def homogeneous_isotropic_turbulence(pp=None, sp=None):
+def homogeneous_isotropic_turbulence(pp=None, sp=None, comm=comm):
     """
     Arguments:
     ----------
     pp: (optional) program parameters, parsed by argument parser
         provided by this file
     sp: (optional) solver parameters, parsed by spectralLES.parser
+    comm: (optional) MPI communicator, default = MPI.COMM_WORLD
     """
+    tstart = MPI.Wtime()  # the wall-time limit includes all setup time
 
     if comm.rank == 0:
         print("\n----------------------------------------------------------")
@@ -82,13 +86,26 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
                                  'requires equal domain dimensions')
     L = pp.L[0]
 
-    if N % comm.size > 0:
+    nsolver = comm.size - pp.insitu
+    if (N % nsolver > 0 or (pp.insitu > 0 and (N % pp.insitu > 0
+                                               or nsolver % pp.insitu > 0))):
         if comm.rank == 0:
             print('Error: job started with improper number of MPI tasks for '
-                  'the size of the data specified!')
+                  'the size of the data and number of analysis tasks '
+                  'specified!')
         MPI.Finalize()
         sys.exit(1)
 
+    # -- split off the in-situ analysis tasks, which receive snapshots from
+    #    the solver tasks and write all analysis and data-file outputs
+    link = None
+    if pp.insitu > 0:
+        link = insituLink(comm, pp.insitu)
+        comm = link.comm
+        if link.analysis:
+            insitu_analysis(link, pp)
+            return
+
     # -------------------------------------------------------------------------
     # Configure the solver, writer, and analyzer
 
@@ -114,24 +131,42 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
     kexp = getattr(pp, 'kexp', None) or -1./3.     # -> E(k) ~ k^(-2./3.)
     kpeak= getattr(pp, 'kpeak', None) or N//4      # ~ kmax/2
 
-    # !  currently using a fixed random seed of comm.rank for testing
-    solver.initialize_HIT_random_spectrum(Einit, kexp, kpeak, rseed=comm.rank)
+    # -- either restart from a checkpoint or form the initial conditions
+    if pp.restart is None:
+        # !  currently using a fixed random seed of comm.rank for testing
+        solver.initialize_HIT_random_spectrum(Einit, kexp, kpeak,
+                                              rseed=comm.rank)
+        rst_state = None
+    else:
+        rst_state = solver.read_checkpoint(pp.idir, pp.restart)
 
     U_hat = solver.U_hat
     U = solver.U
-    omega = solver.omega
-    K = solver.K
 
     # -- configure the writer and analyzer from both pp and sp attributes
     writer = mpiWriter(comm, odir=pp.odir, N=N)
     analyzer = mpiAnalyzer(comm, odir=pp.adir, pid=pp.pid, L=L, N=N,
                            config='hit', method='spectral')
 
+    # -- derived fields (vorticity, enstrophy, ...) of each time step are
+    #    computed on demand and shared by all of its analysis outputs.
+    #    The solver orders velocity components by array axis (U[0] is
+    #    along axis 0), the analyzer by coordinate (u[0] is along x1,
+    #    which is axis 2), so the analyzer gets reversed views.
+    fields = analyzer.fields
+
     Ek_fmt = "\widehat{{{0}}}^*\widehat{{{0}}}".format
     emin = np.inf
     emax = np.NINF
     analyzer.mpi_moments_file = '%s%s.moments' % (analyzer.odir, pp.pid)
 
+    # -- running (time-averaged) spectra of the statistically stationary
+    #    part of the run, which are saved with every checkpoint (by the
+    #    in-situ analysis tasks if they compute the spectra)
+    spec_u = analyzer.spectrum_accumulator()
+    spec_omga = analyzer.spectrum_accumulator()
+    avg_spectra = None
+
     # -------------------------------------------------------------------------
     # Setup the various time and IO counters
 
@@ -149,6 +184,7 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
     dt_stat= getattr(pp, 'dt_stat', None) or max(0.2*taul, 2*tauK, 20*dt)
     dt_spec= getattr(pp, 'dt_spec', None) or max(0.1*taul, tauK, 10*dt)
     dt_drv = getattr(pp, 'dt_drv', None) or max(tauK, 10*dt)
+    t_avg  = getattr(pp, 't_avg', None) or 6*taul
 
     t_sim = t_rst = t_bin = t_stat = t_spec = t_drv = 0.0
     tstep = irst = ibin = istat = ispec = 0
@@ -170,33 +206,88 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
     if ((dt_rst % dt_bin) < 0.1*dt_bin):
         dt_rst -= dt_rst % dt_bin
 
+    # -- resume the time and IO counters of a restarted simulation
+    if rst_state is not None:
+        dt_rst, dt_bin, dt_stat, dt_spec, dt_drv = rst_state['intervals']
+        t_sim, t_rst, t_bin, t_stat, t_spec, t_drv = rst_state['times']
+        tstep, irst, ibin, istat, ispec = rst_state['counters']
+        kwargs['dvScale'] = rst_state['dvScale']
+        emin, emax = rst_state['emin_emax']
+        avg_spectra = rst_state.get('avg_spectra')
+        if 'insitu_state' in rst_state:
+            avg_spectra = read_insitu_state(comm, pp.idir
+                                            + rst_state['insitu_state'])
+        if avg_spectra is not None and link is None:
+            spec_u.load_state(avg_spectra[0])
+            spec_omga.load_state(avg_spectra[1])
+            avg_spectra = None
+        if comm.rank == 0:
+            print("restarted from checkpoint at cycle = %d, time = %15.8e"
+                  % (tstep, t_sim))
+
+    def run_state(ichk):
+        """collects the run metadata needed to restart the simulation"""
+        state = {'intervals': (dt_rst, dt_bin, dt_stat, dt_spec, dt_drv),
+                 'times': (t_sim, t_rst, t_bin, t_stat, t_spec, t_drv),
+                 'counters': (tstep, irst, ibin, istat, ispec),
+                 'dvScale': kwargs['dvScale'], 'emin_emax': (emin, emax)}
+        if link is None:
+            state['avg_spectra'] = (spec_u.state(), spec_omga.state())
+        else:  # saved by the in-situ tasks, see insitu_analysis()
+            state['insitu_state'] = insitu_state_file(ichk)
+        return state
+
     # -------------------------------------------------------------------------
     # Run the simulation
 
+    # -- the controller stops the run early (with a final checkpoint) before
+    #    the wall-time limit is reached or when the scheduler signals the job
+    controller = runController(comm, twall=pp.twall, tstart=tstart)
+
+    # -- per-phase timers are reported every pp.profile steps
+    timers_file = '%s%s.timers' % (analyzer.odir, pp.pid)
+    if pp.profile:
+        timers.enable()
+
     while t_sim < pp.tlimit+1.e-8:
 
+        if controller.stop():
+            if comm.rank == 0:
+                print("------ stopping early: %s ------" % controller.reason)
+            break
+
         # -- Update the dynamic dt based on CFL constraint
         dt = solver.new_dt_constant_nu(pp.cfl)
         t_test = t_sim + 0.5*dt
         compute_vorticity = True  # reset the vorticity computation flag
 
         # -- output log messages every step if needed/wanted
-        KE = 0.5*comm.allreduce(np.sum(np.square(U)))*(1./N)**3
+        KE = 0.5*comm.allreduce(np.sum(np.square(U), dtype=np.float64))
+        KE *= (1./N)**3
         if comm.rank == 0:
             print("cycle = %7d  time = %15.8e  dt = %15.8e  KE = %15.8e"
                   % (tstep, t_sim, dt, KE))
 
         # - output snapshots and data analysis products
-        if t_test >= t_spec:
-            analyzer.spectral_density(U_hat, '%3.3d_u' % ispec,
-                                      'velocity PSD\t%s' % Ek_fmt('u_i'))
+        #   (or hand them off to the in-situ analysis tasks)
+        outputs = {}
 
-            omega[2] = irfft3(comm, 1j*(K[0]*U_hat[1] - K[1]*U_hat[0]))
-            omega[1] = irfft3(comm, 1j*(K[2]*U_hat[0] - K[0]*U_hat[2]))
-            omega[0] = irfft3(comm, 1j*(K[1]*U_hat[2] - K[2]*U_hat[1]))
+        if t_test >= t_spec and link is not None:
+            outputs['ispec'] = ispec
+            outputs['average'] = t_sim >= t_avg
+            t_spec += dt_spec
+            ispec += 1
+
+        elif t_test >= t_spec:
+            average = t_sim >= t_avg
+            analyzer.spectral_density(U_hat, '%3.3d_u' % ispec,
+                                      'velocity PSD\t%s' % Ek_fmt('u_i'),
+                                      spec_u if average else None)
 
-            analyzer.spectral_density(omega, '%3.3d_omga' % ispec,
-                                      'vorticity PSD\t%s' % Ek_fmt('\omega_i'))
+            fields.new_snapshot(tstep, u_hat=U_hat[::-1], u=U[::-1])
+            analyzer.spectral_density(fields['omega'], '%3.3d_omga' % ispec,
+                                      'vorticity PSD\t%s' % Ek_fmt('\omega_i'),
+                                      spec_omga if average else None)
 
             t_spec += dt_spec
             ispec += 1
@@ -204,12 +295,8 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
 
         # if t_test >= t_stat:
 
-        #     if compute_vorticity:
-        #         omega[2] = irfft3(comm, 1j*(K[0]*U_hat[1] - K[1]*U_hat[0]))
-        #         omega[1] = irfft3(comm, 1j*(K[2]*U_hat[0] - K[0]*U_hat[2]))
-        #         omega[0] = irfft3(comm, 1j*(K[1]*U_hat[2] - K[2]*U_hat[1]))
-
-        #     enst = 0.5*np.sum(np.square(omega), axis=0)
+        #     fields.new_snapshot(tstep, u_hat=U_hat[::-1], u=U[::-1])
+        #     enst = fields['enst']
 
         #     emin = min(emin, comm.allreduce(np.min(enst), op=MPI.MIN))
         #     emax = max(emax, comm.allreduce(np.max(enst), op=MPI.MAX))
@@ -226,12 +313,28 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
         #     ibin += 1
 
         if t_test >= t_rst:
-            writer.write_scalar('Velocity1_%3.3d.rst' % irst, U[0], np.float64)
-            writer.write_scalar('Velocity2_%3.3d.rst' % irst, U[1], np.float64)
-            writer.write_scalar('Velocity3_%3.3d.rst' % irst, U[2], np.float64)
+            if link is not None:
+                outputs['irst'] = irst
+            else:
+                writer.write_scalar('Velocity1_%3.3d.rst' % irst, U[0],
+                                    np.float64)
+                writer.write_scalar('Velocity2_%3.3d.rst' % irst, U[1],
+                                    np.float64)
+                writer.write_scalar('Velocity3_%3.3d.rst' % irst, U[2],
+                                    np.float64)
             t_rst += dt_rst
             irst += 1
 
+            # the checkpoint is written after the counter updates so that
+            # a restart resumes the loop without repeating any outputs
+            solver.write_checkpoint(pp.odir, irst-1, **run_state(irst-1))
+
+        if outputs:
+            if avg_spectra is not None:  # resume the in-situ averages
+                outputs['avg_spectra'] = avg_spectra
+                avg_spectra = None
+            link.send(U_hat, tstep=tstep, t_sim=t_sim, **outputs)
+
         # -- Update the forcing pattern
         if t_test >= t_drv:
             # call solver.computeSource_linear_forcing to compute dvScale only
@@ -247,21 +350,47 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
         t_sim += dt
         tstep += 1
 
+        if pp.profile and tstep % pp.profile == 0:
+            summary = timers.report(comm, timers_file)
+            if comm.rank == 0:
+                print("------ timers after cycle = %d ------\n%s"
+                      % (tstep, summary))
+
         sys.stdout.flush()  # forces Python 3 to flush print statements
 
+    if pp.profile:
+        summary = timers.report(comm, timers_file, per_rank=True)
+        if comm.rank == 0:
+            print("------ timers of this run ------\n%s" % summary)
+        timers.disable()
+
     # -------------------------------------------------------------------------
     # Finalize the simulation
 
-    omega[2] = irfft3(comm, 1j*(K[0]*U_hat[1] - K[1]*U_hat[0]))
-    omega[1] = irfft3(comm, 1j*(K[2]*U_hat[0] - K[0]*U_hat[2]))
-    omega[0] = irfft3(comm, 1j*(K[1]*U_hat[2] - K[2]*U_hat[1]))
-    enst = 0.5*np.sum(np.square(omega), axis=0)
+    if link is not None:
+        outputs = {'ispec': ispec, 'irst': irst, 'ibin': ibin}
+        if avg_spectra is not None:
+            outputs['avg_spectra'] = avg_spectra
+        link.send(U_hat, tstep=tstep, t_sim=t_sim, **outputs)
+        link.close()
+        solver.write_checkpoint(pp.odir, irst, **run_state(irst))
+
+        return
+
+    fields.new_snapshot(tstep, u_hat=U_hat[::-1], u=U[::-1])
+    omega = fields['omega']
+    enst = fields['enst']
 
     analyzer.spectral_density(U_hat, '%3.3d_u' % ispec, 'velocity PSD\t%s'
                               % Ek_fmt('u_i'))
     analyzer.spectral_density(omega, '%3.3d_omga' % ispec,
                               'vorticity PSD\t%s' % Ek_fmt('\omega_i'))
 
+    write_average_spectrum(analyzer, spec_u, 'avg_u', 'velocity PSD\t%s'
+                           % Ek_fmt('u_i'))
+    write_average_spectrum(analyzer, spec_omga, 'avg_omga',
+                           'vorticity PSD\t%s' % Ek_fmt('\omega_i'))
+
     # emin = min(emin, comm.allreduce(np.min(enst), op=MPI.MIN))
     # emax = max(emax, comm.allreduce(np.max(enst), op=MPI.MAX))
     # scalar_analysis(analyzer, enst, (emin, emax), None, None,
@@ -272,15 +401,127 @@ def homogeneous_isotropic_turbulence(pp=None, sp=None):
     writer.write_scalar('Velocity1_%3.3d.rst' % irst, U[0], np.float64)
     writer.write_scalar('Velocity2_%3.3d.rst' % irst, U[1], np.float64)
     writer.write_scalar('Velocity3_%3.3d.rst' % irst, U[2], np.float64)
+    solver.write_checkpoint(pp.odir, irst, **run_state(irst))
 
     return
 
 
 # -----------------------------------------------------------------------------
+def insitu_analysis(link, pp):
+    """
+    Writes the analysis products and data files of every snapshot the
+    solver tasks hand off over the insituLink, until the link is closed.
+
+    Arguments:
+    ----------
+    link: insituLink instance of an analysis task
+    pp: program parameters, parsed by argument parser provided by this file
+    """
+    comm = link.comm
+    N = pp.N[0]
+    L = pp.L[0]
+
+    writer = mpiWriter(comm, odir=pp.odir, N=N)
+    analyzer = mpiAnalyzer(comm, odir=pp.adir, pid=pp.pid, L=L, N=N,
+                           config='hit', method='spectral')
+    analyzer.mpi_moments_file = '%s%s.moments' % (analyzer.odir, pp.pid)
+    Ek_fmt = "\widehat{{{0}}}^*\widehat{{{0}}}".format
+
+    fields = analyzer.fields    # in the analyzer's component order
+
+    # -- the running spectra are saved alongside every solver checkpoint,
+    #    and the solver hands them back with its first snapshot after a
+    #    restart
+    spec_u = analyzer.spectrum_accumulator()
+    spec_omga = analyzer.spectrum_accumulator()
+
+    for info, U_hat in link:
+        fields.new_snapshot(info['tstep'], u_hat=U_hat[::-1])
+
+        if 'avg_spectra' in info:
+            spec_u.load_state(info['avg_spectra'][0])
+            spec_omga.load_state(info['avg_spectra'][1])
+
+        if 'ispec' in info:
+            ispec = info['ispec']
+            average = info.get('average', False)
+            analyzer.spectral_density(U_hat, '%3.3d_u' % ispec,
+                                      'velocity PSD\t%s' % Ek_fmt('u_i'),
+                                      spec_u if average else None)
+            analyzer.spectral_density(fields['omega'], '%3.3d_omga' % ispec,
+                                      'vorticity PSD\t%s' % Ek_fmt('\omega_i'),
+                                      spec_omga if average else None)
+
+        if 'ibin' in info:
+            writer.write_scalar('Enstrophy_%3.3d.bin' % info['ibin'],
+                                fields['enst'], np.float32)
+
+        if 'irst' in info:
+            U = fields['u'][::-1]   # back in the solver's component order
+            irst = info['irst']
+            writer.write_scalar('Velocity1_%3.3d.rst' % irst, U[0], np.float64)
+            writer.write_scalar('Velocity2_%3.3d.rst' % irst, U[1], np.float64)
+            writer.write_scalar('Velocity3_%3.3d.rst' % irst, U[2], np.float64)
+
+            # the solver checkpoint of this snapshot has the same number
+            avg_spectra = (spec_u.state(), spec_omga.state())
+            if comm.rank == 0:
+                with open(pp.odir + insitu_state_file(irst), 'wb') as fh:
+                    pickle.dump(avg_spectra, fh, pickle.HIGHEST_PROTOCOL)
+
+        if comm.rank == 0:
+            print("------ in-situ analysis of cycle = %d, time = %15.8e "
+                  "done at %s ------" % (info['tstep'], info['t_sim'],
+                                         timeofday()))
+
+    write_average_spectrum(analyzer, spec_u, 'avg_u', 'velocity PSD\t%s'
+                           % Ek_fmt('u_i'))
+    write_average_spectrum(analyzer, spec_omga, 'avg_omga',
+                           'vorticity PSD\t%s' % Ek_fmt('\omega_i'))
+
+    return
+
+
+def insitu_state_file(irst):
+    return 'Insitu_%3.3d.state' % irst
+
+
+def read_insitu_state(comm, fname):
+    """
+    Returns the running spectra saved by insitu_analysis() in fname, or
+    None if the in-situ tasks were stopped before they could save them.
+    """
+    avg_spectra = None
+    if comm.rank == 0:
+        if os.path.exists(fname):
+            with open(fname, 'rb') as fh:
+                avg_spectra = pickle.load(fh)
+        else:
+            print("Warning: %s not found, the running spectra restart "
+                  "from scratch" % fname)
+
+    return comm.bcast(avg_spectra)
+
+
 def timeofday():
     return time.strftime("%H:%M:%S")
 
 
+def write_average_spectrum(mA, acc, fname, metadata):
+    """
+    Writes the time-averaged spectrum of a spectrumAccumulator in the
+    same format as mpiAnalyzer.spectral_density(), with the number of
+    averaged snapshots appended to the metadata line.
+    """
+    Ek = acc.mean()
+    if mA.comm.rank == 0:
+        with open('%s%s%s.spectra' % (mA.odir, mA.prefix, fname), 'w') as fh:
+            fh.write('%s\tsnapshots = %d\n' % (metadata, acc.count))
+            Ek.tofile(fh, sep='\n', format='% .8e')
+
+    return Ek
+
+
 def scalar_analysis(mA, phi, minmax, w, wbar, fname, title, symb):
     """
     Compute all the 'stand-alone' statistics and scalings related to
@@ -317,8 +558,10 @@ def scalar_analysis(mA, phi, minmax, w, wbar, fname, title, symb):
     if fname in ['rho', 'P', 'T', 'Smm', 'Y']:
         mA.spectral_density(phi, fname, '%s PSD\t%s' % (title, Ek_fmt(symb)))
 
-    # insert structure functions, scalar increments, two-point
-    # correlations here.
+    # scalar-increment structure functions up to half the domain size
+    rs = np.unique(np.geomspace(1, mA.nx[0]//2, 16).astype(int))
+    mA.structure_functions(phi, rs, fname=fname,
+                           metadata='%s increments\t%s' % (title, symb))
 
     return
 
@@ -355,14 +598,22 @@ def vector_analysis(mA, v, minmax, w, wbar, fname, title, symb):
 
     Ek_fmt = "\widehat{{{0}}}^*\widehat{{{0}}}".format
 
-    # vector components analyzed
-    mA.mpi_histogram1(v.copy(), fname, '%s\t%s' % (xlabel, ylabel), minmax,
-                      100, wvec, wbar, norm=3.0)
+    # vector and vector components analyzed, in one batch of histograms
+    fields = {fname: v}
+    weights = {fname: wvec}
+    for i in range(3):
+        fields['%s%d' % (fname, i+1)] = v[i]
+        weights['%s%d' % (fname, i+1)] = w
+    mA.mpi_histograms(fields, '%s\t%s' % (xlabel, ylabel), minmax, 100,
+                      weights)
     mA.spectral_density(v, fname, '%s PSD\t%s' % (title, Ek_fmt(symb)))
     mA.write_mpi_moments(v, title, symb, wvec, wbar, m1=0, norm=3.0)
 
-    # insert structure functions, scalar increments, two-point
-    # correlations here.
+    # longitudinal structure functions up to half the domain size
+    rs = np.unique(np.geomspace(1, mA.nx[0]//2, 16).astype(int))
+    mA.structure_functions(v, rs, fname=fname,
+                           metadata='%s longitudinal increments\t%s'
+                           % (title, symb))
 
     return
 
@@ -407,8 +658,15 @@ def gradient_analysis(mA, A, minmax, w, wbar, fname, title, symb):
 
     symb += '_{ij}'
 
-    mA.mpi_histogram1(A.copy(), fname, '%s\t%s' % (xlabel, ylabel),
-                      minmax, 100, W, wbar, norm=9.0)
+    # tensor and tensor components analyzed, in one batch of histograms
+    fields = {fname: A}
+    weights = {fname: W}
+    for j in range(3):
+        for i in range(3):
+            fields['%s%d%d' % (fname, i+1, j+1)] = A[j, i]
+            weights['%s%d%d' % (fname, i+1, j+1)] = w
+    mA.mpi_histograms(fields, '%s\t%s' % (xlabel, ylabel), minmax, 100,
+                      weights)
 
     # Aii = np.einsum('ii...', A)
     # I = np.identity(3)/3.0
@@ -449,7 +707,11 @@ time_group.add_argument('--cfl', type=float, default=0.5, help='CFL number')
 time_group.add_argument('-t', '--tlimit', type=float, default=np.inf,
                         help='solution time limit')
 time_group.add_argument('-w', '--twall', type=float,
-                        help='run wall-time limit (ignored for now!!!)')
+                        help=('run wall-time limit in hours, the run '
+                              'stops early with a final checkpoint'))
+time_group.add_argument('--profile', type=int, default=0, metavar='NSTEPS',
+                        help=('enable the per-phase timers and report them '
+                              'every NSTEPS steps and at the end of the run'))
 
 init_group = hit_parser.add_argument_group('initial condition arguments')
 
@@ -496,6 +758,12 @@ anlzr_group.add_argument('--dt_stat', type=float,
 anlzr_group.add_argument('--dt_spec', type=float,
                          help='time between isotropic power spectral density'
                               ' outputs')
+anlzr_group.add_argument('--t_avg', type=float,
+                         help=('simulation time at which the running '
+                               'time-averaged spectra start, default = 6*tau'))
+anlzr_group.add_argument('--insitu', type=int, default=0, metavar='NTASKS',
+                         help=('number of MPI tasks split off from the solver '
+                               'to run the analysis and data outputs in-situ'))
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,331 @@
+"""
+ensembleLES: an ensemble (multi-realisation) extension of the spectralLES
+pure-Python pseudo-spectral large eddy simulation solver.
+
+Description:
+============
+LES model development requires many small realisations that differ only
+in their random seed or model constants. Running each realisation as a
+separate MPI job wastes startup time and leaves cores under-used, since
+transforms on small grids cannot saturate a node.
+
+ensembleLES splits the input communicator into `ngroups` sub-
+communicators, and each group of tasks advances `nens//ngroups`
+ensemble members together. Every solver array carries a leading
+ensemble-member axis, such that `U_hat.shape = (nens, 3, nz, nny, nk)`,
+and all transforms and global reductions are batched across the local
+members, so that every member of a group shares the same Alltoall calls
+and the same timestep.
+
+Notes:
+======
+The ensemble members of a group share a single timestep, which is the
+minimum over all of the members.
+
+Authors:
+========
+Colin Towery (colin.towery@colorado.edu)
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+https://github.com/teslacu/spectralLES.git
+"""
+from mpi4py import MPI
+import numpy as np
+from math import sqrt
+import argparse
+
+from teslacu.fft import rfft3, irfft3   # FFT transforms
+from teslacu.stats import gsum          # statistical functions
+from teslacu.misc import timers         # per-phase profiling timers
+
+from .spectralLES import spectralLES
+
+
+class ensembleLES(spectralLES):
+    """
+    Class Variables:
+        parser: spectralLES.parser extended with ensemble arguments
+
+    Class Constructor:
+
+        Regular Arguments:
+            comm: the parent communicator, split into ngroups groups
+            N:
+            L:
+            nu:
+            epsilon:
+            Gtype:
+
+        Optional Keyword Arguments:
+            nens: total number of ensemble members (all groups)
+            ngroups: number of sub-communicator groups
+            (all remaining spectralLES keyword arguments)
+    """
+
+    # Class Variables ---------------------------------------------------------
+    parser = argparse.ArgumentParser(prog='ensembleLES', add_help=False,
+                                     parents=[spectralLES.parser])
+
+    parser.description = ('an ensemble (multi-realisation) mode of '
+                          'spectralLES, %s' % spectralLES.parser.description)
+
+    _ensemble_group = parser.add_argument_group(
+                        'ensemble configuration arguments')
+
+    _ensemble_group.add_argument('--nens', type=int, default=1,
+                                 help='total number of ensemble members')
+    _ensemble_group.add_argument('--ngroups', type=int, default=1,
+                                 help=('number of sub-communicator groups '
+                                       'that the ensemble is split across'))
+
+    # Class Constructor -------------------------------------------------------
+    def __init__(self, comm, N, L, nu, epsilon, Gtype, nens=1, ngroups=1,
+                 **kwargs):
+
+        if comm.size % ngroups > 0 or nens % ngroups > 0:
+            raise ValueError('ensembleLES: both comm.size and nens must be '
+                             'divisible by ngroups')
+
+        # split the parent communicator into groups of tasks -----------
+        self.world_comm = comm
+        self.ngroups = ngroups
+        self.group = comm.rank//(comm.size//ngroups)
+        group_comm = comm.Split(self.group, comm.rank)
+
+        self.nens = nens//ngroups
+        self.members = np.arange(self.nens) + self.group*self.nens
+        self.ens_shape = (self.nens, 1, 1, 1, 1)  # per-member broadcasting
+
+        # First: call spectralLES.__init__() on the group communicator
+        super().__init__(group_comm, N, L, nu, epsilon, Gtype, **kwargs)
+
+        # Second: replace the solver memory with batched ensemble memory
+        nnz, ny, nx = self.nnx
+        nz, nny, nk = self.nnk
+        ne = self.nens
+
+        # real vector field memory
+        self.U = np.empty((ne, 3, nnz, ny, nx), dtype=self.ftype)
+        self.W = np.empty_like(self.U)           # work vector
+        self.omega = self.W                      # vorticity
+
+        # complex vector field memory
+        self.U_hat = np.empty((ne, 3, nz, nny, nk), dtype=self.ctype)
+        self.W_hat = np.empty_like(self.U_hat)   # work vector
+        self.dU = np.empty_like(self.U_hat)      # RHS accumulator
+
+        # RK4 registers are always double precision
+        self.U_hat0= np.empty_like(self.U_hat, dtype=np.complex128)
+        self.U_hat1= np.empty_like(self.U_hat, dtype=np.complex128)
+
+        # real tensor field memory
+        self.A = np.empty((ne, 3, 3, nnz, ny, nx), dtype=self.ftype)
+
+        # each group writes its own restart checkpoints
+        self.chk_prefix = 'Checkpoint_g%3.3d' % self.group
+
+    # Instance Methods --------------------------------------------------------
+    def member_sum(self, data):
+        """
+        Returns the global sum of each local ensemble member of data as
+        an array of shape (nens, ). Sums are always accumulated in double
+        precision.
+        """
+        with timers('gsum'):
+            msum = gsum(self.comm, data, batch=True)
+
+        return msum
+
+    def initialize_Taylor_Green_vortex(self):
+        """
+        Generates the Taylor-Green vortex velocity initial condition
+        for every ensemble member
+        """
+        self.U[:, 0] = np.sin(self.X[0])*np.cos(self.X[1])*np.cos(self.X[2])
+        self.U[:, 1] =-np.cos(self.X[0])*np.sin(self.X[1])*np.cos(self.X[2])
+        self.U[:, 2] = 0.0
+        rfft3(self.comm, self.U, self.U_hat)
+
+        return
+
+    def compute_random_HIT_spectrum(self, kexp, kpeak, rseed=None):
+        """
+        Same as spectralLES.compute_random_HIT_spectrum, except that
+        rseed may also be a sequence of seeds, one per ensemble member
+        of the whole ensemble (any integer type). Each member then
+        reproduces a stand-alone spectralLES field generated with that
+        seed on as many tasks as a group.
+        """
+        if not np.iterable(rseed):
+            return super().compute_random_HIT_spectrum(kexp, kpeak, rseed)
+
+        W_hat = self.W_hat
+        for m, member in enumerate(self.members):
+            self.W_hat = W_hat[m]
+            super().compute_random_HIT_spectrum(kexp, kpeak,
+                                               int(rseed[member]))
+        self.W_hat = W_hat
+
+        return
+
+    def initialize_HIT_random_spectrum(self, Einit=None, kexp=-5./6.,
+                                       kpeak=None, rseed=None):
+        """
+        Generates a random, incompressible, velocity initial condition
+        with a scaled Gamie-Ostriker isotropic turbulence spectrum for
+        every ensemble member
+        """
+        if Einit is None:
+            Einit = 0.72*(self.epsilon*self.L.max())**(2./3.)
+            # the constant of 0.72 is empirically-based
+        if kpeak is None:
+            a = self.L/self.L.min()         # domain size aspect ratios
+            kpeak = np.max((self.nx//8)/a)  # this gives kmax/4
+
+        self.compute_random_HIT_spectrum(kexp, kpeak, rseed)
+
+        # Solenoidally-project, U_hat*(1-ki*kj/k^2)
+        self.W_hat -= np.sum(self.W_hat*self.K_Ksq, axis=1,
+                             keepdims=True)*self.K
+
+        # - Third, scale each member to Einit
+        irfft3(self.comm, self.W_hat, self.U)
+
+        Urms = sqrt(2.0*Einit)
+        U2 = self.member_sum(np.square(self.U, dtype=np.float64))
+        scale = Urms*np.sqrt(self.Nx/U2)
+        self.U *= scale.reshape(self.ens_shape)
+
+        # transform to finish initial conditions
+        rfft3(self.comm, self.U, self.U_hat)
+
+        return
+
+    @timers.timed()
+    def computeSource_HIT_random_forcing(self, rseed=None, **ignored):
+        """
+        Source function to be added to ensembleLES solver instance
+
+        Takes one keyword argument:
+        rseed: (positive integer or sequence, optional), changes the
+            random seed(s) of the pseudo-RNG inside the np.random module
+
+        Returns the array of per-member dvScale values
+        """
+        self.compute_random_HIT_spectrum(-5./3., self.nk[-1], rseed)
+        self.W_hat *= self.hit_filter
+
+        irfft3(self.comm, self.W_hat, self.W)
+        dvScale = self.epsilon/self.member_sum(
+                            np.multiply(self.W, self.U, dtype=np.float64))
+
+        self.W_hat *= dvScale.reshape(self.ens_shape)
+        self.dU += self.W_hat
+
+        return dvScale
+
+    @timers.timed()
+    def computeSource_linear_forcing(self, dvScale=None, computeRHS=True,
+                                     **ignored):
+        """
+        Source function to be added to ensembleLES solver instance
+
+        Takes two keyword arguments:
+        dvScale: (optional) user-provided linear scaling, either a
+            scalar or one value per local ensemble member
+        computeRHS: (default=True) add source term to RHS accumulator
+
+        Returns the array of per-member dvScale values
+        """
+        # Update the HIT forcing function
+        self.W_hat[:] = self.U_hat*self.hit_filter
+
+        if dvScale is None:
+            irfft3(self.comm, self.W_hat, self.W)
+            dvScale = self.epsilon*self.Nx/self.member_sum(
+                            np.multiply(self.U, self.W, dtype=np.float64))
+
+        if computeRHS:
+            self.dU += np.reshape(dvScale, (-1, 1, 1, 1, 1))*self.W_hat
+
+        return dvScale
+
+    @timers.timed()
+    def computeSource_Smagorinksy_SGS(self, Cs=1.2, **ignored):
+        """
+        Smagorinsky Model (takes Cs as input)
+
+        Takes one keyword argument:
+        Cs: (float or sequence, optional), Smagorinsky constant, either
+            shared by all members or one value per local ensemble member
+        """
+        K = self.K
+        self.W_hat[:] = self.les_filter*self.U_hat
+
+        # A[m, j, i] = 0.5*(du_i/dx_j + du_j/dx_i), all 9*nens components
+        # are inverse transformed together
+        irfft3(self.comm, 0.5j*(K[:, None]*self.W_hat[:, None, :]
+                                +K[None, :]*self.W_hat[:, :, None]), self.A)
+
+        # compute SGS flux tensor, nuT = 2|S|(Cs*D)**2
+        nuT = np.sqrt(2.0*np.sum(np.square(self.A), axis=(1, 2)))
+        nuT*= 2.0*(np.reshape(Cs, (-1, 1, 1, 1))*self.D_les)**2
+
+        tau_hat = rfft3(self.comm, self.A*nuT[:, None, None])
+        self.W_hat[:] = 1j*np.sum(K[:, None]*tau_hat, axis=1)
+
+        self.dU += self.W_hat
+
+        return
+
+    @timers.timed()
+    def computeAD_vorticity_form(self, **ignored):
+        """
+        Computes right-hand-side (RHS) advection and diffusion term of
+        the incompressible Navier-Stokes equations using a vorticity
+        formulation for the advection term.
+
+        This function overwrites the previous contents of self.dU and
+        uses self.W_hat as work memory.
+        """
+        K = self.K
+        U_hat = self.U_hat
+        omega_hat = self.W_hat
+
+        # take curl of velocity to get vorticity and inverse transform
+        omega_hat[:, 0] = 1j*(K[1]*U_hat[:, 2] - K[2]*U_hat[:, 1])
+        omega_hat[:, 1] = 1j*(K[2]*U_hat[:, 0] - K[0]*U_hat[:, 2])
+        omega_hat[:, 2] = 1j*(K[0]*U_hat[:, 1] - K[1]*U_hat[:, 0])
+        irfft3(self.comm, omega_hat, self.omega)
+
+        # compute convective transport as the physical-space cross-product of
+        # vorticity and velocity and forward transform
+        rfft3(self.comm, np.cross(self.U, self.omega, axis=1), self.dU)
+
+        # Compute the diffusive transport term and add to the convective term
+        self.dU -= self.nu*self.Ksq*self.U_hat
+
+        return
+
+    def new_dt_constant_nu(self, cfl):
+        """
+        Returns the CFL-limited timestep shared by all local members
+        """
+        umax = np.max(self.U, axis=(0, 2, 3, 4))
+        with timers('Allreduce'):
+            self.comm.Allreduce(MPI.IN_PLACE, umax, op=MPI.MAX)
+
+        dtMinHydro = cfl*np.min(self.dx/umax)
+        dtMinDiff = min(self.dx)**2/(2.0*self.nu)
+        dtMin = min(dtMinHydro, dtMinDiff)
+        if dtMinDiff < dtMinHydro:
+            if self.comm.rank == 0:
+                print("timestep limited by diffusion! {} {}"
+                      .format(dtMinHydro, dtMinDiff))
+
+        return dtMin
+
+###############################################################################
@@ -0,0 +1,187 @@
+"""
+insituLink: offloads in-situ analysis of spectralLES snapshots to a
+dedicated group of MPI tasks.
+
+Description:
+============
+Spectra, histograms, and data-file outputs block every solver task while
+they run. An insituLink splits the last `nanalysis` tasks of a
+communicator off into an analysis group that is connected to the solver
+group by an MPI intercommunicator. Solver tasks hand off their U_hat
+slabs with non-blocking sends from a double buffer and go straight back
+to time stepping, while the analysis tasks receive each snapshot,
+re-assembled into their own (wider) spectral slabs, and run the
+mpiAnalyzer pipeline asynchronously.
+
+Notes:
+======
+The number of solver tasks must be an integer multiple of the number of
+analysis tasks. Each analysis task receives the contiguous spectral
+slabs of nsolver//nanalysis solver tasks, so that the analysis group
+holds the same 1D slab decomposition as the solver, only with fewer
+tasks.
+
+A solver task only blocks in send() if the analysis group is still
+receiving the snapshot handed off two calls before.
+
+Authors:
+========
+Colin Towery (colin.towery@colorado.edu)
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+https://github.com/teslacu/spectralLES.git
+"""
+from mpi4py import MPI
+import numpy as np
+
+__all__ = ['insituLink']
+
+
+class insituLink(object):
+    """
+    Class Constructor:
+
+        Regular Arguments:
+            comm: MPI communicator to split, usually MPI.COMM_WORLD
+            nanalysis: number of tasks (the last of comm) dedicated to
+                analysis
+
+    Attributes:
+    -----------
+        comm: local communicator of this task's group (solver or analysis)
+        intercomm: intercommunicator between the two groups
+        analysis: True on the analysis tasks
+
+    Example:
+    --------
+        link = insituLink(MPI.COMM_WORLD, 2)
+        if link.analysis:
+            for info, U_hat in link:
+                ...  # analyse the snapshot on link.comm
+        else:
+            solver = spectralLES(link.comm, ...)
+            ...
+            link.send(solver.U_hat, tstep=tstep)
+            ...
+            link.close()
+    """
+
+    _tag = 4242
+
+    def __init__(self, comm, nanalysis):
+
+        nsolver = comm.size - nanalysis
+        if nanalysis < 1 or nsolver < 1 or nsolver % nanalysis > 0:
+            raise ValueError('the number of solver tasks must be a positive '
+                             'multiple of the number of analysis tasks')
+
+        self.analysis = comm.rank >= nsolver
+        self.comm = comm.Split(int(self.analysis), comm.rank)
+
+        if self.analysis:
+            self.intercomm = self.comm.Create_intercomm(0, comm, 0, self._tag)
+        else:
+            self.intercomm = self.comm.Create_intercomm(0, comm, nsolver,
+                                                        self._tag)
+
+        self.nsolver = nsolver
+        self.nanalysis = nanalysis
+        self.ratio = nsolver//nanalysis
+
+        if self.analysis:
+            # solver tasks whose slabs this analysis task receives
+            first = self.comm.rank*self.ratio
+            self.sources = list(range(first, first+self.ratio))
+        else:
+            self.dest = self.comm.rank//self.ratio
+            self._buffers = [None, None]
+            self._requests = [[], []]
+            self._count = 0
+
+        self._closed = False
+
+    # Solver-side Methods -----------------------------------------------------
+
+    def send(self, U_hat, **info):
+        """
+        Hands off a copy of the local slab of U_hat, along with the
+        keyword metadata `info`, to this task's analysis task without
+        waiting for the transfer to complete.
+
+        Arguments:
+        ----------
+        U_hat: local spectral-space slab, shape (..., nz, nny, nk)
+        info: metadata passed to the analysis tasks with the snapshot
+        """
+        slot = self._count % 2
+        MPI.Request.Waitall(self._requests[slot])
+
+        buf = self._buffers[slot]
+        if buf is None or buf.shape != U_hat.shape or buf.dtype != U_hat.dtype:
+            buf = self._buffers[slot] = np.empty_like(U_hat)
+        buf[...] = U_hat
+
+        header = dict(info, shape=U_hat.shape, dtype=U_hat.dtype.str)
+        self._requests[slot] = [
+            self.intercomm.isend(header, dest=self.dest, tag=self._tag),
+            self.intercomm.Isend(buf, dest=self.dest, tag=self._tag)]
+        self._count += 1
+
+        return
+
+    def close(self):
+        """
+        Solver tasks: tells the analysis tasks that no more snapshots are
+        coming and waits for every outstanding transfer to complete.
+        """
+        if self.analysis or self._closed:
+            return
+
+        req = self.intercomm.isend(None, dest=self.dest, tag=self._tag)
+        MPI.Request.Waitall(self._requests[0] + self._requests[1] + [req])
+        self._buffers = [None, None]
+        self._closed = True
+
+        return
+
+    # Analysis-side Methods ---------------------------------------------------
+
+    def recv(self):
+        """
+        Analysis tasks: receives the next snapshot from this task's solver
+        tasks and returns (info, U_hat), where U_hat is the re-assembled
+        spectral slab of this analysis task, or None once the solver has
+        closed the link.
+        """
+        info = None
+        slabs = []
+        for src in self.sources:
+            header = self.intercomm.recv(source=src, tag=self._tag)
+            if header is None:
+                self._closed = True
+                continue
+            slab = np.empty(header.pop('shape'),
+                            dtype=np.dtype(header.pop('dtype')))
+            self.intercomm.Recv(slab, source=src, tag=self._tag)
+            slabs.append(slab)
+            info = header
+
+        if self._closed:
+            return None
+
+        # the solver slabs are contiguous in the y-wavenumber axis
+        U_hat = np.concatenate(slabs, axis=-2)
+
+        return info, U_hat
+
+    def __iter__(self):
+        while True:
+            snapshot = self.recv()
+            if snapshot is None:
+                return
+            yield snapshot
+
+###############################################################################
@@ -0,0 +1,132 @@
+"""
+runController: a wall-time aware run controller for spectralLES drivers.
+
+Description:
+============
+Batch jobs are killed by the scheduler when their allocation expires,
+losing every time step since the last restart checkpoint. A
+runController measures the wall time of each time step and tells the
+driver to stop (and write a final checkpoint) while there is still
+enough time left to do so cleanly. It also catches the SIGTERM and
+SIGUSR1 signals that most schedulers send shortly before killing a job.
+
+Notes:
+======
+The step timing is measured on task 0 and is combined with every task's
+signal flag in a single small Allreduce per call of `stop()`, so that
+all tasks always agree on whether to stop.
+
+Authors:
+========
+Colin Towery (colin.towery@colorado.edu)
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+https://github.com/teslacu/spectralLES.git
+"""
+from mpi4py import MPI
+import numpy as np
+import signal
+
+__all__ = ['runController']
+
+
+class runController(object):
+    """
+    Class Constructor:
+
+        Regular Arguments:
+            comm: MPI communicator of the solver
+
+        Optional Keyword Arguments:
+            twall: (default=None) run wall-time limit in hours, if None
+                only signals will stop the run
+            reserve: (default=0.05) fraction of twall reserved for the
+                final checkpoint and a clean exit
+            nsafe: (default=2) number of the slowest measured time steps
+                that must still fit before the wall-time limit
+            signals: (default=(SIGTERM, SIGUSR1)) signals that request a
+                clean stop of the run
+            tstart: (default=None) MPI.Wtime() at the start of the job,
+                e.g. taken at the top of the driver, so that the setup
+                time (solver construction, reading restart files, etc.)
+                is charged against twall. If None, twall is measured
+                from the construction of the controller and excludes
+                all setup time.
+
+    Example:
+    --------
+        tstart = MPI.Wtime()
+        ...
+        controller = runController(comm, twall=pp.twall, tstart=tstart)
+        while t_sim < tlimit:
+            if controller.stop():
+                break
+            ...
+    """
+
+    def __init__(self, comm, twall=None, reserve=0.05, nsafe=2,
+                 signals=(signal.SIGTERM, getattr(signal, 'SIGUSR1', None)),
+                 tstart=None):
+
+        self.comm = comm
+        self.twall = None if twall is None else 3600.0*twall  # seconds
+        self.reserve = reserve
+        self.nsafe = nsafe
+
+        self.nsteps = 0
+        self.tstep = 0.0    # most recent step wall time (task 0)
+        self.tstep_max = 0.0
+        self.elapsed = 0.0
+        self.reason = None
+
+        self._signum = 0
+        for signum in signals:
+            if signum is not None:
+                signal.signal(signum, self._handler)
+
+        # only task 0's clock is used, see stop()
+        self._tlast = MPI.Wtime()
+        self._tstart = self._tlast if tstart is None else tstart
+
+    def _handler(self, signum, frame):
+        self._signum = signum
+
+    def stop(self):
+        """
+        Call once per time step. Returns True on every task once the
+        run should stop, either because another nsafe time steps plus
+        the reserved time would exceed the wall-time limit or because a
+        stop signal was received by any task.
+        """
+        state = np.zeros(3)   # [step time, elapsed time, signal number]
+        if self.comm.rank == 0:
+            tnow = MPI.Wtime()
+            state[0] = tnow - self._tlast
+            state[1] = tnow - self._tstart
+            self._tlast = tnow
+        state[2] = self._signum
+
+        # only task 0 contributes timings, so MAX acts as a broadcast
+        self.comm.Allreduce(MPI.IN_PLACE, state, op=MPI.MAX)
+
+        if self.nsteps > 0:  # first call only starts the step clock
+            self.tstep = state[0]
+            self.tstep_max = max(self.tstep_max, self.tstep)
+        self.elapsed = state[1]
+        self.nsteps += 1
+
+        if state[2] > 0:
+            self.reason = 'received signal %d' % state[2]
+
+        elif self.twall is not None:
+            tneeded = self.nsafe*self.tstep_max + self.reserve*self.twall
+            if self.elapsed + tneeded > self.twall:
+                self.reason = ('wall-time limit of %.2f hours reached'
+                               % (self.twall/3600.0))
+
+        return self.reason is not None
+
+###############################################################################
@@ -61,9 +61,15 @@ from mpi4py import MPI
 import numpy as np
 from math import sqrt, pi
 import argparse
+import os
+import pickle
+import struct
 
 from teslacu.fft import rfft3, irfft3   # FFT transforms
-from teslacu.stats import psum          # statistical functions
+from teslacu.stats import gsum          # statistical functions
+from teslacu.misc import timers         # per-phase profiling timers
+
+from ._rk_kernels import rk4_stage_update  # fused RK4 stage kernel
 
 
 class LoadInputFile(argparse.Action):
@@ -122,6 +128,10 @@ class spectralLES(object):
             k_test:
             kfLow:
             kfHigh:
+            precision: 'double' (default) or 'single'. Single precision
+                stores the solver state and work arrays as float32 and
+                complex64, while global reductions and the RK4
+                accumulation registers (U_hat0, U_hat1) stay in float64.
     """
 
     # Class Variables ---------------------------------------------------------
@@ -162,6 +172,10 @@ class spectralLES(object):
                                help='cutoff wavenumber of LES filter')
     _solver_group.add_argument('--k_test', type=int,
                                help='cutoff wavenumber of test filter')
+    _solver_group.add_argument('--precision', type=str, default='double',
+                               choices=['single', 'double'],
+                               help=('floating-point precision of the solver '
+                                     'state and work arrays'))
 
     # Class Constructor -------------------------------------------------------
     def __init__(self, comm, N, L, nu, epsilon, Gtype, **kwargs):
@@ -203,6 +217,20 @@ class spectralLES(object):
         # may store them in the solver instance for use later
         self.kfHigh = kwargs.pop('kfHigh', None)
         self.kfLow = kwargs.pop('kfLow', None)
+
+        precision = kwargs.pop('precision', None) or 'double'
+        if precision == 'single':
+            self.ftype = np.float32
+            self.ctype = np.complex64
+        elif precision == 'double':
+            self.ftype = np.float64
+            self.ctype = np.complex128
+        else:
+            raise ValueError('did not understand precision')
+
+        # file prefix of restart checkpoints and their index file
+        self.chk_prefix = 'Checkpoint'
+
         for name in kwargs:
             setattr(self, name, kwargs[name])
 
@@ -251,23 +279,29 @@ class spectralLES(object):
         k0 = np.fft.fftfreq(self.nx[0])*self.nx[0]
         k1 = np.fft.fftfreq(self.nx[1])[self.iks[1]:self.ike[1]]*self.nx[1]
         k2 = np.fft.rfftfreq(self.nx[2])*self.nx[2]
-        self.K = np.array(np.meshgrid(k0, k1, k2, indexing='ij'), dtype=int)
+        self.K = np.array(np.meshgrid(k0, k1, k2, indexing='ij'),
+                          dtype=self.ftype)
 
         self.Ksq = np.sum(np.square(self.K), axis=0)
         self.K_Ksq = self.K * np.where(self.Ksq==0, 1.0,
                                        self.Ksq.astype(np.float64))**-1
+        self.K_Ksq = self.K_Ksq.astype(self.ftype)
 
         # -- MPI Local subdomain filter kernel arrays
-        self.dealias = self.filter_kernel(int(sqrt(2)*self.nx.min()/3))
-        self.les_filter = self.filter_kernel(self.k_les, Gtype)
-        self.test_filter = self.filter_kernel(self.k_test, Gtype)
+        ctype = self.ctype
+        self.dealias = self.filter_kernel(int(sqrt(2)*self.nx.min()/3),
+                                          dtype=ctype)
+        self.les_filter = self.filter_kernel(self.k_les, Gtype, dtype=ctype)
+        self.test_filter = self.filter_kernel(self.k_test, Gtype, dtype=ctype)
 
         if self.kfHigh or self.kfLow:
             self.hit_filter = np.ones_like(self.les_filter)
             if self.kfHigh:
-                self.hit_filter *= self.filter_kernel(self.kfHigh)
+                self.hit_filter *= self.filter_kernel(self.kfHigh,
+                                                      dtype=ctype)
             if self.kfLow:
-                self.hit_filter *= 1.0 - self.filter_kernel(self.kfLow)
+                self.hit_filter *= 1.0 - self.filter_kernel(self.kfLow,
+                                                            dtype=ctype)
         else:
             self.hit_filter = 1.0
 
@@ -276,19 +310,21 @@ class spectralLES(object):
         nz, nny, nk = self.nnk
 
         # real vector field memory
-        self.U = np.empty((3, nnz, ny, nx))     # solution vector
+        self.U = np.empty((3, nnz, ny, nx), dtype=self.ftype)  # solution
         self.W = np.empty_like(self.U)          # work vector
         self.omega = self.W                     # vorticity
 
         # complex vector field memory
-        self.U_hat = np.empty((3, nz, nny, nk), dtype=complex)
-        self.U_hat0= np.empty_like(self.U_hat)
-        self.U_hat1= np.empty_like(self.U_hat)
+        self.U_hat = np.empty((3, nz, nny, nk), dtype=self.ctype)
         self.W_hat = np.empty_like(self.U_hat)  # work vector
         self.dU = np.empty_like(self.U_hat)     # RHS accumulator
 
+        # RK4 registers are always double precision
+        self.U_hat0= np.empty_like(self.U_hat, dtype=np.complex128)
+        self.U_hat1= np.empty_like(self.U_hat, dtype=np.complex128)
+
         # real and complex tensor field memory
-        self.A = np.empty((3, 3, nnz, ny, nx))
+        self.A = np.empty((3, 3, nnz, ny, nx), dtype=self.ftype)
         # self.A_hat = np.empty((3, 3, nz, nny, nk), dtype=complex)
 
     # Object-Handling Methods -------------------------------------------------
@@ -430,7 +466,8 @@ class spectralLES(object):
         irfft3(self.comm, self.W_hat[2], self.U[2])
 
         Urms = sqrt(2.0*Einit)
-        self.U *= Urms*sqrt(self.Nx/self.comm.allreduce(psum(self.U**2)))
+        self.U *= Urms*sqrt(self.Nx/gsum(self.comm, np.square(
+                                                self.U, dtype=np.float64)))
 
         # transform to finish initial conditions
         rfft3(self.comm, self.U[0], self.U_hat[0])
@@ -439,6 +476,7 @@ class spectralLES(object):
 
         return
 
+    @timers.timed()
     def computeSource_HIT_random_forcing(self, rseed=None, **ignored):
         """
         Source function to be added to spectralLES solver instance
@@ -453,13 +491,16 @@ class spectralLES(object):
         irfft3(self.comm, self.W_hat[0], self.W[0])
         irfft3(self.comm, self.W_hat[1], self.W[1])
         irfft3(self.comm, self.W_hat[2], self.W[2])
-        dvScale = self.epsilon/self.comm.allreduce(psum(self.W*self.U))
+        with timers('gsum'):
+            dvScale = self.epsilon/gsum(self.comm, np.multiply(
+                                        self.W, self.U, dtype=np.float64))
 
         self.W_hat *= dvScale
         self.dU += self.W_hat
 
         return dvScale
 
+    @timers.timed()
     def computeSource_linear_forcing(self, dvScale=None, computeRHS=True,
                                      **ignored):
         """
@@ -478,14 +519,16 @@ class spectralLES(object):
             irfft3(self.comm, self.W_hat[0], self.W[0])
             irfft3(self.comm, self.W_hat[1], self.W[1])
             irfft3(self.comm, self.W_hat[2], self.W[2])
-            dvScale = self.epsilon*self.Nx/self.comm.allreduce(
-                                                        psum(self.U*self.W))
+            with timers('gsum'):
+                dvScale = self.epsilon*self.Nx/gsum(self.comm, np.multiply(
+                                        self.U, self.W, dtype=np.float64))
 
         if computeRHS:
             self.dU += dvScale*self.W_hat
 
         return dvScale
 
+    @timers.timed()
     def computeSource_Smagorinksy_SGS(self, Cs=1.2, **ignored):
         """
         Smagorinsky Model (takes Cs as input)
@@ -514,6 +557,7 @@ class spectralLES(object):
 
         return
 
+    @timers.timed()
     def computeAD_vorticity_form(self, **ignored):
         """
         Computes right-hand-side (RHS) advection and diffusion term of
@@ -546,9 +590,10 @@ class spectralLES(object):
 
     def new_dt_constant_nu(self, cfl):
         u1m = u2m = u3m = 0.0
-        u1m = self.comm.allreduce(np.max(self.U[0]), op=MPI.MAX)
-        u2m = self.comm.allreduce(np.max(self.U[1]), op=MPI.MAX)
-        u3m = self.comm.allreduce(np.max(self.U[2]), op=MPI.MAX)
+        with timers('Allreduce'):
+            u1m = self.comm.allreduce(np.max(self.U[0]), op=MPI.MAX)
+            u2m = self.comm.allreduce(np.max(self.U[1]), op=MPI.MAX)
+            u3m = self.comm.allreduce(np.max(self.U[2]), op=MPI.MAX)
 
         dtMinHydro = cfl*min(self.dx[0]/u1m, self.dx[1]/u2m, self.dx[2]/u3m)
         dtMinDiff = min(self.dx)**2/(2.0*self.nu)
@@ -560,6 +605,7 @@ class spectralLES(object):
 
         return dtMin
 
+    @timers.timed()
     def RK4_integrate(self, dt, *Sources, **kwargs):
         """
         4th order Runge-Kutta time integrator for spectralLES
@@ -583,33 +629,160 @@ class spectralLES(object):
 
         for rk in range(4):
 
-            irfft3(self.comm, self.U_hat[0], self.U[0])
-            irfft3(self.comm, self.U_hat[1], self.U[1])
-            irfft3(self.comm, self.U_hat[2], self.U[2])
+            with timers('RK4.transform'):
+                irfft3(self.comm, self.U_hat, self.U)
 
-            self.computeAD(**kwargs)
-            for computeSource in Sources:
-                computeSource(**kwargs)
+            with timers('RK4.computeAD'):
+                self.computeAD(**kwargs)
 
-            # Filter the nonlinear contributions to the RHS
-            self.dU *= self.dealias
+            with timers('RK4.Sources'):
+                for computeSource in Sources:
+                    computeSource(**kwargs)
 
-            # Apply the Leray-Hopf projection operator (1 - Helmholtz
+            # Filter the nonlinear contributions to the RHS, then apply
+            # the Leray-Hopf projection operator (1 - Helmholtz
             # operator) to filtered nonlinear contributions in order to
             # enforce the divergence-free continuity condition.
             # This operation is equivalent to computing the pressure
             # field using a physical-space pressure-Poisson solver and
             # then adding the pressure-gradient transport term to the RHS.
-            self.dU -= np.sum(self.dU*self.K_Ksq, axis=0)*self.K
+            # Finally, update the stage solution and the RK4 accumulator.
+            # All four operations are fused into a single threaded sweep
+            # when numba is available (see _rk_kernels.py).
+            with timers('RK4.stage_update'):
+                rk4_stage_update(self.dU, self.U_hat, self.U_hat0,
+                                 self.U_hat1, self.dealias, self.K,
+                                 self.K_Ksq, a[rk]*dt,
+                                 b[rk]*dt if rk < 3 else None)
+
+        with timers('RK4.transform'):
+            irfft3(self.comm, self.U_hat, self.U)
 
-            if rk < 3:
-                self.U_hat[:] = self.U_hat0 + b[rk]*dt*self.dU
-            self.U_hat1[:] += a[rk]*dt*self.dU
+        return
 
-        irfft3(self.comm, self.U_hat[0], self.U[0])
-        irfft3(self.comm, self.U_hat[1], self.U[1])
-        irfft3(self.comm, self.U_hat[2], self.U[2])
+    # Checkpoint/Restart Methods ----------------------------------------------
+    _chk_magic = b'sLES-chk'
 
-        return
+    def write_checkpoint(self, odir, irst, **metadata):
+        """
+        Write a restart checkpoint of the solver state to the file
+        odir/<chk_prefix>_<irst>.rst and append it to the checkpoint
+        index file, odir/<chk_prefix>.index.
+
+        The checkpoint holds the spectral-space solution, U_hat, the
+        state of every task's np.random RNG, and any run metadata passed
+        in as keyword arguments (e.g. simulation time, output counters,
+        and dvScale). All tasks write their U_hat slab and task 0 also
+        writes the metadata header in one collective MPI-IO write.
+
+        Returns the checkpoint file name.
+        """
+        comm = self.comm
+        fname = '%s_%3.3d.rst' % (self.chk_prefix, irst)
+        U_hat = np.ascontiguousarray(self.U_hat)
+        rng_states = comm.gather(np.random.get_state())
+
+        if comm.rank == 0:
+            metadata.update(nx=self.nx, L=self.L, nu=self.nu,
+                            epsilon=self.epsilon, ntasks=comm.size,
+                            shape=U_hat.shape, dtype=U_hat.dtype.str,
+                            rng_states=rng_states)
+            header = pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL)
+            header = self._chk_magic + struct.pack('<Q', len(header)) + header
+
+            os.makedirs(odir, exist_ok=True)
+            if os.path.exists(odir+fname):
+                os.remove(odir+fname)
+        else:
+            header = None
+
+        hsize = comm.bcast(len(header) if comm.rank == 0 else None)
+
+        if comm.rank == 0:
+            buf = np.empty(hsize + U_hat.nbytes, dtype=np.uint8)
+            buf[:hsize] = np.frombuffer(header, dtype=np.uint8)
+            buf[hsize:] = U_hat.reshape(-1).view(np.uint8)
+            offset = 0
+        else:
+            buf = U_hat
+            offset = hsize + comm.rank*U_hat.nbytes
+
+        fh = MPI.File.Open(comm, odir+fname, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+        fh.Write_at_all(offset, buf)
+        fh.Close()
+
+        if comm.rank == 0:
+            with open('%s%s.index' % (odir, self.chk_prefix), 'a') as fh:
+                fh.write('%d\t%s\n' % (irst, fname))
+
+        return fname
+
+    def read_checkpoint(self, idir, irst=-1):
+        """
+        Restore the solver state from a checkpoint written by
+        write_checkpoint() and return the run metadata that was saved
+        with it. The physical-space solution, U, is recomputed from
+        U_hat exactly as at the end of RK4_integrate(), so that a
+        restarted run continues bit-for-bit.
+
+        Arguments:
+        ----------
+        idir: directory containing the checkpoints and their index file
+        irst: (default=-1) checkpoint number to restart from, negative
+            numbers index backwards from the last checkpoint in the index
+        """
+        comm = self.comm
+
+        fname = None
+        if comm.rank == 0:
+            try:
+                with open('%s%s.index' % (idir, self.chk_prefix)) as fh:
+                    entries = [line.split() for line in fh if line.strip()]
+                if irst < 0:
+                    fname = entries[irst][1]
+                else:
+                    fname = dict((int(i), f) for i, f in entries)[irst]
+            except (IOError, IndexError, KeyError):
+                pass
+
+        fname = comm.bcast(fname)
+        if fname is None:
+            raise ValueError('could not find checkpoint %d in %s%s.index'
+                             % (irst, idir, self.chk_prefix))
+
+        fh = MPI.File.Open(comm, idir+fname, MPI.MODE_RDONLY)
+
+        preamble = np.empty(16, dtype=np.uint8)
+        fh.Read_at_all(0, preamble)
+        if preamble[:8].tobytes() != self._chk_magic:
+            fh.Close()
+            raise ValueError('%s%s is not a spectralLES checkpoint'
+                             % (idir, fname))
+
+        hsize = struct.unpack('<Q', preamble[8:].tobytes())[0]
+        header = np.empty(hsize, dtype=np.uint8)
+        fh.Read_at_all(16, header)
+        metadata = pickle.loads(header.tobytes())
+
+        if (metadata['ntasks'] != comm.size
+                or tuple(metadata['shape']) != self.U_hat.shape
+                or np.dtype(metadata['dtype']) != self.U_hat.dtype):
+            fh.Close()
+            raise ValueError('checkpoint %s%s does not match the solver '
+                             'configuration or number of MPI tasks'
+                             % (idir, fname))
+
+        offset = 16 + hsize + comm.rank*self.U_hat.nbytes
+        fh.Read_at_all(offset, self.U_hat)
+        fh.Close()
+
+        np.random.set_state(metadata['rng_states'][comm.rank])
+        for key in ['nx', 'L', 'nu', 'epsilon', 'ntasks', 'shape', 'dtype',
+                    'rng_states']:
+            metadata.pop(key)
+
+        irfft3(self.comm, self.U_hat, self.U)
+
+        return metadata
 
 ###############################################################################
@@ -0,0 +1,54 @@
+"""
+Description:
+------------
+Reproducibility checks of the per-member random seeds of ensembleLES.
+
+Run with `python -m pytest spectralLES/test/test_ensemble_seeds.py` or
+`mpiexec -n 2 python spectralLES/test/test_ensemble_seeds.py`.
+
+Authors:
+--------
+Colin Towery, colin.towery@colorado.edu
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+
+from mpi4py import MPI
+import numpy as np
+from spectralLES import spectralLES, ensembleLES
+comm = MPI.COMM_WORLD
+
+N = 16
+L = 2*np.pi
+seeds = 7 + np.arange(2)    # numpy integers, as in HIT_ensemble_test.py
+
+
+def test_member_seeds_match_standalone():
+    ensemble = ensembleLES(comm, N, L, 0.01, 1.0, 'spectral', nens=2)
+    ensemble.compute_random_HIT_spectrum(-5./3., N//4, rseed=seeds)
+
+    for m, rseed in enumerate(seeds):
+        solver = spectralLES(comm, N, L, 0.01, 1.0, 'spectral')
+        solver.compute_random_HIT_spectrum(-5./3., N//4, rseed=int(rseed))
+        assert np.array_equal(ensemble.W_hat[m], solver.W_hat)
+
+
+def test_member_seeds_are_reproducible():
+    U = []
+    for run in range(2):
+        ensemble = ensembleLES(comm, N, L, 0.01, 1.0, 'spectral', nens=2)
+        ensemble.initialize_HIT_random_spectrum(rseed=seeds)
+        U.append(ensemble.U.copy())
+
+    assert np.array_equal(U[0], U[1])
+    assert not np.array_equal(U[0][0], U[0][1])
+
+
+if __name__ == "__main__":
+    test_member_seeds_match_standalone()
+    test_member_seeds_are_reproducible()
+    if comm.rank == 0:
+        print('ensembleLES seed tests passed')
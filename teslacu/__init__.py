@@ -5,6 +5,7 @@ from .mpiWriter import *
 from . import fft
 from . import stats
 from . import diff
-# from misc import
+from . import misc
 
-__all__=['mpiAnalyzer', 'mpiReader', 'mpiWriter', 'fft', 'stats', 'diff']
+__all__=['mpiAnalyzer', 'mpiReader', 'mpiWriter', 'fft', 'stats', 'diff',
+         'misc']
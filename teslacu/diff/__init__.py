@@ -1,5 +1,6 @@
 from . import _akima_numpy_scipy as akima
 from . import _pchip_mpi4py_scipy as pchip
 from . import _findiff_numpy_scipy as central
+from . import _compact_numpy as compact
 
-__all__=['akima', 'pchip', 'central']
+__all__=['akima', 'pchip', 'central', 'compact']
@@ -6,6 +6,16 @@ Assumes 1-D domain decomposition.
 
 Notes:
 ------
+The Akima slopes and interface values are evaluated in closed form for
+all grid lines at once, in blocks of about _chunk points, with the same
+slope formulas as scipy.interpolate.Akima1DInterpolator.
+
+Slopes are undefined where their weight is below 1e-9 times the largest
+weight of the whole grid line. With ghost zones, each task only holds
+part of a line, so the line maxima of the nodes of every task
+(cutoff_scale()) must be combined with a MAX reduction by the caller and
+passed to deriv() as scale, so that the derivative does not depend on
+the domain decomposition.
 
 Definitions:
 ------------
@@ -20,14 +30,82 @@ University of Colorado Boulder
 http://tesla.colorado.edu
 """
 import numpy as _np
-from scipy.interpolate import Akima1DInterpolator as _interp
 
-__all__ = ['deriv']
+__all__ = ['deriv', 'cutoff_scale']
+
+_chunk = 2**16
+
+
+def _midpoints(tmp, scale=None):
+    """
+    Returns the values at the interval midpoints of the Akima splines
+    through every line of tmp along axis 0, for unit grid spacing.
+    The slopes t and the end-slope extrapolation are those of
+    scipy.interpolate.Akima1DInterpolator, including its cutoff of
+    1e-9 times the largest weight of each line (or scale, if given) for
+    undefined slopes.
+    """
+    n = tmp.shape[0]
+
+    # slopes between nodes, with two extrapolated slopes at either end
+    m = _np.empty((n+3, ) + tmp.shape[1:])
+    _np.subtract(tmp[1:], tmp[:-1], out=m[2:-2])
+    m[1] = 2.*m[2] - m[3]
+    m[0] = 2.*m[1] - m[2]
+    m[-2] = 2.*m[-3] - m[-4]
+    m[-1] = 2.*m[-2] - m[-3]
+
+    dm = _np.abs(_np.diff(m, axis=0))
+    f1 = dm[2:]
+    f2 = dm[:-2]
+    f12 = f1 + f2
+    if scale is None:
+        scale = f12.max(axis=0)
+    defined = f12 > 1.e-9*scale
+
+    t = 0.5*(m[3:] + m[:-3])
+    f12[~defined] = 1.0
+    t[defined] = (m[1:-2] + (f2/f12)*(m[2:-1] - m[1:-2]))[defined]
+
+    # cubic Hermite interpolant at the midpoint of each interval
+    return 0.5*(tmp[:-1] + tmp[1:]) + 0.125*(t[:-1] - t[1:])
 
 
-def deriv(phi, h, axis=0):
+def cutoff_scale(phi, bc='periodic', axis=0):
     """
-    deriv(phi, h, axis=0):
+    cutoff_scale(phi, bc='periodic', axis=0):
+
+    Returns the largest Akima weight |m[i+1] - m[i]| + |m[i-1] - m[i-2]|
+    of the nodes of every line of phi along axis, excluding any ghost
+    points, as an array of the shape of phi without axis. For bc =
+    'ghost_zones', the maximum over all tasks is the scale of deriv().
+    """
+    if bc not in ('periodic', 'ghost_zones'):
+        raise ValueError("cutoff_scale(): bc must be 'periodic' or "
+                         "'ghost_zones', not %r" % (bc, ))
+
+    phi = _np.moveaxis(phi, axis, 0)
+    if bc == 'ghost_zones':
+        tmp = phi[1:-1]     # the weights need 2 neighbours on either side
+    else:
+        tmp = _np.concatenate((phi[-2:], phi, phi[:2]), axis=0)
+
+    if tmp.ndim == 1:
+        dm = _np.abs(_np.diff(tmp, n=2))
+        return (dm[2:] + dm[:-2]).max()
+
+    scale = _np.empty(tmp.shape[1:])
+    nb = max(1, _chunk*tmp.shape[1]//tmp.size)
+    for j in range(0, tmp.shape[1], nb):
+        dm = _np.abs(_np.diff(tmp[:, j:j+nb], n=2, axis=0))
+        scale[j:j+nb] = (dm[2:] + dm[:-2]).max(axis=0)
+
+    return scale
+
+
+def deriv(phi, h, bc='periodic', axis=0, scale=None):
+    """
+    deriv(phi, h, bc='periodic', axis=0, scale=None):
 
     deriv computes the k'th derivative of a uniform gridded array along the
     prescribed axis using Akima spline approximation.
@@ -36,36 +114,55 @@ def deriv(phi, h, axis=0):
     ---------
     phi   - input array
     h     - uniform grid spacing
-    bc    -
+    bc    - 'periodic', or 'ghost_zones' if phi includes 3 ghost points on
+            either end of axis, which are not differentiated
     k     - order of the derivative
     axis  -
+    scale - (optional) largest Akima weight of each whole line, of the
+            shape of phi without axis (see cutoff_scale()), which
+            defaults to the maximum over the points of phi
 
     Output
     ------
     f - d^k/dx^k(phi)
     """
+    if bc not in ('periodic', 'ghost_zones'):
+        raise ValueError("deriv(): bc must be 'periodic' or 'ghost_zones', "
+                         "not %r" % (bc, ))
+
     axis = axis % phi.ndim
 
     if axis != 0:
         phi = _np.swapaxes(phi, axis, 0)
+        if scale is not None:
+            scale = _np.moveaxis(scale, 0, axis-1)
 
     s = list(phi.shape)
-    x = _np.arange(-3, s[0]+3, dtype=_np.float64)
-    xi = _np.arange(-0.5, s[0]+0.5, 1.0, dtype=_np.float64)
-    deriv = _np.empty_like(phi)
-
-    s[0] += 6
-    tmp = _np.empty(s, dtype=phi.dtype)
-
-    tmp[3:-3] = phi
-    tmp[:3] = phi[-3:]
-    tmp[-3:] = phi[:3]
-
-    for j in range(s[-2]):
-        for i in range(s[-1]):
-            spline = _interp(x, tmp[..., j, i])
-            phi2 = spline(xi)
-            deriv[..., j, i] = (phi2[1:] - phi2[:-1])*(1.0/h)
+    if bc == 'ghost_zones':
+        s[0] -= 6
+    n = s[0]
+    deriv = _np.empty(s, dtype=phi.dtype)
+
+    if bc == 'ghost_zones':
+        tmp = phi
+    else:
+        s[0] += 6
+        tmp = _np.empty(s, dtype=phi.dtype)
+
+        tmp[3:-3] = phi
+        tmp[:3] = phi[-3:]
+        tmp[-3:] = phi[:3]
+
+    # the midpoints -1/2, ..., n-1/2 lie in the intervals [2, n+3) of tmp
+    if phi.ndim == 1:
+        mid = _midpoints(tmp, scale)[2:n+3]
+        _np.multiply(mid[1:] - mid[:-1], 1.0/h, out=deriv)
+    else:
+        nb = max(1, _chunk*s[1]//tmp.size)
+        for j in range(0, s[1], nb):
+            sj = None if scale is None else scale[j:j+nb]
+            mid = _midpoints(tmp[:, j:j+nb], sj)[2:n+3]
+            deriv[:, j:j+nb] = (mid[1:] - mid[:-1])*(1.0/h)
 
     if axis != 0:
         deriv = _np.swapaxes(deriv, axis, 0)
@@ -0,0 +1,142 @@
+"""
+Compact (Pade) finite difference methods. Package is shared-memory only.
+User must wrap this package with an MPI-parallel data analysis class for
+distributed memory computing.
+Assumes 1-D domain decomposition.
+
+Notes:
+------
+The tridiagonal compact schemes of Lele (J. Comput. Phys. 103, 1992)
+
+    alpha*f'[i-1] + f'[i] + alpha*f'[i+1]
+        = a*(f[i+1] - f[i-1])/(2h) + b*(f[i+2] - f[i-2])/(4h)
+
+have spectral-like resolution for a narrow stencil, but couple every
+point of a grid line, so that each derivative is a periodic (cyclic)
+tridiagonal solve along the entire line. The cyclic system is reduced
+to two tridiagonal systems with the Sherman-Morrison formula, and the
+Thomas algorithm is vectorised over all lines of the array at once.
+The LU factors depend only on the line length and the order and are
+cached.
+
+Definitions:
+------------
+
+Authors:
+--------
+Colin Towery
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+import numpy as _np
+
+__all__ = ['deriv']
+
+# (alpha, a, b) of the tridiagonal schemes
+_schemes = {4: (1./4, 3./2, 0.),
+            6: (1./3, 14./9, 1./9)}
+
+_factors = {}
+
+
+def _cyclic_factors(n, order):
+    """
+    Returns the cached LU factors (cp, inv) of the tridiagonal part of the
+    cyclic matrix tridiag(alpha, 1, alpha) of length n, and the
+    Sherman-Morrison correction vector z and scalar.
+    """
+    key = (n, order)
+    if key not in _factors:
+        alpha = _schemes[order][0]
+        gamma = -1.0
+
+        diag = _np.ones(n)
+        diag[0] -= gamma
+        diag[-1] -= alpha*alpha/gamma
+
+        cp = _np.empty(n)
+        inv = _np.empty(n)
+        inv[0] = 1.0/diag[0]
+        cp[0] = alpha*inv[0]
+        for i in range(1, n):
+            inv[i] = 1.0/(diag[i] - alpha*cp[i-1])
+            cp[i] = alpha*inv[i]
+
+        u = _np.zeros(n)
+        u[0] = gamma
+        u[-1] = alpha
+        z = _thomas(u, alpha, cp, inv)
+        scale = 1.0/(1.0 + z[0] + alpha/gamma*z[-1])
+
+        _factors[key] = (alpha, gamma, cp, inv, z, scale)
+
+    return _factors[key]
+
+
+def _thomas(r, alpha, cp, inv):
+    """
+    Solves tridiag(alpha, diag, alpha) x = r in place along axis 0 of r,
+    for every line at once, given the LU factors cp and inv.
+    """
+    n = r.shape[0]
+    r[0] *= inv[0]
+    for i in range(1, n):
+        r[i] -= alpha*r[i-1]
+        r[i] *= inv[i]
+    for i in range(n-2, -1, -1):
+        r[i] -= cp[i]*r[i+1]
+
+    return r
+
+
+def deriv(phi, h, order=6, axis=0):
+    """
+    deriv(phi, h, order=6, axis=0):
+
+    deriv computes the first derivative of a periodic uniform gridded
+    array along the prescribed axis with the 4th or 6th order compact
+    (Pade) finite difference scheme.
+
+    Arguments
+    ---------
+    phi   - input array, periodic along axis
+    h     - uniform grid spacing
+    order - order of the compact scheme (4 or 6)
+    axis  - axis along which to differentiate
+
+    Output
+    ------
+    f - d/dx(phi)
+    """
+    if order not in _schemes:
+        raise ValueError('deriv(): order must be 4 or 6, not %s' % order)
+
+    phi = _np.moveaxis(_np.asarray(phi), axis, 0)
+    n = phi.shape[0]
+    if n < 5:
+        raise ValueError('deriv(): axis %d is too short for a compact '
+                         'scheme' % axis)
+
+    alpha, gamma, cp, inv, z, scale = _cyclic_factors(n, order)
+    a, b = _schemes[order][1:]
+
+    # right-hand side, from periodically wrapped slices along axis 0
+    dtype = _np.result_type(phi.dtype, _np.float64)
+    y = _np.zeros(phi.shape, dtype)
+    for s, w in ((1, a/(2*h)), (2, b/(4*h))):
+        if w == 0:
+            continue
+        y[:n-s] += w*phi[s:]    # + w*phi[i+s]
+        y[n-s:] += w*phi[:s]
+        y[s:] -= w*phi[:n-s]    # - w*phi[i-s]
+        y[:s] -= w*phi[n-s:]
+
+    # Sherman-Morrison: x = y - (v.y)/(1 + v.z)*z, v = [1, 0..., alpha/gamma]
+    _thomas(y, alpha, cp, inv)
+    vy = (y[0] + (alpha/gamma)*y[-1])*scale
+    y -= z.reshape((n, ) + (1, )*(y.ndim-1))*vy
+
+    return _np.moveaxis(y, 0, axis)
@@ -1,11 +1,14 @@
 """
-Linear algebra based finite difference methods. Package is shared-memory only.
+Explicit central finite difference methods. Package is shared-memory only.
 User must wrap this package with an MPI-parallel data analysis class for
 distributed memory computing.
 Assumes 1-D domain decomposition.
 
 Notes:
 ------
+Derivatives are computed by applying the stencil weights to shifted
+slices of the input array, which costs O(order) passes over the data
+along any axis, without transposes or dense operator matrices.
 
 Definitions:
 ------------
@@ -20,9 +23,46 @@ University of Colorado Boulder
 http://tesla.colorado.edu
 """
 import numpy as _np
-from scipy.linalg import circulant as _circulant
 
-__all__ = ['central_matrix', 'central_deriv']
+__all__ = ['central_stencil', 'central_matrix', 'central_deriv']
+
+# one-sided weights [w_0, w_1, ..., w_m] of the centered stencils, where
+# w_-j = -w_j for the first derivative and w_-j = w_j for the second
+_weights = {
+    (1, 2): [0., 1./2],
+    (1, 4): [0., 2./3, -1./12],
+    (1, 6): [0., 3./4, -3./20, 1./60],
+    (1, 8): [0., 4./5, -1./5, 4./105, -1./280],
+    (2, 2): [-2., 1.],
+    (2, 4): [-5./2, 4./3, -1./12],
+    (2, 6): [-49./18, 3./2, -3./20, 1./90],
+    (2, 8): [-205./72, 8./5, -1./5, 8./315, -1./560],
+}
+
+
+def central_stencil(k=1, order=4):
+    """
+    central_stencil(k=1, order=4):
+
+    Returns the weights of the central finite difference stencil of the
+    k'th derivative with the prescribed order of accuracy, for unit grid
+    spacing and the offsets -order//2, ..., order//2.
+
+    Arguments
+    ---------
+    k     - order of the derivative (1 or 2)
+    order - order of the finite difference approximation (2, 4, 6, or 8)
+    """
+    try:
+        w = _np.array(_weights[(k, order)])
+    except KeyError:
+        raise ValueError('central_stencil(): k must be 1 or 2 and order '
+                         'must be 2, 4, 6, or 8, not k=%s, order=%s'
+                         % (k, order))
+
+    sign = -1 if k == 1 else 1
+
+    return _np.concatenate((sign*w[:0:-1], w))
 
 
 def central_matrix(n, d=1, o=4, dtype=_np.float64):
@@ -52,79 +92,33 @@ def central_matrix(n, d=1, o=4, dtype=_np.float64):
      0   0   0   1  -8   0
     ]
     '''
+    w = central_stencil(d, o)
+    m = w.size//2
 
-    if d==1:
-        if o==2:
-            d1 = _np.ones(n-1, dtype)
-            A = _np.diag(d1, 1) - _np.diag(d1, -1)
-
-        elif o==4:
-            d1 = (8./12)*_np.ones(n-1, dtype)
-            d2 = (1./12)*_np.ones(n-2, dtype)
-            A = _np.diag(d2, -2) - _np.diag(d1, -1) + _np.diag(d1, 1) \
-                - _np.diag(d2, 2)
-
-        elif o==6:
-            d1 = (3./4)*_np.ones(n-1, dtype)
-            d2 = (3./20)*_np.ones(n-2, dtype)
-            d3 = (1./60)*_np.ones(n-3, dtype)
-            A = -_np.diag(d3, -3) + _np.diag(d2, -2) - _np.diag(d1, -1) \
-                + _np.diag(d1, 1) - _np.diag(d2, 2) + _np.diag(d3, 3)
-
-        elif o==8:
-            d1 = (4./5)*_np.ones(n-1, dtype)
-            d2 = (1./5)*_np.ones(n-2, dtype)
-            d3 = (4./105)*_np.ones(n-3, dtype)
-            d4 = (1./280)*_np.ones(n-4, dtype)
-            A = _np.diag(d4, -4) - _np.diag(d3, -3) + _np.diag(d2, -2) \
-                - _np.diag(d1, -1) + _np.diag(d1, 1) - _np.diag(d2, 2) \
-                + _np.diag(d3, 3) - _np.diag(d4, 4)
-
-        else:
-            raise
-
-    elif d==2:
-        if o==2:
-            c = 2*_np.ones(n, dtype)
-            d1 = _np.ones(n-1, dtype)
-            A = _np.diag(d1, -1) - _np.diag(c, 0) + _np.diag(d1, 1)
-
-        elif o==4:
-            c = (30./12)*_np.ones(n, dtype)
-            d1 = (16./12)*_np.ones(n-1, dtype)
-            d2 = (1./12)*_np.ones(n-2, dtype)
-            A = -_np.diag(d2, -2) + _np.diag(d1, -1) - _np.diag(c, 0) \
-                - _np.diag(d2, 2) + _np.diag(d1, 1)
-
-        elif o==6:
-            c = (49./18)*_np.ones(n, dtype)
-            d1 = (3./2)*_np.ones(n-1, dtype)
-            d2 = (3./20)*_np.ones(n-2, dtype)
-            d3 = (1./90)*_np.ones(n-3, dtype)
-            A = _np.diag(d3, -3) - _np.diag(d2, -2) + _np.diag(d1, -1) \
-                - _np.diag(c, 0) + _np.diag(d3, 3) - _np.diag(d2, 2) \
-                + _np.diag(d1, 1)
-
-        elif o==8:
-            c = (205./72)*_np.ones(n, dtype)
-            d1 = (8./5)*_np.ones(n-1, dtype)
-            d2 = (1./5)*_np.ones(n-2, dtype)
-            d3 = (8./315)*_np.ones(n-3, dtype)
-            d4 = (1./560)*_np.ones(n-4, dtype)
-            A = -_np.diag(d4, -4) + _np.diag(d3, -3) - _np.diag(d2, -2) \
-                + _np.diag(d1, -1) - _np.diag(c, 0) -_np.diag(d4, 4) \
-                + _np.diag(d3, 3) - _np.diag(d2, 2) + _np.diag(d1, 1)
-
-        else:
-            raise ValueError
-
-    else:
-        raise ValueError
+    A = _np.zeros((n, n), dtype)
+    for s in range(-m, m+1):
+        A += w[m+s]*_np.eye(n, k=s, dtype=dtype)
 
     return A
 
 
-def central_deriv(phi, h, bc='periodic', k=1, order=4, axis=-1):
+def _slices(n, s, m, periodic):
+    """
+    (destination, source) slices of the shifted values phi[i+s] of the
+    n output points along an axis, wrapped around if periodic and read
+    from the m ghost points on either side of the data otherwise.
+    """
+    if not periodic:
+        return [(slice(None), slice(m+s, m+s+n))]
+
+    s %= n
+    if s == 0:
+        return [(slice(None), slice(None))]
+
+    return [(slice(0, n-s), slice(s, n)), (slice(n-s, n), slice(0, s))]
+
+
+def central_deriv(phi, h, bc='periodic', k=1, order=4, axis=-1, out=None):
     """
     central_deriv(phi, h, bc='periodic', k=1, order=4, axis=-1):
 
@@ -136,46 +130,52 @@ def central_deriv(phi, h, bc='periodic', k=1, order=4, axis=-1):
     ---------
     phi   - input array
     h     - uniform grid spacing
-    bc    -
-    k     - order of the derivative
-    order - order of the finite difference approximation
-    axis  -
+    bc    - 'periodic', or 'ghost_zones' if phi includes order//2 ghost
+            points on either end of axis, which are not differentiated
+    k     - order of the derivative (1 or 2)
+    order - order of the finite difference approximation (2, 4, 6, or 8)
+    axis  - axis along which to differentiate
+    out   - (optional) output array
 
     Output
     ------
-    f - d^k/dx^k(phi)
+    f - d^k/dx^k(phi), without the ghost points if bc='ghost_zones'
     """
-    axis = axis % phi.ndim
-
-    nx= phi.shape[axis]
-    c = _np.zeros(nx)
-    c[1:3] = [-8./12, 1./12]
-    c[-2:] = [-1./12, 8./12]
-    c /= h
-    A = _circulant(c)
-
-    # A = (1.0/h**k)*central_matrix(nx, k, order, phi.dtype)
-
-    # if bc=='periodic':
-    #     for d in range(1, order/2+1):
-    #         for i, j in enumerate(range(-d, 0)):
-    #             A[i, j] = A[d, 0]
-    #             A[j, i] = A[0, d]
+    if bc not in ('periodic', 'ghost_zones'):
+        raise ValueError("central_deriv(): bc must be 'periodic' or "
+                         "'ghost_zones', not %r" % (bc, ))
 
-    # elif bc=='ghost_zones':
-    #     raise ValueError('findiff_numpy_scipy.central_deriv(): '
-    #                      'only periodic bc implemented')
-
-    # else:
-    #     raise ValueError('findiff_numpy_scipy.central_deriv(): '
-    #                      'only periodic bc implemented')
-
-    if axis != phi.ndim-1:
-        phi = _np.swapaxes(phi, axis, -1)
-
-    deriv = _np.einsum('ijk,mk->ijm', phi, A)
-
-    if axis != phi.ndim-1:
-        deriv = _np.swapaxes(deriv, axis, -1)
-
-    return deriv
+    phi = _np.asarray(phi)
+    axis = axis % phi.ndim
+    w = central_stencil(k, order)/h**k
+    m = w.size//2
+    periodic = bc == 'periodic'
+
+    shape = list(phi.shape)
+    if not periodic:
+        shape[axis] -= 2*m
+        if shape[axis] < 1:
+            raise ValueError('central_deriv(): axis %d is too short for %d '
+                             'ghost points' % (axis, m))
+    n = shape[axis]
+    if periodic and n < 2*m + 1:
+        raise ValueError('central_deriv(): axis %d is too short for an '
+                         'order %d stencil' % (axis, order))
+
+    dtype = _np.result_type(phi.dtype, w.dtype)
+    if out is None:
+        out = _np.zeros(shape, dtype)
+    else:
+        out[...] = 0
+    tmp = _np.empty(shape, dtype)
+
+    index = (slice(None), )*axis
+    for s in range(-m, m+1):
+        if w[m+s] == 0:
+            continue
+        for dst, src in _slices(n, s, m, periodic):
+            t = tmp[index + (dst, )]
+            _np.multiply(phi[index + (src, )], w[m+s], out=t)
+            out[index + (dst, )] += t
+
+    return out
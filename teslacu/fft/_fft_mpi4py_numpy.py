@@ -61,61 +61,95 @@ http://tesla.colorado.edu
 from mpi4py import MPI
 import numpy as np
 
+from ..misc import timers  # per-phase profiling timers
+
 __all__ = ['psum', 'rfft3', 'irfft3', 'shell_average', 'y2z_slab_exchange',
            'z2y_slab_exchange']
 
+# MPI datatypes of the supported complex work arrays
+_mpi_complex = {np.dtype(np.complex64): MPI.COMPLEX,
+                np.dtype(np.complex128): MPI.DOUBLE_COMPLEX}
+
 
 # 3D real-valued FFTs ---------------------------------------------------------
+@timers.timed('rfft3')
 def rfft3(comm, u, fu=None):
     """
     Compute MPI-distributed, real-to-complex 3D FFT.
-    Input array must have only three dimensions (not curently checked)
+    The transform is taken over the last three axes of the input array,
+    any leading axes (e.g. vector components or ensemble members) are
+    batched together so that only one Alltoall is needed per call.
+    Single-precision input is transformed and communicated in single
+    precision (complex64) unless fu is passed in with another dtype.
     temp and fu are complex data work arrays where the array view for fu can
     be passed in from the calling function
     """
     ntasks = comm.size
-    nnz, ny, nx = u.shape
+    nnz, ny, nx = u.shape[-3:]
+    nb = u.shape[:-3]   # leading batch dimensions
     nk = nx//2+1
     nny = ny//ntasks
     nz = nnz*ntasks
 
     if fu is None:
-        fu = np.empty([nz, nny, nk], dtype=np.complex128)
+        fu = np.empty(nb+(nz, nny, nk), dtype=np.result_type(u.dtype,
+                                                              np.complex64))
+    mpi_complex = _mpi_complex[fu.dtype]
+
+    temp1 = np.empty(nb+(nnz, ny, nk), dtype=fu.dtype)
 
-    temp1 = np.empty([nnz, ny, nk], dtype=np.complex128)
+    temp1[:] = np.fft.rfft2(u, axes=(-2, -1))
+    temp1 = temp1.reshape(nb+(nnz, ntasks, nny, nk))
 
-    temp1[:] = np.fft.rfft2(u, axes=(1, 2))
-    fu[:] = np.rollaxis(temp1.reshape([nnz, ntasks, nny, nk]),
-                        1).reshape(fu.shape)
-    comm.Alltoall(MPI.IN_PLACE, [fu, MPI.DOUBLE_COMPLEX])  # send, receive
-    fu[:] = np.fft.fft(fu, axis=0)
+    if len(nb) == 0:
+        fu[:] = np.rollaxis(temp1, 1).reshape(fu.shape)
+        with timers('Alltoall'):
+            comm.Alltoall(MPI.IN_PLACE, [fu, mpi_complex])  # send, receive
+    else:
+        # the send buffer must be contiguous by destination task
+        temp2 = np.empty((ntasks, )+nb+(nnz, nny, nk), dtype=fu.dtype)
+        temp2[:] = np.moveaxis(temp1, -3, 0)
+        with timers('Alltoall'):
+            comm.Alltoall(MPI.IN_PLACE, [temp2, mpi_complex])
+        fu[:] = np.moveaxis(temp2, 0, -4).reshape(fu.shape)
+
+    fu[:] = np.fft.fft(fu, axis=-3)
 
     return fu
 
 
+@timers.timed('irfft3')
 def irfft3(comm, fu, u=None):
     """
     compute MPI-distributed, complex-to-real 3D FFT.
-    Input array must have only three dimensions (not curently checked)
+    The transform is taken over the last three axes of the input array,
+    any leading axes are batched together as in rfft3, and complex64
+    input is transformed and communicated in single precision.
     temp1 and temp2 are complex data work arrays
     """
     ntasks = comm.size
-    nz, nny, nk = fu.shape
+    nz, nny, nk = fu.shape[-3:]
+    nb = fu.shape[:-3]  # leading batch dimensions
     nnz = nz//ntasks
     ny = nny*ntasks
 
-    temp1 = np.empty_like(fu)
-    temp2 = np.empty([nnz, ny, nk], dtype=fu.dtype)
+    temp1 = np.empty((ntasks, )+nb+(nnz, nny, nk), dtype=fu.dtype)
+    temp2 = np.empty(nb+(nnz, ny, nk), dtype=fu.dtype)
 
-    temp1[:] = np.fft.ifft(fu, axis=0)
-    temp1.resize([ntasks, nnz, nny, nk])
-    comm.Alltoall(MPI.IN_PLACE, [temp1, MPI.DOUBLE_COMPLEX])  # send, receive
-    temp2[:] = np.rollaxis(temp1, 1).reshape([nnz, ny, nk])
+    if len(nb) == 0:
+        temp1.reshape(fu.shape)[:] = np.fft.ifft(fu, axis=0)
+    else:
+        # the send buffer must be contiguous by destination task
+        temp1[:] = np.moveaxis(np.fft.ifft(fu, axis=-3).reshape(
+                                nb+(ntasks, nnz, nny, nk)), -4, 0)
+    with timers('Alltoall'):
+        comm.Alltoall(MPI.IN_PLACE, [temp1, _mpi_complex[fu.dtype]])
+    temp2[:] = np.moveaxis(temp1, 0, -3).reshape(temp2.shape)
 
     if u is None:
-        u = np.fft.irfft2(temp2, axes=(1, 2))
+        u = np.fft.irfft2(temp2, axes=(-2, -1))
     else:
-        u[:] = np.fft.irfft2(temp2, axes=(1, 2))
+        u[:] = np.fft.irfft2(temp2, axes=(-2, -1))
 
     return u
 
@@ -153,7 +187,8 @@ def shell_average(comm, E3, km):
     for k in range(1, nk):
         E1[k] = psum(np.where(km==k, E3, zeros))
 
-    comm.Allreduce(MPI.IN_PLACE, E1, op=MPI.SUM)
+    with timers('Allreduce'):
+        comm.Allreduce(MPI.IN_PLACE, E1, op=MPI.SUM)
 
     return E1
 
@@ -175,7 +210,8 @@ def z2y_slab_exchange(comm, var, varT=None):
         varT.resize([comm.size, nnz, nny, nx])
 
     varT[:] = np.rollaxis(var.reshape([nnz, comm.size, nny, nx]), 1)
-    comm.Alltoall(MPI.IN_PLACE, varT)  # send, receive
+    with timers('Alltoall'):
+        comm.Alltoall(MPI.IN_PLACE, varT)  # send, receive
     varT.resize([nz, nny, nx])
 
     return varT
@@ -196,7 +232,8 @@ def y2z_slab_exchange(comm, varT, var=None):
     else:
         var.resize([comm.size, nnz, nny, nx])
 
-    comm.Alltoall(var, varT.reshape(var.shape))  # send, receive
+    with timers('Alltoall'):
+        comm.Alltoall(var, varT.reshape(var.shape))  # send, receive
     var.resize([nnz, ny, nx])
     var[:] = np.rollaxis(var, 1).reshape(var.shape)
 
@@ -1 +1,4 @@
+from ._timers_mpi4py import *
+from ._fields_numpy import *
+
 __all__=[]
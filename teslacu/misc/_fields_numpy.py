@@ -0,0 +1,162 @@
+"""
+Description:
+============
+This module contains a lazy, memoising registry of named derived fields
+of a data snapshot (e.g. the velocity gradient tensor, vorticity,
+strain rate, enstrophy, and dissipation of a velocity field), so that
+analysis routines can request the quantities they need by name without
+recomputing shared intermediates.
+
+Each derived field is defined once as a function of other named fields
+and is computed on its first request for the current snapshot. Computed
+fields are cached within an optional memory budget, evicting the least
+recently used fields first, and the whole cache is invalidated when the
+snapshot changes. Input fields set for a snapshot are never evicted.
+
+Notes:
+======
+Derived fields are often computed with MPI collectives (FFTs, slab
+exchanges), so every task must request the same fields in the same
+order. Since every task then makes the same caching and eviction
+decisions for its equally-sized memory-local fields, the registry stays
+consistent across tasks.
+
+Cached fields are returned by reference and must not be modified in
+place. Input fields are also held by reference, so a snapshot must be
+renewed with new_snapshot() whenever its input arrays change.
+
+Example:
+--------
+    fields = fieldRegistry(budget=2**30)
+    fields.define('enst', lambda w: 0.5*np.sum(w**2, axis=0), 'omega')
+    ...
+    fields.new_snapshot(tstep, u_hat=U_hat)
+    enst = fields['enst']
+
+Authors:
+========
+Colin Towery
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+from collections import OrderedDict
+
+__all__ = ['fieldRegistry']
+
+
+class fieldRegistry(object):
+    """
+    Lazy, memoising registry of named per-snapshot fields.
+
+    Class Constructor:
+
+        Optional Keyword Arguments:
+            budget: (default=None) memory budget in bytes of the cached
+                derived fields, or None for no limit
+
+    Attributes:
+    -----------
+        budget: memory budget of the cached derived fields
+        snapshot: tag of the current snapshot
+        nbytes: memory used by the cached derived fields
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.snapshot = None
+        self.nbytes = 0
+        self._rules = {}
+        self._inputs = {}
+        self._cache = OrderedDict()  # least recently used first
+        self._pending = set()
+
+    def define(self, name, func, *deps):
+        """
+        Defines the derived field `name` as func(*[self[d] for d in deps]).
+        Redefining a field drops all cached derived fields.
+        """
+        self._rules[name] = (func, deps)
+        self._drop_cache()
+
+    def new_snapshot(self, snapshot=None, **inputs):
+        """
+        Starts a new snapshot with the given input fields, invalidating
+        all inputs and cached fields of the previous snapshot. If the
+        snapshot tag equals the current (not None) tag, the snapshot is
+        unchanged and nothing is invalidated.
+        """
+        if snapshot is not None and snapshot == self.snapshot:
+            return
+
+        self.snapshot = snapshot
+        self._inputs = dict(inputs)
+        self._drop_cache()
+
+    def set(self, name, value):
+        """
+        Sets the input field `name` of the current snapshot, which takes
+        precedence over its definition, and drops all cached derived
+        fields, which might depend on it.
+        """
+        self._inputs[name] = value
+        self._drop_cache()
+
+    def clear(self):
+        """Drops all inputs and cached fields of the current snapshot."""
+        self.new_snapshot()
+
+    def __contains__(self, name):
+        """True if `name` is available without computing it"""
+        return name in self._inputs or name in self._cache
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get(self, name):
+        """
+        Returns the field `name` of the current snapshot, computing it
+        (and any fields it depends on) if it is not an input or cached.
+        """
+        if name in self._inputs:
+            return self._inputs[name]
+
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return self._cache[name]
+
+        if name not in self._rules:
+            raise KeyError('field %r is neither an input of this snapshot '
+                           'nor defined' % (name, ))
+        if name in self._pending:
+            raise ValueError('field %r depends on itself, the snapshot is '
+                             'missing an input' % (name, ))
+
+        func, deps = self._rules[name]
+        self._pending.add(name)
+        try:
+            value = func(*[self.get(d) for d in deps])
+        finally:
+            self._pending.discard(name)
+
+        self._store(name, value)
+
+        return value
+
+    def _store(self, name, value):
+        nbytes = getattr(value, 'nbytes', 0)
+        if self.budget is not None:
+            if nbytes > self.budget:
+                return  # too big to cache at all
+            while self._cache and self.nbytes + nbytes > self.budget:
+                old = self._cache.popitem(last=False)[1]
+                self.nbytes -= getattr(old, 'nbytes', 0)
+
+        self._cache[name] = value
+        self.nbytes += nbytes
+
+    def _drop_cache(self):
+        self._cache.clear()
+        self.nbytes = 0
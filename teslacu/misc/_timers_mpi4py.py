@@ -0,0 +1,192 @@
+"""
+Description:
+============
+This module contains a lightweight registry of named wall-clock timers
+for profiling the phases of TESLaCU and spectralLES routines (FFTs,
+collectives, RHS terms, etc.).
+
+Timers are disabled by default, in which case timing a phase costs one
+attribute lookup and returns a shared do-nothing context manager, so the
+instrumentation can stay in place in production runs.
+
+Notes:
+======
+The timers are inclusive, i.e. time spent in a nested phase is also
+counted in every enclosing phase. Phase names are free-form strings, but
+by convention dotted names (e.g. 'RK4.computeAD') are used for the
+phases of a routine.
+
+Example:
+--------
+    from teslacu.misc import timers
+
+    timers.enable()
+    with timers('my_phase'):
+        ...
+
+    @timers.timed()
+    def my_function(...):
+        ...
+
+    summary = timers.report(comm)   # not None on task 0 only
+
+Authors:
+========
+Colin Towery
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+from mpi4py import MPI
+import numpy as np
+import functools
+from time import perf_counter
+
+__all__ = ['timerRegistry', 'timers']
+
+
+class _nullPhase(object):
+    """do-nothing context manager returned by a disabled registry"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        return False
+
+
+_null_phase = _nullPhase()
+
+
+class _phase(object):
+    """context manager that adds its wall time to a registry entry"""
+    __slots__ = ('_totals', '_name', '_t0')
+
+    def __init__(self, totals, name):
+        self._totals = totals
+        self._name = name
+
+    def __enter__(self):
+        self._t0 = perf_counter()
+        return self
+
+    def __exit__(self, type, value, tb):
+        elapsed = perf_counter() - self._t0
+        entry = self._totals.get(self._name)
+        if entry is None:
+            self._totals[self._name] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+        return False
+
+
+class timerRegistry(object):
+    """
+    Registry of named, accumulating wall-clock timers.
+
+    Class Constructor:
+
+        Optional Keyword Arguments:
+            enabled: (default=False) start with the timers enabled
+
+    Attributes:
+    -----------
+        enabled: timers only accumulate while enabled is True
+        totals: dictionary of {name: [number of calls, seconds]}
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.totals = {}
+
+    def __call__(self, name):
+        """
+        Returns a context manager that times the enclosed phase under
+        `name`, or a shared do-nothing context manager if disabled.
+        """
+        if not self.enabled:
+            return _null_phase
+
+        return _phase(self.totals, name)
+
+    def timed(self, name=None):
+        """
+        Decorator that times every call of the decorated function under
+        `name`, which defaults to the function's qualified name.
+        """
+        def decorator(func):
+            label = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _phase(self.totals, label):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """discard all accumulated timings"""
+        self.totals.clear()
+
+    def report(self, comm=MPI.COMM_WORLD, fname=None, per_rank=False):
+        """
+        Gathers the timers of every task in comm and returns a summary
+        table of the number of calls and the min, avg, and max across
+        tasks of the total seconds spent in each phase. Only task 0
+        returns the summary, all other tasks return None.
+
+        Arguments:
+        ----------
+        comm: (default=MPI.COMM_WORLD) MPI communicator
+        fname: (optional) file name to which task 0 appends the summary
+        per_rank: (default=False) also list the time of every task
+        """
+        all_totals = comm.gather(self.totals)
+        if comm.rank != 0:
+            return None
+
+        names = sorted(set().union(*all_totals))
+        fmt = '{:<40s} {:>9s} {:>12s} {:>12s} {:>12s}'.format
+        lines = [fmt('phase', 'calls', 'min [s]', 'avg [s]', 'max [s]')]
+
+        fmt = '{:<40s} {:>9d} {:12.5e} {:12.5e} {:12.5e}'.format
+        for name in names:
+            calls = max(t.get(name, (0, 0.0))[0] for t in all_totals)
+            secs = np.array([t.get(name, (0, 0.0))[1] for t in all_totals])
+            lines.append(fmt(name, calls, secs.min(), secs.mean(),
+                             secs.max()))
+
+        if per_rank:
+            fmt = '{:<40s} {:>9d} {:12.5e}'.format
+            for rank, totals in enumerate(all_totals):
+                lines.append('\ntask %d:' % rank)
+                for name in names:
+                    calls, secs = totals.get(name, (0, 0.0))
+                    lines.append(fmt(name, calls, secs))
+
+        summary = '\n'.join(lines)
+
+        if fname is not None:
+            with open(fname, 'a') as fh:
+                fh.write('%s\n\n' % summary)
+
+        return summary
+
+
+# the global registry used to instrument TESLaCU and spectralLES
+timers = timerRegistry()
@@ -64,6 +64,9 @@ from . import fft as tcfft          # FFT transforms and math functions
 from . import stats as tcstats      # statistical functions
 from .diff import central as tcfd   # finite difference functions
 from .diff import akima as tcas     # Akima spline approximation functions
+from .diff import pchip as tcpc     # PCHIP approximation functions
+from .diff import compact as tccd   # compact finite difference functions
+from .misc import fieldRegistry     # lazy derived-field registry
 
 __all__ = ['mpiAnalyzer']
 
@@ -96,7 +99,10 @@ def mpiAnalyzer(comm=world_comm, odir='./analysis/', pid='test', ndims=3,
 
     config: problem configuration (switch)
 
-    kwargs: additional arguments to be handled by the subclasses
+    kwargs: additional arguments to be handled by the subclasses, e.g.
+        the derivative `method` of the 'hit' configuration and, for
+        method='central_diff', its `order` of accuracy (2, 4, 6, or 8,
+        default 4)
 
     output:
     -------
@@ -105,7 +111,8 @@ def mpiAnalyzer(comm=world_comm, odir='./analysis/', pid='test', ndims=3,
 
     if config == 'hit':
         method = kwargs['method']
-        analyzer = _hitAnalyzer(comm, odir, pid, ndims, L, N, method)
+        order = kwargs.get('order', 4)
+        analyzer = _hitAnalyzer(comm, odir, pid, ndims, L, N, method, order)
     elif config is None:
         analyzer = _baseAnalyzer(comm, odir, pid, ndims, L, N)
     else:
@@ -195,6 +202,11 @@ class _baseAnalyzer(object):
 
         self.mpi_moments_file = '%s%s.moments' % (self.odir, self.prefix)
 
+        self._cart = None
+
+        # per-snapshot registry of derived fields, see fieldRegistry
+        self.fields = fieldRegistry()
+
     # Class Properities -------------------------------------------------------
 
     def __enter__(self):
@@ -233,6 +245,17 @@ class _baseAnalyzer(object):
     def L(self):
         return self._L
 
+    @property
+    def cart(self):
+        """
+        1D Cartesian communicator of the slab decomposition along axis 0,
+        periodic if the domain is periodic along axis 0
+        """
+        if self._cart is None:
+            self._cart = self.comm.Create_cart([self.comm.size],
+                                               periods=self.periodic[:1])
+        return self._cart
+
     @property
     def nx(self):
         return self._nx
@@ -267,12 +290,12 @@ class _baseAnalyzer(object):
     def mpi_mean(self, data, w=None, wbar=None, norm=1.0):
         N = self.Nx*norm
         if w is None:
-            u1 = self.comm.allreduce(self.psum(data), op=MPI.SUM)/N
+            u1 = tcstats.gsum(self.comm, data)/N
         else:
             if wbar is None:
-                wbar = self.comm.allreduce(self.psum(w), op=MPI.SUM)/N
+                wbar = tcstats.gsum(self.comm, w)/N
             N *= wbar
-            u1 = self.comm.allreduce(self.psum(w*data), op=MPI.SUM)/N
+            u1 = tcstats.gsum(self.comm, w*data)/N
 
         return u1
 
@@ -282,12 +305,12 @@ class _baseAnalyzer(object):
         """
         N = self.Nx*norm
         if w is None:
-            m2 = self.comm.allreduce(self.psum(data**2), op=MPI.SUM)/N
+            m2 = tcstats.gsum(self.comm, data**2)/N
         else:
             if wbar is None:
-                wbar = self.comm.allreduce(self.psum(w), op=MPI.SUM)/N
+                wbar = tcstats.gsum(self.comm, w)/N
             N *= wbar
-            m2 = self.comm.allreduce(self.psum(w*data**2), op=MPI.SUM)/N
+            m2 = tcstats.gsum(self.comm, w*data**2)/N
 
         return np.sqrt(m2)
 
@@ -297,6 +320,20 @@ class _baseAnalyzer(object):
 
         return (gmin, gmax)
 
+    def mpi_quantiles(self, data, q, w=None, delta=500):
+        """
+        Estimates global quantiles q (scalar or array in [0, 1], e.g. 0.5
+        for the median or 0.9999 for an extreme tail) of MPI-distributed
+        data, optionally weighted by w, from t-digest sketches merged in
+        one Allreduce. The memory footprint is bounded by delta and is
+        independent of the data size. See teslacu.stats.quantiles().
+
+        Returns the quantiles and the global t-digest, which can be passed
+        to teslacu.stats.tdigest_quantiles() or tdigest_cdf() for further
+        quantiles or tail probabilities without communication.
+        """
+        return tcstats.quantiles(self.comm, data, q, w, delta)
+
 # Histograms ------------------------------------------------------------------
 
     def mpi_histogram1(self, var, fname, metadata='', range=None,
@@ -304,25 +341,60 @@ class _baseAnalyzer(object):
         """MPI-distributed univariate spatial histogram."""
 
         # get histogram and statistical moments (every task gets the results)
-        # result = (hist, u1, c2, g3, g4, g5, g6, gmin, gmax, width)
+        # result = (hist, m1, m2, gmin, gmax, width)
         result = tcstats.histogram1(self.comm, self.Nx*norm,
                                     var, range, bins, w, wbar, m1)
-        hist = result[0]
-        gmin, gmax, width = result[1:4]
-        m = result[4:]
 
         # write histogram from root task
         if self.comm.rank == 0:
-            fh = open('%s%s%s.hist' % (self.odir, self.prefix, fname), 'w')
-            fh.write('%s\n' % metadata)
-            fmt = '%s\n' % '  '.join(['{:14.8e}']*len(m)).format
-            fh.write(fmt(*m))
-            fmt = '%d  %s\n' % '  '.join(['{:14.8e}']*3).format
-            fh.write(fmt(bins, width, gmin, gmax))
-            hist.tofile(fh, sep='\n', format='%14.8e')
-            fh.close()
+            self._write_histogram1(fname, metadata, *result)
 
-        return m
+        return result[1:3]
+
+    def mpi_histograms(self, fields, metadata='', range=None, bins=100,
+                       w=None):
+        """
+        MPI-distributed univariate spatial histograms of several fields,
+        computed with a constant number of collectives, see
+        teslacu.stats.histograms().
+
+        Arguments:
+        ----------
+        fields: dictionary of {fname: var}, where each var is any array of
+            spatial data (e.g. a scalar, vector or tensor field)
+        metadata: (default='') header line of every file, or a dictionary
+            of {fname: metadata}
+        range: (optional) (min, max) of every field's bins, or a
+            dictionary of {fname: (min, max)}, computed from the data if
+            not given
+        bins: (default=100) number of bins
+        w: (optional) weights of every field, or a dictionary of
+            {fname: w}
+
+        Returns a dictionary of {fname: (m1, m2)}.
+        """
+        results = tcstats.histograms(self.comm, fields, range, bins, w)
+
+        # write histograms from root task
+        if self.comm.rank == 0:
+            for fname, result in results.items():
+                if isinstance(metadata, dict):
+                    header = metadata.get(fname, '')
+                else:
+                    header = metadata
+                self._write_histogram1(fname, header, *result)
+
+        return {fname: result[1:3] for fname, result in results.items()}
+
+    def _write_histogram1(self, fname, metadata, hist, m1, m2, gmin, gmax,
+                          width):
+        fh = open('%s%s%s.hist' % (self.odir, self.prefix, fname), 'w')
+        fh.write('%s\n' % metadata)
+        fh.write('{:14.8e}  {:14.8e}\n'.format(m1, m2))
+        fh.write('{:d}  {:14.8e}  {:14.8e}  {:14.8e}\n'
+                 .format(hist.size, width, gmin, gmax))
+        hist.tofile(fh, sep='\n', format='%14.8e')
+        fh.close()
 
     def mpi_histogram2(self, var1, var2, fname, metadata='',
                        xrange=None, yrange=None, bins=100, w=None):
@@ -330,18 +402,14 @@ class _baseAnalyzer(object):
 
         # get histogram and statistical moments (every task gets the results)
         # result = (jhist, (min1, max1), width1, (min2, max2), width2)
-        if w is not None:
-            w = np.ravel(w)
-
-        result = tcstats.histogram2(
-                    self.comm, np.ravel(var1), np.ravel(var2),
-                    xrange, yrange, bins, w)
+        result = tcstats.histogram2(self.comm, var1, var2, xrange, yrange,
+                                    bins, w)
         hist = result[0]
         m = result[1:]
 
         # write histogram from root task
         if self.comm.rank == 0:
-            fmt = '%d  %s\n' % '  '.join(['{:14.8e}']*len(m)).format
+            fmt = ('{:d}  %s\n' % '  '.join(['{:14.8e}']*len(m))).format
             fh = open('%s%s%s.hist2d' % (self.odir, self.prefix, fname), 'w')
             fh.write('%s\n' % metadata)
             fh.write(fmt(bins, *m))
@@ -350,43 +418,143 @@ class _baseAnalyzer(object):
 
         return m
 
+    def mpi_conditional_moments(self, cond, targets, fname=None, metadata='',
+                                bins=100, range=None, w=None):
+        """
+        MPI-distributed conditional means and variances of several target
+        fields given one or two binned conditioning fields, computed in a
+        single pass over the data, see teslacu.stats.conditional_moments().
+
+        Arguments:
+        ----------
+        cond: conditioning field, or a list of conditioning fields for
+            joint conditioning
+        targets: dictionary of {name: var} of the target fields
+        fname: (optional) output file name (without the .cstats extension)
+        metadata: (default='') header line of the output file
+        bins: (default=100) number of bins, or a sequence with one number
+            per conditioning field
+        range: (optional) (min, max) of the bins, or a sequence with one
+            (min, max) per conditioning field
+        w: (optional) weights of the data
+
+        Returns (counts, stats, ranges), where stats is a dictionary of
+        {name: (mean, var)}.
+        """
+        counts, stats, ranges = tcstats.conditional_moments(
+                            self.comm, cond, targets, bins, range, w)
+
+        # write conditional moments from root task
+        if fname is not None and self.comm.rank == 0:
+            centers = [(np.arange(n) + 0.5)*(r[1] - r[0])/n + r[0]
+                       for n, r in zip(counts.shape, ranges)]
+            columns = list(np.meshgrid(*centers, indexing='ij')) + [counts]
+            labels = ['x%d' % d for d, _ in enumerate(centers)] + ['count']
+            for name, (mean, var) in stats.items():
+                columns.extend([mean, var])
+                labels.extend(['mean(%s)' % name, 'var(%s)' % name])
+
+            fh = open('%s%s%s.cstats' % (self.odir, self.prefix, fname), 'w')
+            fh.write('%s\n' % metadata)
+            fh.write('  '.join('{:d}'.format(n) for n in counts.shape))
+            fh.write('  %s\n' % '  '.join('{:14.8e}'.format(r)
+                                          for r in ranges.ravel()))
+            fh.write('%s\n' % '  '.join(labels))
+            np.savetxt(fh, np.stack([c.ravel() for c in columns], axis=-1),
+                       fmt='%14.8e', delimiter='  ')
+            fh.close()
+
+        return counts, stats, ranges
+
     # Data Transposing --------------------------------------------------------
 
+    def z_halo_exchange(self, var, m):
+        """
+        Returns a copy of the MPI-distributed array var (of shape
+        [..., nnz, ny, nx], any leading axes are batched) extended by m
+        ghost planes from the neighbouring tasks on either end of the
+        decomposed axis, so that local stencils can be applied along that
+        axis without a global transpose.
+
+        Ghost planes are exchanged with Sendrecv on the periodic
+        Cartesian communicator self.cart, which moves only O(m*ny*nx)
+        data per task. If m > nnz, the ghost planes are gathered from as
+        many successive neighbours as needed. Ghost planes beyond a
+        non-periodic domain boundary are left uninitialized.
+        """
+        axis = var.ndim - self.ndims    # decomposed axis
+        lead = (slice(None), )*axis
+        nnz = var.shape[axis]
+
+        shape = list(var.shape)
+        shape[axis] += 2*m
+        temp = np.empty(shape, dtype=var.dtype)
+        temp[lead + (slice(m, m+nnz), )] = var
+
+        q = 0
+        while q*nnz < m:
+            count = min(nnz, m - q*nnz)
+            lo = m - q*nnz      # end of the lower ghost planes from rank-q-1
+            hi = m + nnz + q*nnz  # start of the upper ghost planes
+            src, dest = self.cart.Shift(0, q+1)
+
+            shape[axis] = count
+            recvbuf = np.empty(shape, dtype=var.dtype)
+
+            # send my top planes up, receive lower ghost planes from below
+            top = lead + (slice(nnz-count, nnz), )
+            sendbuf = np.ascontiguousarray(var[top])
+            self.cart.Sendrecv(sendbuf, dest, 0, recvbuf, src, 0)
+            temp[lead + (slice(lo-count, lo), )] = recvbuf
+
+            # send my bottom planes down, receive upper ghost planes
+            sendbuf = np.ascontiguousarray(var[lead + (slice(0, count), )])
+            self.cart.Sendrecv(sendbuf, src, 1, recvbuf, dest, 1)
+            temp[lead + (slice(hi, hi+count), )] = recvbuf
+            q += 1
+
+        return temp
+
     def z2y_slab_exchange(self, var):
         """
-        Domain decomposition 'transpose' of MPI-distributed scalar array.
+        Domain decomposition 'transpose' of MPI-distributed array of shape
+        [..., nnz, ny, nx], where any leading axes (e.g. vector components)
+        are batched into a single Alltoall.
         Assumes 1D domain decomposition
         """
+        P = self.comm.size
+        *lead, nnz, ny, nx = var.shape
+        nz = nnz*P
+        nny = ny//P
+        B = int(np.prod(lead))
 
-        nnz, ny, nx = var.shape
-        nz = nnz*self.comm.size
-        nny = ny//self.comm.size
+        temp = np.empty([P, B, nnz, nny, nx], dtype=var.dtype)
 
-        temp = np.empty([self.comm.size, nnz, nny, nx], dtype=var.dtype)
-
-        temp[:] = np.rollaxis(var.reshape([nnz, self.comm.size, nny, nx]), 1)
+        temp[:] = np.moveaxis(var.reshape([B, nnz, P, nny, nx]), 2, 0)
         self.comm.Alltoall(MPI.IN_PLACE, temp)  # send, receive
-        temp.resize([nz, nny, nx])
 
-        return temp
+        return np.moveaxis(temp, 0, 1).reshape(lead + [nz, nny, nx])
 
     def y2z_slab_exchange(self, varT):
         """
-        Domain decomposition 'transpose' of MPI-distributed scalar array.
+        Domain decomposition 'transpose' of MPI-distributed array of shape
+        [..., nz, nny, nx], where any leading axes (e.g. vector components)
+        are batched into a single Alltoall.
         Assumes 1D domain decomposition
         """
+        P = self.comm.size
+        *lead, nz, nny, nx = varT.shape
+        nnz = nz//P
+        ny = nny*P
+        B = int(np.prod(lead))
 
-        nz, nny, nx = varT.shape
-        nnz = nz//self.comm.size
-        ny = nny*self.comm.size
+        sendbuf = np.empty([P, B, nnz, nny, nx], dtype=varT.dtype)
+        sendbuf[:] = np.moveaxis(varT.reshape([B, P, nnz, nny, nx]), 1, 0)
 
-        temp = np.empty([self.comm.size, nnz, nny, nx], dtype=varT.dtype)
+        temp = np.empty_like(sendbuf)
+        self.comm.Alltoall(sendbuf, temp)  # send, receive
 
-        self.comm.Alltoall(temp, varT.reshape(temp.shape))  # send, receive
-        temp.resize([nnz, ny, nx])
-        temp[:] = np.rollaxis(temp, 1).reshape(temp.shape)
-
-        return temp
+        return np.moveaxis(temp, 0, 2).reshape(lead + [nnz, ny, nx])
 
 
 ###############################################################################
@@ -396,7 +564,11 @@ class _hitAnalyzer(_baseAnalyzer):
         ...
     """
 
-    def __init__(self, comm, odir, pid, ndims, L, N, method='akima'):
+    # symmetric tensor components (i, j) of the SGS stresses
+    sgs_components = ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2))
+
+    def __init__(self, comm, odir, pid, ndims, L, N, method='akima',
+                 order=4):
 
         super().__init__(comm, odir, pid, ndims, L, N)
 
@@ -429,11 +601,20 @@ class _hitAnalyzer(_baseAnalyzer):
         self.k = np.sqrt(self.Ksq)
         self.km = (self.k/dk).astype(int)
         self.k1 = k1
+        self._iK = None
+        self._ik1 = {}
+        self._Ghat = {}
 
         if method == 'central_diff':
+            tcfd.central_stencil(1, order)  # raises ValueError if invalid
+            self.order = order
             self.deriv = self._centdiff_deriv
         elif method == 'spline_flux_diff':
             self.deriv = self._akima_deriv
+        elif method == 'pchip':
+            self.deriv = self._pchip_deriv
+        elif method == 'compact':
+            self.deriv = self._compact_deriv
         elif method == 'spectral':
             self.deriv = self._fft_deriv
         else:
@@ -443,13 +624,50 @@ class _hitAnalyzer(_baseAnalyzer):
                       "Defaulting to Akima spline flux differencing.")
             self.deriv = self._akima_deriv
 
+        self._define_fields()
+
+    def _define_fields(self):
+        """
+        Defines the standard derived fields of a velocity snapshot in
+        self.fields, which is started with either or both of the inputs
+        'u' and 'u_hat' (and 'nu' for the dissipation), e.g.
+        analyzer.fields.new_snapshot(tstep, u_hat=U_hat).
+
+        'A' is the velocity gradient tensor A[j, i] = du_i/dx_j, 'S' the
+        strain rate tensor, 'omega' the vorticity, 'div' the dilatation,
+        'KE' the kinetic energy, 'enst' the enstrophy 0.5*omega_i*omega_i,
+        and 'diss' the dissipation 2*nu*S_ij*S_ij.
+        """
+        f = self.fields
+        f.define('u_hat', self.vec_fft, 'u')
+        f.define('u', self.vec_ifft, 'u_hat')
+
+        if self.deriv == self._fft_deriv:
+            f.define('A', self._spectral_grad, 'u_hat')
+            f.define('omega', self._spectral_curl, 'u_hat')
+        else:
+            f.define('A', self.grad, 'u')
+            f.define('omega', self.curl, 'A')
+
+        f.define('S', lambda A: 0.5*(A + np.swapaxes(A, 0, 1)), 'A')
+        f.define('div', lambda A: np.einsum('ii...', A), 'A')
+        f.define('KE', lambda u: 0.5*np.sum(np.square(u), axis=0), 'u')
+        f.define('enst', lambda w: 0.5*np.sum(np.square(w), axis=0),
+                 'omega')
+        f.define('diss', lambda S, nu: 2*nu*np.sum(np.square(S), axis=(0, 1)),
+                 'S', 'nu')
+
     # Spectra -----------------------------------------------------------------
 
-    def spectral_density(self, var, fname, metadata=''):
+    def spectral_density(self, var, fname, metadata='', accumulator=None):
         """
         Write the 1D power spectral density of var to text file. Method
         assumes a real input is in physical space and a complex input is
         in Fourier space.
+
+        If a teslacu.stats.spectrumAccumulator is passed in as
+        accumulator, the 3D spectral density is also added to its running
+        spectrum.
         """
         if np.iscomplexobj(var) is True:
             cdata = var
@@ -468,6 +686,9 @@ class _hitAnalyzer(_baseAnalyzer):
             spect3d = np.sum(spect3d, axis=0)
         spect3d[..., 0] *= 0.5
 
+        if accumulator is not None:
+            accumulator.update(spect3d)
+
         spect1d = tcfft.shell_average(self.comm, spect3d, self.km)
 
         if self.comm.rank == 0:
@@ -505,48 +726,16 @@ class _hitAnalyzer(_baseAnalyzer):
     def vec_fft(self, var):
         """
         Convenience function for MPI-distributed 3D r2c FFT of vector.
+        All components are transformed in a single batched rfft3.
         """
-        nnz, ny, nx = var.shape[1:]
-        nk = nx//2+1
-        nny = ny//self.comm.size
-        nz = nnz*self.comm.size
-
-        if var.dtype.itemsize == 8:
-            fft_complex = np.complex128
-        elif var.dtype.itemsize == 4:
-            fft_complex = np.complex64
-        else:
-            raise AttributeError("cannot detect dataype of u")
-
-        fvar = np.empty([3, nz, nny, nk], dtype=fft_complex)
-        fvar[0] = tcfft.rfft3(self.comm, var[0])
-        fvar[1] = tcfft.rfft3(self.comm, var[1])
-        fvar[2] = tcfft.rfft3(self.comm, var[2])
-
-        return fvar
+        return tcfft.rfft3(self.comm, var)
 
     def vec_ifft(self, fvar):
         """
         Convenience function for MPI-distributed 3D c2r IFFT of vector.
+        All components are transformed in a single batched irfft3.
         """
-        nz, nny, nk = fvar.shape[1:]
-        nx = (nk-1)*2
-        ny = nny*self.comm.size
-        nnz = nz//self.comm.size
-
-        if fvar.dtype.itemsize == 16:
-            fft_real = np.float64
-        elif fvar.dtype.itemsize == 8:
-            fft_real = np.float32
-        else:
-            raise AttributeError("cannot detect dataype of u")
-
-        var = np.empty([3, nnz, ny, nx], dtype=fft_real)
-        var[0] = tcfft.irfft3(self.comm, fvar[0])
-        var[1] = tcfft.irfft3(self.comm, fvar[1])
-        var[2] = tcfft.irfft3(self.comm, fvar[2])
-
-        return var
+        return tcfft.irfft3(self.comm, fvar)
 
     def shell_average(self, E3):
         """
@@ -554,11 +743,29 @@ class _hitAnalyzer(_baseAnalyzer):
         """
         return tcfft.shell_average(self.comm, E3, self.km)
 
+    def spectrum_accumulator(self):
+        """
+        Returns a teslacu.stats.spectrumAccumulator for time-averaged
+        spectra of this analyzer's wavemodes, see spectral_density().
+        """
+        return tcstats.spectrumAccumulator(self.comm, self.km)
+
     def filter_kernel(self, ell, gtype='comp_exp', dtype=np.complex128):
         """
         ell - filter width
         G - user-supplied filter kernel array
+
+        Kernels are cached by (ell, gtype, dtype), since the 'comp_exp'
+        kernel costs two 3D FFTs, and are shared by all callers, so they
+        must not be modified in place.
         """
+        key = (ell, gtype, np.dtype(dtype))
+        if key not in self._Ghat:
+            self._Ghat[key] = self._filter_kernel(ell, gtype, dtype)
+
+        return self._Ghat[key]
+
+    def _filter_kernel(self, ell, gtype, dtype):
         kl = self.k*ell
 
         Ghat = np.zeros(self.k.shape, dtype=dtype)
@@ -579,7 +786,7 @@ class _hitAnalyzer(_baseAnalyzer):
             Ghat = np.where(ball, Hhat, Ghat)
             G0 = tcfft.irfft3(self.comm, Ghat)
             G = G0**2
-            Gbar = self.comm.allreduce(self.psum(G), op=MPI.SUM)
+            Gbar = tcstats.gsum(self.comm, G)
             G = G/Gbar
             Ghat = tcfft.rfft3(self.comm, G)
 
@@ -602,10 +809,323 @@ class _hitAnalyzer(_baseAnalyzer):
         return Ghat
 
     def scalar_filter(self, phi, Ghat):
-        return tcfft.irfft3(self.comm, Ghat*tcfft.rfft3(self.comm, phi))
+        """
+        Filter a scalar field with the kernel Ghat. A complex phi is taken
+        to be already in Fourier space, saving the forward transform.
+        """
+        if not np.iscomplexobj(phi):
+            phi = tcfft.rfft3(self.comm, phi)
+
+        return tcfft.irfft3(self.comm, Ghat*phi)
 
     def vector_filter(self, u, Ghat):
-        return self.vec_ifft(Ghat*self.vec_fft(u))
+        """
+        Filter a vector field with the kernel Ghat. A complex u is taken
+        to be already in Fourier space, saving the forward transform.
+        """
+        if not np.iscomplexobj(u):
+            u = self.vec_fft(u)
+
+        return self.vec_ifft(Ghat*u)
+
+    def multi_filter(self, var, widths, gtype='comp_exp'):
+        """
+        Filter a field at several filter widths and return the filtered
+        fields stacked along a new leading axis, i.e. out[i] is var
+        filtered at widths[i].
+
+        var may be a scalar, vector, or any field whose last three axes
+        are the grid, and a complex var is taken to be already in Fourier
+        space. The field is transformed once, each cached kernel of
+        filter_kernel() is applied to it, and all filtered fields are
+        inverse transformed together in a single batched irfft3.
+        """
+        if np.iscomplexobj(var):
+            var_hat = var
+        else:
+            var_hat = tcfft.rfft3(self.comm, var)
+
+        Ghats = [self.filter_kernel(ell, gtype) for ell in widths]
+
+        dtype = np.result_type(var_hat.dtype, *Ghats)
+        fbar = np.empty((len(Ghats), )+var_hat.shape, dtype=dtype)
+        for i, Ghat in enumerate(Ghats):
+            np.multiply(Ghat, var_hat, out=fbar[i])
+
+        return tcfft.irfft3(self.comm, fbar)
+
+# A Priori SGS Analysis -------------------------------------------------------
+
+    def sgs_a_priori(self, u, widths, gtype='comp_exp', fname=None,
+                     metadata='', callback=None):
+        """
+        Computes the exact subgrid-scale (SGS) stresses of a resolved
+        (e.g. DNS) velocity field,
+            tau_ij = bar(u_i*u_j) - bar(u_i)*bar(u_j),
+        and the SGS dissipation (energy flux), Pi = -tau_ij*bar(S)_ij,
+        where bar(S)_ij is the strain rate of the filtered velocity, for
+        every filter width, as needed for a priori tests of SGS models.
+
+        The velocity and its six products u_i*u_j are transformed
+        together in a single batched rfft3 and reused for every width.
+        For each width, the filtered velocity, products and strain rate
+        (15 fields) are inverse transformed together in a single batched
+        irfft3, using the cached kernels of filter_kernel() and the
+        derivative operator of ik_operator().
+
+        Arguments:
+        ----------
+        u: velocity field, or its Fourier transform if complex
+        widths: sequence of filter widths
+        gtype: (default='comp_exp') filter type, see filter_kernel()
+        fname: (optional) output file name (without the .sgs extension)
+            of the statistics
+        metadata: (default='') header line of the output file
+        callback: (optional) function called as callback(ell, tau, Pi)
+            for every width before the next width is computed, e.g. to
+            write histograms, where tau holds the symmetric tensor
+            components (i, j) of sgs_components, i.e. 11, 12, 13, 22,
+            23, 33
+
+        Returns the statistics as an array of shape (len(widths), 7, 8),
+        of (m1, c2, c3, c4, c5, c6, min, max) of the central_moments() of
+        the six tau components and Pi for every width.
+        """
+        ij = self.sgs_components
+        if np.iscomplexobj(u):
+            u_hat = u
+            u = self.vec_ifft(u_hat)
+            uu_hat = tcfft.rfft3(self.comm, np.array([u[i]*u[j]
+                                                      for i, j in ij]))
+        else:
+            uu = np.empty((9, )+u.shape[1:], dtype=u.dtype)
+            uu[:3] = u
+            for m, (i, j) in enumerate(ij):
+                np.multiply(u[i], u[j], out=uu[3+m])
+            uu_hat = tcfft.rfft3(self.comm, uu)
+            u_hat = uu_hat[:3]
+            uu_hat = uu_hat[3:]
+
+        iK = self.ik_operator()
+        fbar = np.empty((15, )+u_hat.shape[1:],
+                        dtype=np.result_type(u_hat.dtype, np.complex64))
+        tau = np.empty((6, )+u.shape[1:], dtype=u.dtype)
+        stats = np.empty((len(widths), 7, 8))
+
+        for w, ell in enumerate(widths):
+            Ghat = self.filter_kernel(ell, gtype)
+
+            np.multiply(Ghat, u_hat, out=fbar[:3])
+            np.multiply(Ghat, uu_hat, out=fbar[3:9])
+            for m, (i, j) in enumerate(ij):
+                fbar[9+m] = 0.5*(iK[j]*fbar[i] + iK[i]*fbar[j])
+
+            bar = tcfft.irfft3(self.comm, fbar)
+            ubar, Sbar = bar[:3], bar[9:]
+
+            Pi = np.zeros(u.shape[1:], dtype=u.dtype)
+            for m, (i, j) in enumerate(ij):
+                np.subtract(bar[3+m], ubar[i]*ubar[j], out=tau[m])
+                Pi -= (1 + (i != j))*tau[m]*Sbar[m]
+
+            for m, var in enumerate(list(tau) + [Pi]):
+                stats[w, m] = self.central_moments(var)
+
+            if callback is not None:
+                callback(ell, tau, Pi)
+
+        if fname is not None and self.comm.rank == 0:
+            labels = ['tau%d%d' % (i+1, j+1) for i, j in ij] + ['Pi']
+            fh = open('%s%s%s.sgs' % (self.odir, self.prefix, fname), 'w')
+            fh.write('%s\n' % metadata)
+            fh.write('ell  field  m1  c2  c3  c4  c5  c6  min  max\n')
+            for w, ell in enumerate(widths):
+                for m, label in enumerate(labels):
+                    fh.write(('{:14.8e}  {:s}  %s\n' % '  '.join(
+                              ['{:14.8e}']*8)).format(ell, label,
+                                                      *stats[w, m]))
+            fh.close()
+
+        return stats
+
+# Two-point Statistics --------------------------------------------------------
+
+    def two_point_correlation(self, u, v=None):
+        """
+        Returns the two-point correlation R(r) = <u(x) v(x+r)> of the
+        periodic fields u and v (default v = u) for every separation
+        vector r on the grid at once, computed as the FFT cross-
+        correlation irfft3(conj(u_hat)*v_hat)/Nx.
+
+        R has the physical-space decomposition of the inputs, where
+        R[..., iz, iy, ix] is the correlation at r = (ix*dx[2],
+        iy*dx[1], iz*dx[0]) (negative separations are wrapped around as
+        in np.fft.fftfreq). If u and v are vector fields, R is the
+        correlation tensor R[i, j](r) = <u_i(x) v_j(x+r)>.
+        """
+        if u.ndim not in (3, 4):
+            raise ValueError('two_point_correlation expects 3D scalar or 4D '
+                             'vector fields, not %dD' % u.ndim)
+
+        u_hat = tcfft.rfft3(self.comm, u)
+        if v is None:
+            v_hat = u_hat
+        else:
+            v_hat = tcfft.rfft3(self.comm, v)
+
+        if u.ndim == 4:
+            R_hat = np.conj(u_hat)[:, None]*v_hat[None, :]
+        else:
+            R_hat = np.conj(u_hat)*v_hat
+
+        R = tcfft.irfft3(self.comm, R_hat)
+        R *= self.Nxinv
+
+        return R
+
+    def structure_function2(self, u):
+        """
+        Returns the second-order structure function D(r) = <(u(x+r) -
+        u(x))^2> of a periodic field for every separation vector r on
+        the grid at once, derived from the two-point correlation as
+        D(r) = 2*R(0) - R(r) - R(-r), see two_point_correlation().
+        If u is a vector field, D is the structure function tensor
+        D[i, j](r) = <du_i du_j> = 2*R[i, j](0) - R[i, j](r) - R[j, i](r).
+        """
+        R = self.two_point_correlation(u)
+        R0 = self.comm.bcast(R[..., 0, 0, 0].copy())  # r = 0 is on task 0
+
+        if u.ndim == 4:
+            D = -R - np.swapaxes(R, 0, 1)
+            D += 2*R0[..., None, None, None]
+        else:
+            D = 2*R0 - 2*R
+
+        return D
+
+    def structure_functions(self, u, separations, orders=(2, 3, 4, 6),
+                            fname=None, metadata=''):
+        """
+        Computes the structure functions S_p(r) = <du(r)^p> of a periodic
+        field for the given grid separations r (integers, in units of
+        dx) along each coordinate direction, from the increments
+        du(r) = u(x + r*e_i) - u(x). For a vector field, du is the
+        longitudinal increment of u_i along e_i, for a scalar field it is
+        the scalar increment.
+
+        Shifts along the two memory-local axes are local. Shifts along
+        the MPI-decomposed axis are batched by slab offset, so that each
+        task receives every slab it needs only once, however many
+        separations share it, and the exchange of the next slab is
+        pipelined with the computation of the current separations.
+
+        Arguments:
+        ----------
+        u: 3D scalar or 4D vector field
+        separations: sequence of grid separations, 0 < r < nx
+        orders: (default=(2, 3, 4, 6)) orders p of the structure functions
+        fname: (optional) if given, the direction-averaged structure
+            functions are written to the text file <fname>.strfn
+        metadata: (default='') header line of the text file
+
+        Returns S[i, n, m] = S_{orders[n]}(separations[m]) along e_i.
+        """
+        comm = self.comm
+        separations = np.asarray(separations, dtype=int)
+        nr = separations.size
+        sums = np.zeros((3, len(orders), nr))
+
+        def accumulate(i, m, du):
+            for n, p in enumerate(orders):
+                sums[i, n, m] += np.sum(du**p)
+
+        for i in range(3):
+            var = u[i] if u.ndim == 4 else u
+            axis = 2-i
+
+            if axis > 0:    # memory-local shifts
+                for m, r in enumerate(separations):
+                    accumulate(i, m, np.roll(var, -r, axis=axis) - var)
+            else:
+                for m, du in self._z_increments(var, separations):
+                    accumulate(i, m, du)
+
+        comm.Allreduce(MPI.IN_PLACE, sums, op=MPI.SUM)
+        S = sums*self.Nxinv
+
+        if fname is not None and comm.rank == 0:
+            fh = open('%s%s%s.strfn' % (self.odir, self.prefix, fname), 'w')
+            fh.write('%s\n' % metadata)
+            fh.write('r\t%s\n' % '\t'.join('S_%d' % p for p in orders))
+            fmt = '\t'.join(['{:14.8e}']*(len(orders)+1)).format
+            Savg = S.mean(axis=0)
+            for m, r in enumerate(separations):
+                fh.write('%s\n' % fmt(r*self.dx[0], *Savg[:, m]))
+            fh.close()
+
+        return S
+
+    def _z_increments(self, var, separations):
+        """
+        Generator of (index, increment) of var along the MPI-decomposed
+        axis 0 for each grid separation, in increasing order of
+        separation. The shifted field var(z + r) on this task is made of
+        the slabs of the tasks at offsets q = r//nnz and q + 1, which are
+        fetched with non-blocking sends and receives one offset ahead of
+        the computation.
+        """
+        comm = self.comm
+        nnz = var.shape[0]
+        var = np.ascontiguousarray(var)
+
+        order = np.argsort(separations, kind='stable')
+        needs = [(r//nnz, r % nnz) for r in separations[order]]
+        offsets = sorted(set(q for q, s in needs)
+                         | set(q+1 for q, s in needs if s > 0))
+
+        slabs = {}
+        requests = {}
+
+        def post(o):
+            src = (comm.rank + o) % comm.size
+            if src == comm.rank:
+                slabs[o] = var
+                requests[o] = []
+                return
+            slabs[o] = np.empty_like(var)
+            dest = (comm.rank - o) % comm.size
+            tag = o % 32768
+            requests[o] = [comm.Irecv(slabs[o], source=src, tag=tag),
+                           comm.Isend(var, dest=dest, tag=tag)]
+
+        posted = 0
+        for m, (q, s) in zip(order, needs):
+            needed = [q, q+1] if s > 0 else [q]
+
+            # post every exchange this separation needs, plus one more
+            # offset so that it is in flight during the computation
+            while posted < len(offsets) and offsets[posted] <= needed[-1]+1:
+                post(offsets[posted])
+                posted += 1
+
+            for o in needed:
+                MPI.Request.Waitall(requests[o])
+
+            # slabs at offsets below q are no longer needed
+            for o in [o for o in slabs if o < q]:
+                MPI.Request.Waitall(requests.pop(o))
+                del slabs[o]
+
+            du = np.empty_like(var)
+            du[:nnz-s] = slabs[q][s:]
+            if s > 0:
+                du[nnz-s:] = slabs[q+1][:s]
+            du -= var
+
+            yield m, du
+
+        for o in requests:
+            MPI.Request.Waitall(requests[o])
 
 # Scalar and Vector Derivatives -----------------------------------------------
 
@@ -613,8 +1133,8 @@ class _hitAnalyzer(_baseAnalyzer):
         """
         Calculate and return the divergence of a vector field.
 
-        Currently the slab_exchange routines limit this function to vector
-        fields.
+        Only one component is differentiated along each axis, so this
+        needs a single exchange along the decomposed axis.
         """
         div = self.deriv(var[0], dim=0)  # axis=2
         div+= self.deriv(var[1], dim=1)  # axis=1
@@ -633,15 +1153,18 @@ class _hitAnalyzer(_baseAnalyzer):
             omega = np.einsum('ijk,jk...->i...', e, var)
 
         elif var.ndim == 4:     # var is the vector field
+            # both derivatives along the decomposed axis in one exchange
+            d3 = self.deriv(var[:2], dim=2)
+
             omega = np.empty_like(var)
-            omega[0] = self.deriv(var[1], dim=2)
-            omega[0]-= self.deriv(var[2], dim=1)
+            omega[0] = self.deriv(var[2], dim=1)
+            omega[0]-= d3[1]
 
-            omega[1] = self.deriv(var[2], dim=0)
-            omega[1]-= self.deriv(var[0], dim=2)
+            omega[1] = d3[0]
+            omega[1]-= self.deriv(var[2], dim=0)
 
-            omega[2] = self.deriv(var[0], dim=1)
-            omega[2]-= self.deriv(var[1], dim=0)
+            omega[2] = self.deriv(var[1], dim=0)
+            omega[2]-= self.deriv(var[0], dim=1)
         else:
             raise
 
@@ -665,6 +1188,8 @@ class _hitAnalyzer(_baseAnalyzer):
     def grad(self, var):
         """
         Calculate and return the gradient tensor field of a vector field.
+        All three components are differentiated along each axis at once,
+        so that only one exchange is needed along the decomposed axis.
         """
 
         shape = list(var.shape)
@@ -672,18 +1197,29 @@ class _hitAnalyzer(_baseAnalyzer):
         A = np.empty(shape, dtype=var.dtype)
 
         for j in range(3):
-            for i in range(3):
-                A[j, i] = self.deriv(var[i], dim=j)
+            A[j] = self.deriv(var, dim=j)
 
         return A
 
     def grad_curl_div(self, u):
         """
-        Uses numpy.einsum which can be dramatically faster than
-        alternative routines for many use cases
+        Calculate and return the gradient tensor, vorticity, and
+        dilatation of a vector field.
+
+        If u is complex, it is taken to be the Fourier transform of the
+        vector field (e.g. the U_hat of a spectral solver), and the
+        gradient tensor is computed spectral-first with a single batched
+        inverse transform of all nine components of i*k_j*u_i, using the
+        cached derivative operator of ik_operator(). Otherwise grad() is
+        used, which for spectral derivatives is cheaper than forward 3D
+        transforms. The vorticity and dilatation are contracted from the
+        gradient tensor with numpy.einsum, which can be dramatically
+        faster than alternative routines for many use cases.
         """
-
-        A = self.grad(u)
+        if np.iscomplexobj(u):
+            A = self._spectral_grad(u)
+        else:
+            A = self.grad(u)
 
         e = np.zeros((3, 3, 3))
         e[0, 1, 2] = e[1, 2, 0] = e[2, 0, 1] = 1
@@ -694,34 +1230,64 @@ class _hitAnalyzer(_baseAnalyzer):
 
         return A, omega, Aii
 
+    def _spectral_grad(self, u_hat):
+        """gradient tensor of a vector field from its Fourier transform"""
+        iK = self.ik_operator().astype(u_hat.dtype, copy=False)
+        return tcfft.irfft3(self.comm, iK[:, None]*u_hat)
+
+    def _spectral_curl(self, u_hat):
+        """curl of a vector field from its Fourier transform"""
+        iK = self.ik_operator().astype(u_hat.dtype, copy=False)
+        return tcfft.irfft3(self.comm, np.cross(iK, u_hat, axis=0))
+
+    def ik_operator(self):
+        """
+        Returns the memory-local spectral first-derivative operator
+        2*pi*i*K_j in vector-component order (K_1, K_2, K_3), with the Nyquist
+        modes zeroed as in the 1D FFT derivatives, so that derivatives of
+        real fields stay real. It is computed once and cached.
+        """
+        if self._iK is None:
+            iK = 2j*np.pi*self.K[::-1]  # K is in cycles per unit length
+            nyq3 = np.fft.fftfreq(self.nx[0]) == -0.5
+            nyq2 = np.fft.fftfreq(self.nx[1])[self.ixs[0]:self.ixe[0]] == -0.5
+            nyq1 = np.fft.rfftfreq(self.nx[2]) == 0.5
+            iK[2][nyq3] = 0
+            iK[1][:, nyq2] = 0
+            iK[0][..., nyq1] = 0
+            self._iK = iK
+
+        return self._iK
+
 # Underlying Linear Algebra Routines ------------------------------------------
     # Note that the FFT derivative does not rely on the teslacu FFT package
     # This allows FFT-based derivatives to conform to a consistent deriv
     # template for all types of numerical differentiation.
     # The 'k' parameter asks for the order of the derivative, but only the FFT
     # derivative can provide any order derivative to the user.
+    # All derivative routines batch any leading axes of var (e.g. the
+    # components of a vector field) into a single halo or slab exchange.
 
     # @profile
     def _centdiff_deriv(self, var, dim=0, k=1):
         """
         Calculate and return the specified derivative of a 3D scalar field at
-        the specified order of accuracy.
-        While k is passed on to the central_deriv function in the teslacu
-        finite difference module, central_deriv may not honor a request for
-        anything but the first derivative, depending on it's state of
-        development.
+        the order of accuracy self.order (2, 4, 6, or 8) of the analyzer.
+        The central_deriv function in the teslacu finite difference module
+        computes first (k=1) and second (k=2) derivatives.
         """
         dim = dim % 3
-        axis = 2-dim
-        if axis == 0:
-            var = self.z2y_slab_exchange(var)
-
-        deriv = tcfd.central_deriv(var, self.dx[axis], bc='periodic',
-                                   k=k, order=4, axis=axis)
-        if axis == 0:
-            deriv = self.y2z_slab_exchange(deriv)
+        axis = var.ndim-1-dim
+        if dim == 2:
+            # order//2 ghost planes from the neighbouring tasks replace the
+            # periodic wrap-around of the global transpose
+            var = self.z_halo_exchange(var, self.order//2)
+            bc = 'ghost_zones'
+        else:
+            bc = 'periodic'
 
-        return deriv
+        return tcfd.central_deriv(var, self.dx[2-dim], bc=bc, k=k,
+                                  order=self.order, axis=axis)
 
     def _akima_deriv(self, var, dim=0, k=1):
         """
@@ -729,13 +1295,53 @@ class _hitAnalyzer(_baseAnalyzer):
         The k parameter is ignored, a first derivative is _always_ returned.
         """
         dim = dim % 3
-        axis = 2-dim
-        if axis == 0:
+        axis = var.ndim-1-dim
+        scale = None
+        if dim == 2:
+            var = self.z_halo_exchange(var, 3)
+            bc = 'ghost_zones'
+
+            # the undefined-slope cutoff of each z line, which is spread
+            # across all tasks
+            scale = tcas.cutoff_scale(var, bc=bc, axis=axis)
+            self.comm.Allreduce(MPI.IN_PLACE, scale, op=MPI.MAX)
+        else:
+            bc = 'periodic'
+
+        return tcas.deriv(var, self.dx[2-dim], bc=bc, axis=axis, scale=scale)
+
+    def _pchip_deriv(self, var, dim=0, k=1):
+        """
+        Calculate and return the _first_ derivative of a 3D scalar field
+        from its monotone piecewise cubic Hermite interpolant.
+        The k parameter is ignored, a first derivative is _always_ returned.
+        """
+        dim = dim % 3
+        axis = var.ndim-1-dim
+        if dim == 2:
+            var = self.z_halo_exchange(var, 1)
+            bc = 'ghost_zones'
+        else:
+            bc = 'periodic'
+
+        return tcpc.deriv(var, self.dx[2-dim], bc=bc, axis=axis)
+
+    def _compact_deriv(self, var, dim=0, k=1):
+        """
+        Calculate and return the _first_ derivative of a 3D scalar field
+        with the 6th order compact finite difference scheme.
+        The k parameter is ignored, a first derivative is _always_ returned.
+        Since compact schemes couple entire grid lines, derivatives along
+        the decomposed axis use the global slab transposes.
+        """
+        dim = dim % 3
+        axis = var.ndim-1-dim
+        if dim == 2:
             var = self.z2y_slab_exchange(var)
 
-        deriv = tcas.deriv(var, self.dx[axis], axis=axis)
+        deriv = tccd.deriv(var, self.dx[2-dim], order=6, axis=axis)
 
-        if axis == 0:
+        if dim == 2:
             deriv = self.y2z_slab_exchange(deriv)
 
         return deriv
@@ -747,18 +1353,19 @@ class _hitAnalyzer(_baseAnalyzer):
         MPI-decomposed 3D FFTs.
         """
         dim = dim % 3
-        axis = 2-dim
+        axis = var.ndim-1-dim
         s = [1]*var.ndim
         s[axis] = self.k1.shape[0]
-        K = self.k1.reshape(s)
+        if k not in self._ik1:  # k1 is in cycles per unit length
+            self._ik1[k] = np.power(2j*np.pi*self.k1, k)
+        iK = self._ik1[k].reshape(s)
 
-        if axis == 0:
+        if dim == 2:
             var = self.z2y_slab_exchange(var)
 
-        deriv = np.fft.irfft(
-                    np.power(1j*K, k)*np.fft.rfft(var, axis=axis), axis=axis)
+        deriv = np.fft.irfft(iK*np.fft.rfft(var, axis=axis), axis=axis)
 
-        if axis == 0:
+        if dim == 2:
             deriv = self.y2z_slab_exchange(deriv)
 
         return deriv
@@ -1,3 +1,5 @@
 from ._stats_mpi4py_numpy import *
+from ._accumulators_mpi4py import *
+from ._sketches_mpi4py_numpy import *
 
 __all__=[]
@@ -0,0 +1,310 @@
+"""
+MPI-distributed streaming statistics accumulators. An accumulator is
+updated in place with each new snapshot of MPI-decomposed data and holds
+the running statistics of every snapshot seen so far, so that time-
+averaged statistics of a stationary simulation do not have to be
+assembled from hundreds of per-snapshot output files.
+
+Updates are memory-local. The partial statistics of all tasks are only
+combined (in a single collective call) when they are read, and the
+reduced result is cached until the next update. Reading an accumulator
+is therefore collective: every task of comm must read it together.
+
+The state() of an accumulator is a small dictionary of the globally
+reduced statistics that can be saved with a checkpoint (e.g. as
+spectralLES.write_checkpoint() metadata). Since the statistics are
+mergeable, a run restarted with load_state(), even on a different number
+of tasks, continues the running statistics as if it had never stopped.
+"""
+
+from mpi4py import MPI
+import numpy as np
+from math import comb
+
+from ._stats_mpi4py_numpy import (local_moments, merge_moments,
+                                  uniform_histogram, _moments_type,
+                                  _moments_op)
+
+__all__ = ['momentsAccumulator', 'histogramAccumulator',
+           'spectrumAccumulator']
+
+
+class _accumulator(object):
+    """
+    Base class of the streaming accumulators. Subclasses keep their
+    memory-local partial statistics in the float64 array self._local and
+    implement _reduce(), which returns the global statistics.
+    """
+
+    def __init__(self, comm):
+        self.comm = comm
+        self._global = None
+
+    def _updated(self):
+        self._global = None  # invalidate the cached global statistics
+
+    @property
+    def reduced(self):
+        """global statistics of all tasks (collective on first read)"""
+        if self._global is None:
+            self._global = self._reduce()
+        return self._global
+
+    def reset(self):
+        """discard all accumulated statistics"""
+        self._local[...] = self._empty()
+        self._updated()
+
+    def merge(self, other):
+        """
+        Merges the memory-local statistics of another accumulator of the
+        same type and configuration into this one.
+        """
+        if type(other) is not type(self):
+            raise ValueError('cannot merge a %s into a %s'
+                             % (type(other).__name__, type(self).__name__))
+        self._merge(other._local)
+        self._updated()
+
+    def state(self):
+        """
+        Returns the globally reduced statistics as a picklable dictionary
+        (collective).
+        """
+        return {'type': type(self).__name__, 'data': self.reduced.copy()}
+
+    def load_state(self, state):
+        """
+        Restores the statistics saved by state(). Every task must pass in
+        the same state, which is loaded by task 0 only so that it is
+        counted once in the global statistics.
+        """
+        if state['type'] != type(self).__name__:
+            raise ValueError('cannot load a %s state into a %s'
+                             % (state['type'], type(self).__name__))
+        data = np.asarray(state['data'], dtype=np.float64)
+        if data.shape != self._local.shape:
+            raise ValueError('state shape %s does not match accumulator '
+                             'shape %s' % (data.shape, self._local.shape))
+
+        if self.comm.rank == 0:
+            self._local[...] = data
+        else:
+            self._local[...] = self._empty()
+        self._updated()
+
+
+class momentsAccumulator(_accumulator):
+    """
+    Running (weighted) min, max, mean, and 2nd-6th central moments, kept
+    as the mergeable partial moments of local_moments() and combined with
+    the pairwise update formulas of merge_moments().
+
+    Class Constructor:
+
+        Regular Arguments:
+            comm: MPI communicator
+
+    Example:
+    --------
+        acc = momentsAccumulator(comm)
+        for each snapshot:
+            acc.update(enst)
+        m1, c2, c3, c4, c5, c6, gmin, gmax = acc.moments()
+    """
+
+    def __init__(self, comm):
+        super().__init__(comm)
+        self._local = self._empty()
+
+    def _empty(self):
+        return np.array([0.0]*7 + [np.nan]*2)
+
+    def _merge(self, stats):
+        self._local[...] = merge_moments(self._local, stats)
+
+    def _reduce(self):
+        stats = self._local.copy()
+        self.comm.Allreduce(MPI.IN_PLACE, [stats, _moments_type],
+                            op=_moments_op)
+        return stats
+
+    def update(self, data, w=None):
+        """
+        Adds the memory-local data (optionally weighted by w) to the
+        running moments.
+        """
+        self._merge(local_moments(data, w))
+        self._updated()
+
+    @property
+    def count(self):
+        """global sum of weights (number of points if unweighted)"""
+        return self.reduced[0]
+
+    def moments(self, m1=None):
+        """
+        Returns the global m1, c2, c3, c4, c5, c6, gmin, gmax of all data
+        seen so far, in the same form as central_moments(). To get raw
+        moments, simply pass in m1=0.
+        """
+        stats = self.reduced
+        W, mean = stats[:2]
+        if W == 0:
+            return (np.nan, )*8
+
+        if m1 is None:
+            m1 = mean
+
+        M = np.concatenate(([W, 0.0], stats[2:7]))
+        d = mean - m1
+        c = [sum(comb(p, k)*M[k]*d**(p-k) for k in range(p+1))/W
+             for p in range(2, 7)]
+
+        return (m1, *c, stats[7], stats[8])
+
+
+class histogramAccumulator(_accumulator):
+    """
+    Running fixed-bin histogram. Since the bins cannot change between
+    updates, values outside of the range are counted separately in
+    underflow and overflow bins. Non-finite values are ignored.
+
+    Class Constructor:
+
+        Regular Arguments:
+            comm: MPI communicator
+            range: (min, max) of the histogram bins
+
+        Optional Keyword Arguments:
+            bins: (default=100) number of bins
+    """
+
+    def __init__(self, comm, range, bins=100):
+        super().__init__(comm)
+        gmin, gmax = range
+        if not gmax > gmin:
+            raise ValueError('histogram range must be (min, max), min < max')
+        self.range = (float(gmin), float(gmax))
+        self.bins = bins
+        self.width = (gmax - gmin)/bins
+        self._local = self._empty()
+
+    def _empty(self):
+        return np.zeros(self.bins+2)  # [underflow, bins..., overflow]
+
+    def _merge(self, counts):
+        self._local += counts
+
+    def _reduce(self):
+        counts = self._local.copy()
+        self.comm.Allreduce(MPI.IN_PLACE, counts, op=MPI.SUM)
+        return counts
+
+    def update(self, data, w=None):
+        """
+        Adds the memory-local data (optionally weighted by w) to the
+        running histogram.
+        """
+        data = np.asarray(data)
+        if w is not None:
+            w = np.broadcast_to(w, data.shape)
+
+        gmin, gmax = self.range
+        finite = np.isfinite(data)
+        below = finite & (data < gmin)
+        above = finite & (data > gmax)
+        if w is None:
+            self._local[0] += np.count_nonzero(below)
+            self._local[-1] += np.count_nonzero(above)
+        else:
+            self._local[0] += np.sum(w[below])
+            self._local[-1] += np.sum(w[above])
+
+        self._local[1:-1] += uniform_histogram(data, self.bins, self.range, w)
+        self._updated()
+
+    @property
+    def edges(self):
+        return np.linspace(*self.range, self.bins+1)
+
+    @property
+    def counts(self):
+        """global counts of the in-range bins"""
+        return self.reduced[1:-1]
+
+    @property
+    def underflow(self):
+        return self.reduced[0]
+
+    @property
+    def overflow(self):
+        return self.reduced[-1]
+
+    def pmf(self):
+        """
+        Returns the probability mass function of the in-range bins,
+        normalized by all counts, including underflow and overflow.
+        """
+        total = self.reduced.sum()
+        return self.counts/total if total > 0 else np.zeros(self.bins)
+
+
+class spectrumAccumulator(_accumulator):
+    """
+    Running shell-averaged spectrum of a 3D Fourier-space spectral
+    density. Each update adds the memory-local shell sums of one
+    snapshot, so the time-averaged spectrum costs no communication until
+    it is read.
+
+    Class Constructor:
+
+        Regular Arguments:
+            comm: MPI communicator
+            km: wavemode of each memory-local wavevector, see
+                teslacu.fft.shell_average()
+
+        Optional Keyword Arguments:
+            nk: (default=km.shape[-1]) length of the 1D spectrum
+    """
+
+    def __init__(self, comm, km, nk=None):
+        super().__init__(comm)
+        self.km = np.ravel(km)
+        self.nk = km.shape[-1] if nk is None else nk
+        self._keep = self.km < self.nk  # drop the corner modes
+        self._local = self._empty()
+
+    def _empty(self):
+        return np.zeros(self.nk+1)  # [number of snapshots, spectrum...]
+
+    def _merge(self, sums):
+        self._local += sums
+
+    def _reduce(self):
+        sums = self._local.copy()
+        self.comm.Allreduce(MPI.IN_PLACE, sums[1:], op=MPI.SUM)
+        self.comm.Allreduce(MPI.IN_PLACE, sums[:1], op=MPI.MAX)
+        return sums
+
+    def update(self, E3):
+        """
+        Adds one snapshot of the memory-local 3D spectral density E3
+        (e.g. real(u_hat*conj(u_hat))) to the running spectrum.
+        """
+        E3 = np.ravel(E3)
+        self._local[1:] += np.bincount(self.km[self._keep],
+                                       weights=E3[self._keep],
+                                       minlength=self.nk)
+        self._local[0] += 1
+        self._updated()
+
+    @property
+    def count(self):
+        """number of snapshots"""
+        return self.reduced[0]
+
+    def mean(self):
+        """Returns the time-averaged 1D spectrum (collective)."""
+        n = self.count
+        return self.reduced[1:]/n if n > 0 else np.zeros(self.nk)
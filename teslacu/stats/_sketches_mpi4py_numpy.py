@@ -0,0 +1,230 @@
+"""
+MPI-distributed quantile sketches. Medians, percentiles, and the extreme
+tails of MPI-decomposed data are estimated from mergeable t-digests
+(T. Dunning and O. Ertl, "Computing extremely accurate quantiles using
+t-digests", 2019), without ever gathering or sorting the global data.
+
+A t-digest summarizes data as fewer than delta weighted centroids, whose
+sizes are limited by the logarithmic (k2) scale function, so that the
+number of points in a centroid near either tail is proportional to its
+quantile (or one minus its quantile) and extreme tail quantiles keep
+the same relative accuracy as the median. Every task reduces its data
+to a digest in chunks of `chunk` points, and the digests of all tasks
+are merged in a single Allreduce with a user-defined MPI reduction.
+Memory use is therefore bounded by the chunk and digest sizes,
+independent of the data size.
+
+Digests are float64 arrays with the fixed layout
+    [delta, W, min, max, n, means[0:cmax], weights[0:cmax]],
+where W is the total weight, n the number of centroids, and
+cmax = delta + 2.
+"""
+
+from mpi4py import MPI
+import numpy as np
+
+__all__ = ['local_tdigest', 'merge_tdigests', 'tdigest_quantiles',
+           'tdigest_cdf', 'quantiles']
+
+_chunk = 2**16
+_head = 5
+
+
+def _cmax(delta):
+    return int(delta) + 2
+
+
+def _empty_tdigest(delta):
+    digest = np.zeros(_head + 2*_cmax(delta))
+    digest[:4] = (delta, 0.0, np.inf, -np.inf)
+    return digest
+
+
+def _centroids(digest):
+    n = int(digest[4])
+    cmax = (digest.size - _head)//2
+    means = digest[_head:_head+n]
+    weights = digest[_head+cmax:_head+cmax+n]
+    return means, weights
+
+
+def _merge_sorted(m1, w1, m2, w2):
+    """merges two sets of centroids, each sorted by mean, in O(n)"""
+    index = np.searchsorted(m1, m2, side='right')
+    return np.insert(m1, index, m2), np.insert(w1, index, w2)
+
+
+def _compress(digest, means, weights):
+    """
+    Merges the centroids means and weights, sorted by mean, into the
+    groups of equal integer part of the scale function
+    k2 = delta/Z*log(q/(1-q)), Z = 4*log(W/delta) + 24, of their center
+    quantile q, and stores the groups in digest. There are fewer than
+    delta groups for any total weight W.
+    """
+    delta = digest[0]
+    cmax = _cmax(delta)
+
+    W = np.sum(weights)
+    below = np.cumsum(weights) - 0.5*weights
+    above = W - below   # both without cancellation near the tails
+    Z = 4*np.log(max(W/delta, 1.0)) + 24
+    k = delta/Z*np.log(below/above)
+    group = np.floor(k).astype(np.intp)
+    group = np.minimum(group - group[0], cmax-1)
+
+    weights_g = np.bincount(group, weights=weights)
+    keep = weights_g > 0
+    means_g = np.bincount(group, weights=weights*means)[keep]
+    weights_g = weights_g[keep]
+    means_g /= weights_g
+
+    n = weights_g.size
+    digest[1] = W
+    digest[4] = n
+    digest[_head:_head+n] = means_g
+    digest[_head+cmax:_head+cmax+n] = weights_g
+
+    return digest
+
+
+def local_tdigest(data, w=None, delta=500, chunk=_chunk):
+    """
+    Returns the t-digest of the memory-local data, optionally weighted
+    by w. Non-finite values are ignored.
+
+    The data are read in chunks of `chunk` points, each of which is
+    merged into the running digest, so that only chunk-sized
+    temporaries are created.
+
+    Arguments:
+    ----------
+    data: array of any shape
+    w: (optional) weights, broadcastable to the shape of data
+    delta: (default=500) compression parameter, the digest holds fewer
+        than delta centroids
+    """
+    digest = _empty_tdigest(delta)
+
+    ops = [np.asarray(data)]
+    if w is not None:
+        ops.append(np.asarray(w))
+
+    it = np.nditer(ops, flags=['external_loop', 'buffered', 'zerosize_ok'],
+                   op_dtypes=[np.float64]*len(ops), casting='same_kind',
+                   buffersize=chunk)
+    for xs in it:
+        if len(ops) == 1:
+            x = np.sort(xs[np.isfinite(xs)])
+            wc = np.ones_like(x)
+        else:
+            x, wc = xs
+            keep = np.isfinite(x) & (wc > 0)
+            order = np.argsort(x[keep])
+            x = x[keep][order]
+            wc = wc[keep][order]
+
+        if x.size == 0:
+            continue
+
+        digest[2] = min(digest[2], x[0])
+        digest[3] = max(digest[3], x[-1])
+
+        means, weights = _centroids(digest)
+        _compress(digest, *_merge_sorted(x, wc, means, weights))
+
+    return digest
+
+
+def merge_tdigests(a, b):
+    """
+    Returns the t-digest of the union of the data summarized by the
+    t-digests a and b, which must have the same delta.
+    """
+    if a[0] != b[0] or a.size != b.size:
+        raise ValueError('cannot merge t-digests with different delta')
+
+    c = _empty_tdigest(a[0])
+    c[2] = min(a[2], b[2])
+    c[3] = max(a[3], b[3])
+
+    ma, wa = _centroids(a)
+    mb, wb = _centroids(b)
+    if wa.size + wb.size > 0:
+        _compress(c, *_merge_sorted(ma, wa, mb, wb))
+
+    return c
+
+
+def _interpolants(digest):
+    """cumulative weights of the centroid centers, including min and max"""
+    means, weights = _centroids(digest)
+    W = digest[1]
+    pos = np.concatenate(([0.0], np.cumsum(weights) - 0.5*weights, [W]))
+    vals = np.concatenate(([digest[2]], means, [digest[3]]))
+
+    return pos, vals
+
+
+def tdigest_quantiles(digest, q):
+    """
+    Returns the estimated quantiles q (scalar or array in [0, 1]) of the
+    data summarized by a t-digest, interpolated linearly between the
+    centroid centers and the exact min and max.
+    """
+    if digest[1] == 0:
+        return np.full(np.shape(q), np.nan)[()]
+
+    pos, vals = _interpolants(digest)
+    return np.interp(np.asarray(q)*digest[1], pos, vals)
+
+
+def tdigest_cdf(digest, x):
+    """
+    Returns the estimated fraction of the data (by weight) that is less
+    than or equal to x (scalar or array), the inverse of
+    tdigest_quantiles(). Tail probabilities are 1 - tdigest_cdf().
+    """
+    if digest[1] == 0:
+        return np.full(np.shape(x), np.nan)[()]
+
+    pos, vals = _interpolants(digest)
+    # np.interp needs increasing x-coordinates, so ties in vals (e.g.
+    # singleton centroids at min or max) keep their largest position
+    vals, last = np.unique(vals[::-1], return_index=True)
+    pos = pos[::-1][last]
+    return np.interp(x, vals, pos)/digest[1]
+
+
+def _tdigest_reduce(inbuf, inoutbuf, datatype):
+    """MPI user-defined reduction of t-digests"""
+    a = np.frombuffer(inbuf, dtype=np.float64)
+    b = np.frombuffer(inoutbuf, dtype=np.float64)
+    b[...] = merge_tdigests(a, b)
+
+
+# as for teslacu.stats.central_moments(), each digest is reduced as one
+# MPI element by a non-commutative op, so that the digests are always
+# merged in rank order and every task gets bitwise identical results
+_tdigest_op = MPI.Op.Create(_tdigest_reduce, commute=False)
+_tdigest_types = {}
+
+
+def quantiles(comm, data, q, w=None, delta=500):
+    """
+    Returns the estimated global quantiles q (scalar or array in [0, 1])
+    of MPI-decomposed data, optionally weighted by w, along with the
+    global t-digest of the data, which can be passed to
+    tdigest_quantiles() and tdigest_cdf() for further quantiles and tail
+    probabilities without communication.
+    """
+    digest = local_tdigest(data, w, delta)
+
+    if digest.size not in _tdigest_types:
+        _tdigest_types[digest.size] = MPI.DOUBLE.Create_contiguous(
+                                                    digest.size).Commit()
+    dtype = _tdigest_types[digest.size]
+
+    comm.Allreduce(MPI.IN_PLACE, [digest, dtype], op=_tdigest_op)
+
+    return tdigest_quantiles(digest, q), digest
@@ -5,20 +5,161 @@ domain decomposition or dimensionality.
 
 from mpi4py import MPI
 import numpy as np
+import builtins
+from math import comb
 
-__all__ = ['psum', 'central_moments', 'histogram1', 'histogram2']
+__all__ = ['psum', 'gsum', 'sum_limbs', 'limbs_to_float', 'central_moments',
+           'local_moments', 'merge_moments', 'uniform_histogram',
+           'histogram1', 'histograms', 'histogram2', 'conditional_moments']
 
 
 def psum(data):
     """
     input argument data can be any n-dimensional array-like object, including
     a 0D scalar value or 1D array.
+
+    Returns the exact sum of data, correctly rounded to float64 (complex
+    data are summed component-wise), which is independent of the order,
+    and therefore the memory layout and decomposition, of the data. See
+    sum_limbs() for the algorithm.
+    """
+    data = np.asarray(data)
+    if np.iscomplexobj(data):
+        return complex(psum(data.real), psum(data.imag))
+
+    return limbs_to_float(sum_limbs(data))
+
+
+def gsum(comm, data, batch=False):
+    """
+    Returns the exact global sum of MPI-decomposed data, correctly rounded
+    to float64. Since the partial sums are exact integers, the result is
+    bitwise identical for any number of tasks and any decomposition.
+
+    If batch is True, each data[i] is summed separately and an array of
+    global sums is returned, still using only one Allreduce.
     """
-    psum = np.array(data)
-    for n in range(psum.ndim):
-        psum.sort(axis=-1)
-        psum = np.sum(psum, axis=-1)
-    return psum
+    if np.iscomplexobj(data):
+        data = np.asarray(data)
+        sums = gsum(comm, [data.real, data.imag], batch=True)
+        return sums[0] + 1j*sums[1]
+
+    if batch:
+        limbs = np.array([sum_limbs(d) for d in data])
+    else:
+        limbs = sum_limbs(data)
+
+    comm.Allreduce(MPI.IN_PLACE, limbs, op=MPI.SUM)
+
+    if batch:
+        return np.array([limbs_to_float(l) for l in limbs])
+
+    return limbs_to_float(limbs)
+
+
+# exact summation -------------------------------------------------------------
+# Sums are accumulated exactly as integers on a fixed grid of 32-bit "limbs",
+# where limb j holds multiples of 2^(32*j-1074), so that any two partial sums
+# can be combined exactly (MPI.SUM of int64) in any order.
+# For each chunk of data, the bits in the range of the highest occupied limb
+# j are extracted from every value with the error-free transformation
+# q = (x + B) - B, B = 1.5*2^(32*j-1022), which rounds x to a multiple of
+# 2^(32*j-1074). Since |q| <= 2^(32*j-1042) and a chunk has far fewer than
+# 2^21 points, np.sum(q) is exact in any summation order. The remainder x-q
+# (also exact) then goes to the next-lower limb, until it is zero.
+# The three entries after the limbs count +inf, -inf, and nan values.
+_nlimbs = 68
+_chunk = 2**16  # chunks of 512 KiB stay in cache for the extraction sweeps
+_big = 2.0**900
+
+
+def sum_limbs(data):
+    """
+    Returns the exact sum of real data as an int64 array of carry-
+    normalized limbs (plus counts of non-finite values) that can be added
+    together exactly (see gsum()) and converted back to float64 with
+    limbs_to_float(). The data are read in chunks without copying (except
+    for any cast of a chunk to float64), and only chunk-sized work arrays
+    are allocated.
+    """
+    limbs = np.zeros(_nlimbs+3, dtype=np.int64)
+    q = np.empty(_chunk)
+    r = np.empty(_chunk)
+    mask = np.int64(0xFFFFFFFF)
+
+    it = np.nditer(np.asarray(data),
+                   flags=['external_loop', 'buffered', 'zerosize_ok'],
+                   op_dtypes=[np.float64], casting='same_kind',
+                   buffersize=_chunk)
+    for x in it:
+        m = max(x.max(), -x.min())
+        if not np.isfinite(m):
+            limbs[-3] += np.count_nonzero(x == np.inf)
+            limbs[-2] += np.count_nonzero(x == -np.inf)
+            limbs[-1] += np.count_nonzero(np.isnan(x))
+            x = np.where(np.isfinite(x), x, 0.0)
+            m = max(x.max(), -x.min())
+
+        if m >= _big:
+            # the extraction constant B would overflow, so huge values are
+            # scaled down by 2^256 (exactly) and accumulated 8 limbs up
+            big = np.abs(x) >= _big
+            _extract(np.where(big, x*2.0**-256, 0.0), limbs, q, r, 8)
+            x = np.where(big, 0.0, x)
+
+        _extract(x, limbs, q, r, 0)
+
+        # carry-normalize all but the (signed) top limb into [0, 2^32)
+        carry = limbs[:_nlimbs-1] >> 32
+        limbs[:_nlimbs-1] &= mask
+        limbs[1:_nlimbs] += carry
+
+    return limbs
+
+
+def _extract(x, limbs, q, r, shift):
+    """exactly adds the finite values |x| < 2^900 to limbs[shift:]"""
+    n = x.size
+    q = q[:n]
+    r = r[:n]
+    m = max(x.max(), -x.min()) if n else 0.0
+
+    while m > 0:
+        # the highest limb j that holds any bits of m < 2^e
+        j = -(-(int(np.frexp(m)[1]) + 1074)//32) - 1
+        B = np.ldexp(1.5, 32*j-1022)
+        np.add(x, B, out=q)
+        q -= B
+        np.subtract(x, q, out=r)
+        limbs[j+shift] += int(np.ldexp(q.sum(), 1074-32*j))
+        x = r
+        m = max(x.max(), -x.min())
+
+    return
+
+
+def limbs_to_float(limbs):
+    """
+    Returns the correctly rounded float64 value of an exact sum
+    represented as limbs, see sum_limbs().
+    """
+    ninf_pos, ninf_neg, nnan = limbs[-3:]
+    if nnan or (ninf_pos and ninf_neg):
+        return np.nan
+    elif ninf_pos:
+        return np.inf
+    elif ninf_neg:
+        return -np.inf
+
+    total = 0
+    for k in range(_nlimbs-1, -1, -1):
+        total = (total << 32) + int(limbs[k])
+
+    # Python's int true division is correctly rounded
+    try:
+        return total/(1 << 1074)
+    except OverflowError:
+        return np.inf if total > 0 else -np.inf
 
 
 def central_moments(comm, N, data, w=None, wbar=None, m1=None):
@@ -30,54 +171,291 @@ def central_moments(comm, N, data, w=None, wbar=None, m1=None):
     To get weighted moments, bass in the weighting coefficients, w.
     If you've already calculated the mean of w, save some computations and pass
     it in as wbar.
+
+    The data are read in a single chunked pass, and each task's partial
+    moments are combined with all other tasks' in one Allreduce (see
+    local_moments() and merge_moments()).
     """
-    gmin = comm.allreduce(np.nanmin(data), op=MPI.MIN)
-    gmax = comm.allreduce(np.nanmax(data), op=MPI.MAX)
+    stats = local_moments(data, w)
+    comm.Allreduce(MPI.IN_PLACE, [stats, _moments_type], op=_moments_op)
+    W, mean = stats[:2]
+    gmin, gmax = stats[-2:]
 
     if w is None:   # unweighted moments
-        w = 1
         wbar = 1
-    else:
-        if wbar is None:
-            wbar = comm.allreduce(psum(w), op=MPI.SUM)/N
+    elif wbar is None:
+        wbar = W/N
 
     N = N*wbar
 
     # 1st raw moment
     if m1 is None:
-        m1 = comm.allreduce(psum(w*data), op=MPI.SUM)/N
+        m1 = W*mean/N
 
-    # 2nd-6th centered moments
-    cdata = data-m1
-    c2 = comm.allreduce(psum(w*np.power(cdata, 2)), op=MPI.SUM)/N
-    c3 = comm.allreduce(psum(w*np.power(cdata, 3)), op=MPI.SUM)/N
-    c4 = comm.allreduce(psum(w*np.power(cdata, 4)), op=MPI.SUM)/N
-    c5 = comm.allreduce(psum(w*np.power(cdata, 5)), op=MPI.SUM)/N
-    c6 = comm.allreduce(psum(w*np.power(cdata, 6)), op=MPI.SUM)/N
+    # 2nd-6th moments centered on m1 from the moments centered on the
+    # mean by the binomial theorem, sum(w*(x-m1)^p) =
+    # sum_k C(p, k)*M_k*(mean-m1)^(p-k), where M_0 = W and M_1 = 0
+    M = np.concatenate(([W, 0.0], stats[2:7]))
+    d = mean - m1
+    c2, c3, c4, c5, c6 = [sum(comb(p, k)*M[k]*d**(p-k) for k in range(p+1))/N
+                          for p in range(2, 7)]
 
     return m1, c2, c3, c4, c5, c6, gmin, gmax
 
 
+def local_moments(data, w=None, chunk=65536):
+    """
+    Returns the mergeable partial moments of the memory-local data as the
+    float64 array [W, mean, M2, M3, M4, M5, M6, min, max], where W is the
+    sum of the weights (number of points if w is None), mean is the
+    weighted mean, and Mp = sum(w*(data-mean)^p).
+
+    The data are processed in chunks of `chunk` points, so that only
+    chunk-sized temporaries are created, and the chunks are combined
+    with merge_moments().
+    """
+    data = np.asarray(data)
+    if w is not None:
+        w = np.broadcast_to(w, data.shape).reshape(-1)
+    data = data.reshape(-1)
+
+    stats = np.zeros(9)
+    stats[-2:] = (np.nan, np.nan)
+
+    for i in range(0, data.size, chunk):
+        x = data[i:i+chunk].astype(np.float64)
+        part = np.empty(9)
+
+        if w is None:
+            part[0] = x.size
+            part[1] = np.sum(x)/part[0]
+            d = x - part[1]
+            dp = d*d
+            for p in range(2, 7):
+                part[p] = np.sum(dp)
+                dp *= d
+        else:
+            wc = w[i:i+chunk].astype(np.float64)
+            part[0] = np.sum(wc)
+            part[1] = np.sum(wc*x)/part[0] if part[0] != 0 else 0.0
+            d = x - part[1]
+            dp = wc*d*d
+            for p in range(2, 7):
+                part[p] = np.sum(dp)
+                dp *= d
+
+        part[7] = np.nanmin(x)
+        part[8] = np.nanmax(x)
+
+        stats = merge_moments(stats, part)
+
+    return stats
+
+
+def merge_moments(a, b):
+    """
+    Combines two sets of partial moments, [W, mean, M2, ..., M6, min,
+    max], as returned by local_moments(), with the arbitrary-order
+    pairwise update formulas of Pebay (Sandia report SAND2008-6212).
+    """
+    nA = a[0]
+    nB = b[0]
+    c = np.empty(9)
+    c[7] = np.fmin(a[7], b[7])
+    c[8] = np.fmax(a[8], b[8])
+
+    if nB == 0:
+        c[:7] = a[:7]
+        return c
+    if nA == 0:
+        c[:7] = b[:7]
+        return c
+
+    n = nA + nB
+    delta = b[1] - a[1]
+    c[0] = n
+    c[1] = a[1] + delta*nB/n
+
+    MA = (nA, 0.0) + tuple(a[2:7])
+    MB = (nB, 0.0) + tuple(b[2:7])
+    for p in range(2, 7):
+        Mp = MA[p] + MB[p]
+        for k in range(1, p-1):
+            Mp += comb(p, k)*delta**k*((-nB/n)**k*MA[p-k]
+                                       + (nA/n)**k*MB[p-k])
+        Mp += (nA*nB*delta/n)**p*(nB**(1-p) - (-1.0/nA)**(p-1))
+        c[p] = Mp
+
+    return c
+
+
+def _moments_reduce(inbuf, inoutbuf, datatype):
+    """MPI user-defined reduction of partial moments arrays"""
+    a = np.frombuffer(inbuf, dtype=np.float64).reshape(-1, 9)
+    b = np.frombuffer(inoutbuf, dtype=np.float64).reshape(-1, 9)
+    for i in range(b.shape[0]):
+        b[i] = merge_moments(a[i], b[i])
+
+
+# each set of partial moments is reduced as one MPI element, so that MPI
+# can never split it up, and the op is not declared commutative, so that
+# MPI always merges the partial moments in rank order and every task gets
+# bitwise identical results
+_moments_type = MPI.DOUBLE.Create_contiguous(9).Commit()
+_moments_op = MPI.Op.Create(_moments_reduce, commute=False)
+
+
+def uniform_histogram(data, bins, range, w=None, outliers='drop',
+                      chunk=_chunk):
+    """
+    Returns the memory-local histogram of data on uniform bins, which is
+    the same as np.histogram() (or np.histogramdd()) of float64 data
+    with an integer number of bins and a given range, but computed
+    directly from the bin indices floor((x - lo)*scale), corrected
+    against the bin edges exactly as in np.histogram(), and accumulated
+    with np.bincount(). As in np.histogram(), an empty range (lo == hi)
+    is widened to (lo - 0.5, hi + 0.5). The data are read in chunks of
+    `chunk` points, so that only chunk-sized temporaries are created,
+    whatever the shape and memory layout of the data.
+
+    Arguments:
+    ----------
+    data: array of any shape, or a list or tuple of D arrays (of the
+        same, or broadcastable, shapes) for a D-dimensional joint
+        histogram
+    bins: number of bins, or a sequence of D numbers of bins
+    range: (min, max) of the bins, or a sequence of D (min, max)
+    w: (optional) weights, broadcastable to the shape of data
+    outliers: (default='drop') 'drop' ignores values outside of range,
+        'clip' counts them in the first or last bin. Non-finite values
+        are always ignored.
+
+    The histogram is returned as an int64 array if w is None (float64
+    otherwise) of shape (bins, ) or (bins[0], ..., bins[D-1]).
+    """
+    data = list(data) if isinstance(data, (list, tuple)) else [data]
+    binner = _uniformBins(len(data), bins, range, outliers, chunk)
+    hist = np.zeros(binner.nbins, dtype=np.int64 if w is None else np.float64)
+
+    ops = data if w is None else data + [w]
+    for xs in _chunks(ops, chunk):
+        flat, keep = binner.index(xs)
+        if w is None:
+            hist += np.bincount(flat[keep], minlength=binner.nbins)
+        else:
+            hist += np.bincount(flat[keep], weights=xs[-1][keep],
+                                minlength=binner.nbins)
+
+    return hist.reshape(binner.bins)
+
+
+def _chunks(ops, chunk):
+    """
+    Generator of aligned float64 chunks of at most `chunk` points of the
+    (broadcastable) arrays ops, as a tuple of 1D arrays.
+    """
+    ops = [np.asarray(x) for x in ops]
+    it = np.nditer(ops, flags=['external_loop', 'buffered', 'zerosize_ok'],
+                   op_dtypes=[np.float64]*len(ops), casting='same_kind',
+                   buffersize=chunk)
+    for xs in it:
+        yield (xs, ) if len(ops) == 1 else xs
+
+
+class _uniformBins(object):
+    """
+    Flat bin indices of D-dimensional uniform bins, see
+    uniform_histogram().
+    """
+
+    def __init__(self, ndim, bins, range, outliers='drop', chunk=_chunk):
+        if outliers not in ('drop', 'clip'):
+            raise ValueError("outliers must be either 'drop' or 'clip'")
+
+        self.ndim = ndim
+        self.bins = np.broadcast_to(bins, ndim).astype(np.intp)
+        self.nbins = int(np.prod(self.bins))
+        self.range = np.array(range, dtype=np.float64).reshape(ndim, 2)
+        if not np.all(np.isfinite(self.range)):
+            raise ValueError('histogram range %s is not finite, the data '
+                             'may be all nan' % self.range.tolist())
+        if np.any(self.range[:, 0] > self.range[:, 1]):
+            raise ValueError('histogram range must be (min, max), not %s'
+                             % self.range.tolist())
+
+        # widen empty ranges (e.g. of a constant field) like np.histogram()
+        empty = self.range[:, 0] == self.range[:, 1]
+        self.range[empty] += [-0.5, 0.5]
+
+        self.scale = self.bins/(self.range[:, 1] - self.range[:, 0])
+        self.edges = [np.linspace(lo, hi, n+1)
+                      for (lo, hi), n in zip(self.range, self.bins)]
+        self.outliers = outliers
+        self._f = np.empty(chunk)
+        self._index = np.empty(chunk, dtype=np.intp)
+
+    def index(self, xs):
+        """
+        Returns the flat bin index of each point of a chunk of the D
+        binned arrays xs[:D] and the mask of the points to keep.
+        """
+        n = xs[0].size
+        fi = self._f[:n]
+        flat = self._index[:n]
+        keep = None
+        for d, x in enumerate(xs[:self.ndim]):
+            lo, hi = self.range[d]
+            nb = self.bins[d]
+            edges = self.edges[d]
+
+            np.subtract(x, lo, out=fi)
+            fi *= self.scale[d]
+            if self.outliers == 'drop':
+                inside = (x >= lo) & (x <= hi)
+            else:
+                inside = np.isfinite(x)
+            fi[~inside] = 0
+            np.clip(fi, 0, nb-1, out=fi)  # x == max goes in the last bin
+            i = fi.astype(np.intp)
+
+            # values that round into the wrong bin are moved by one bin,
+            # exactly like np.histogram()
+            i -= x < edges[i]
+            i += (x >= edges[i+1]) & (i != nb-1)
+            np.clip(i, 0, nb-1, out=i)  # clipped outliers
+
+            keep = inside if keep is None else keep & inside
+
+            if d == 0:
+                flat[:] = i
+            else:
+                flat *= nb
+                flat += i
+
+        return flat, keep
+
+
 def histogram1(comm, N, data, range=None, bins=50, w=None, wbar=None, m1=None):
     """
     Constructs the histogram (probability mass function) of an MPI-
     decomposed data.
     """
+    weights = w
 
     if w is None:   # unweighted moments
         w = 1
         wbar = 1
     elif wbar is None:
-        wbar = comm.allreduce(psum(w), op=MPI.SUM)/N
+        wbar = gsum(comm, w)/N
 
     N = N*wbar
 
     # 1st raw moment
     if m1 is None:
-        m1 = comm.allreduce(psum(w*data), op=MPI.SUM)/N
+        m1 = gsum(comm, w*data)/N
 
     # 2nd raw moment
-    m2 = comm.allreduce(psum(w*np.power(data, 2)), op=MPI.SUM)/N
+    m2 = gsum(comm, w*np.power(data, 2))/N
 
     if range is None:
         gmin = comm.allreduce(np.nanmin(data), op=MPI.MIN)
@@ -87,7 +465,7 @@ def histogram1(comm, N, data, range=None, bins=50, w=None, wbar=None, m1=None):
 
     width = (gmax-gmin)/bins
 
-    temp = np.histogram(data, bins=bins, range=(gmin, gmax), weights=w)[0]
+    temp = uniform_histogram(data, bins, (gmin, gmax), weights)
     hist = temp.astype(data.dtype, order='C')
     comm.Allreduce(MPI.IN_PLACE, hist, op=MPI.SUM)
     hist *= 1.0/hist.sum()  # makes this a probability mass function
@@ -95,6 +473,95 @@ def histogram1(comm, N, data, range=None, bins=50, w=None, wbar=None, m1=None):
     return hist, m1, m2, gmin, gmax, width
 
 
+def histograms(comm, fields, range=None, bins=50, w=None):
+    """
+    Constructs the histograms (probability mass functions) of several
+    MPI-decomposed data sets at once, using at most three collectives
+    in total: one MIN/MAX reduction of every range that is not given,
+    one SUM reduction of every histogram, stacked into a single array,
+    and one SUM reduction of the exact raw sums (see gsum()) of every
+    field, so that m1 and m2 are bitwise identical to histogram1()'s.
+
+    Arguments:
+    ----------
+    fields: dictionary of {name: data}
+    range: (optional) (min, max) of the bins of every field, or a
+        dictionary of {name: (min, max)}, where the ranges of missing
+        names are computed from the data
+    bins: (default=50) number of bins
+    w: (optional) weights of every field, or a dictionary of {name: w},
+        where missing names are unweighted
+
+    Returns a dictionary of {name: (hist, m1, m2, gmin, gmax, width)}, in
+    the same form as histogram1().
+    """
+    names = list(fields)
+    nf = len(names)
+
+    if isinstance(range, dict):
+        ranges = dict(range)
+    elif range is not None:
+        ranges = dict.fromkeys(names, tuple(range))
+    else:
+        ranges = {}
+
+    if isinstance(w, dict):
+        weights = w
+    else:
+        weights = dict.fromkeys(names, w)
+
+    # one reduction of all missing ranges as [-min, max] with MPI.MAX
+    missing = [name for name in names if name not in ranges]
+    if missing:
+        minmax = np.empty((2, len(missing)))
+        for i, name in enumerate(missing):
+            minmax[0, i] = -np.nanmin(fields[name])
+            minmax[1, i] = np.nanmax(fields[name])
+        comm.Allreduce(MPI.IN_PLACE, minmax, op=MPI.MAX)
+        for i, name in enumerate(missing):
+            ranges[name] = (-minmax[0, i], minmax[1, i])
+
+    # local histograms, and the number of points and exact raw sums
+    # [sum(w), sum(w*x), sum(w*x^2)] as limbs, see gsum()
+    hists = np.empty((nf, bins))
+    sums = np.zeros((nf, 4, _nlimbs+3), dtype=np.int64)
+    for i, name in enumerate(names):
+        data = np.ravel(fields[name])
+        wi = weights.get(name)
+        if wi is not None:
+            wi = np.broadcast_to(wi, np.shape(fields[name])).ravel()
+
+        hists[i] = uniform_histogram(data, bins, ranges[name], wi)
+        sums[i, 0, 0] = data.size
+        if wi is None:
+            sums[i, 2] = sum_limbs(data)
+            sums[i, 3] = sum_limbs(np.power(data, 2))
+        else:
+            sums[i, 1] = sum_limbs(wi)
+            sums[i, 2] = sum_limbs(wi*data)
+            sums[i, 3] = sum_limbs(wi*np.power(data, 2))
+
+    comm.Allreduce(MPI.IN_PLACE, hists, op=MPI.SUM)
+    comm.Allreduce(MPI.IN_PLACE, sums, op=MPI.SUM)
+
+    results = {}
+    for i, name in enumerate(names):
+        gmin, gmax = ranges[name]
+        hist = hists[i]
+        hist *= 1.0/hist.sum()  # makes this a probability mass function
+
+        # same arithmetic as histogram1(), so that m1 and m2 are bitwise
+        # identical for the same data
+        N = float(sums[i, 0, 0])
+        if weights.get(name) is not None:
+            N = N*(limbs_to_float(sums[i, 1])/N)
+        m1 = limbs_to_float(sums[i, 2])/N
+        m2 = limbs_to_float(sums[i, 3])/N
+        results[name] = (hist, m1, m2, gmin, gmax, (gmax-gmin)/bins)
+
+    return results
+
+
 def histogram2(comm, var1, var2, xrange=None, yrange=None, bins=50, w=None):
     """
     Constructs the 2D histogram (probability mass function) of two MPI-
@@ -135,7 +602,7 @@ def histogram2(comm, var1, var2, xrange=None, yrange=None, bins=50, w=None):
 
     xy_range = [[gmin1, gmax1], [gmin2, gmax2]]
 
-    temp = np.histogram2d(var1, var2, bins=bins, range=xy_range, weights=w)[0]
+    temp = uniform_histogram([var1, var2], bins, xy_range, w)
     hist = temp.astype(var1.dtype, order='C')
     comm.Allreduce(MPI.IN_PLACE, hist, op=MPI.SUM)
     hist *= 1.0/hist.sum()  # makes this a probability mass function
@@ -143,6 +610,141 @@ def histogram2(comm, var1, var2, xrange=None, yrange=None, bins=50, w=None):
     return hist, gmin1, gmax1, width1, gmin2, gmax2, width2
 
 
+def conditional_moments(comm, cond, targets, bins=50, range=None, w=None,
+                        chunk=_chunk):
+    """
+    Computes the conditional means and variances of any number of target
+    fields given one or more binned conditioning fields, e.g.
+    <dissipation | enstrophy>, in a single chunked pass over the data
+    and a single Allreduce (plus one MIN/MAX reduction if range is not
+    given).
+
+    Within each chunk, the (weighted) count, mean, and centered sum of
+    squares of every target in every bin are computed with np.bincount,
+    and merged into the running statistics with the pairwise formulas
+    of Chan et al., which are also used to merge the statistics of all
+    tasks in a user-defined MPI reduction.
+
+    Arguments:
+    ----------
+    cond: conditioning field, or a list or tuple of D conditioning fields
+        for joint conditioning
+    targets: dictionary of {name: field} of the target fields
+    bins: (default=50) number of bins, or a sequence of D numbers
+    range: (optional) (min, max) of the bins, or a sequence of D
+        (min, max), computed from the data if not given
+    w: (optional) weights of the data
+
+    Returns (counts, stats, ranges), where counts is the (weighted)
+    number of points in each bin, stats is a dictionary of
+    {name: (mean, var)}, arrays with the same shape as counts that are
+    nan in empty bins, and ranges is the (D, 2) array of bin ranges.
+    """
+    cond = list(cond) if isinstance(cond, (list, tuple)) else [cond]
+    names = list(targets)
+    ndim = len(cond)
+    nt = len(names)
+
+    if range is None:
+        minmax = np.empty((2, ndim))
+        for d, x in enumerate(cond):
+            minmax[0, d] = -np.nanmin(x)
+            minmax[1, d] = np.nanmax(x)
+        comm.Allreduce(MPI.IN_PLACE, minmax, op=MPI.MAX)
+        range = np.stack((-minmax[0], minmax[1]), axis=-1)
+
+    binner = _uniformBins(ndim, bins, range, 'drop', chunk)
+    nbins = binner.nbins
+
+    # [ntargets, W, mean_0, M2_0, mean_1, M2_1, ...] with nbins each
+    stats = np.zeros(1 + (1+2*nt)*nbins)
+    stats[0] = nt
+    part = np.zeros_like(stats)
+    part[0] = nt
+
+    ops = cond + [targets[name] for name in names]
+    if w is not None:
+        ops.append(w)
+
+    for xs in _chunks(ops, chunk):
+        flat, keep = binner.index(xs)
+        index = flat[keep]
+        wc = None if w is None else xs[-1][keep]
+
+        P = part[1:].reshape(1+2*nt, nbins)
+        P[0] = np.bincount(index, weights=wc, minlength=nbins)
+        full = P[0] > 0
+        for t in builtins.range(nt):
+            x = xs[ndim+t][keep]
+            wx = x if wc is None else wc*x
+            mean = np.bincount(index, weights=wx, minlength=nbins)
+            mean[full] /= P[0, full]
+            d = x - mean[index]
+            d *= d
+            if wc is not None:
+                d *= wc
+            P[1+2*t] = mean
+            P[2+2*t] = np.bincount(index, weights=d, minlength=nbins)
+
+        stats = _merge_binned_moments(stats, part)
+
+    if stats.size not in _binned_types:
+        _binned_types[stats.size] = MPI.DOUBLE.Create_contiguous(
+                                                    stats.size).Commit()
+    dtype = _binned_types[stats.size]
+    comm.Allreduce(MPI.IN_PLACE, [stats, dtype], op=_binned_moments_op)
+
+    S = stats[1:].reshape(1+2*nt, nbins)
+    W = S[0]
+    empty = W == 0
+    results = {}
+    for t, name in enumerate(names):
+        mean = np.where(empty, np.nan, S[1+2*t])
+        var = np.where(empty, np.nan, S[2+2*t]/np.where(empty, 1, W))
+        results[name] = (mean.reshape(binner.bins), var.reshape(binner.bins))
+
+    return W.reshape(binner.bins), results, binner.range
+
+
+def _merge_binned_moments(a, b):
+    """
+    Merges two arrays of per-bin [W, mean, M2] statistics, as used by
+    conditional_moments(), bin by bin with the pairwise formulas of Chan
+    et al.
+    """
+    nt = int(a[0])
+    c = np.empty_like(a)
+    c[0] = nt
+    A = a[1:].reshape(1+2*nt, -1)
+    B = b[1:].reshape(1+2*nt, -1)
+    C = c[1:].reshape(1+2*nt, -1)
+
+    nA = A[0]
+    nB = B[0]
+    n = nA + nB
+    C[0] = n
+    fB = np.divide(nB, n, out=np.zeros_like(n), where=n > 0)
+    for t in builtins.range(nt):
+        delta = B[1+2*t] - A[1+2*t]
+        C[1+2*t] = A[1+2*t] + delta*fB
+        C[2+2*t] = A[2+2*t] + B[2+2*t] + delta**2*nA*fB
+
+    return c
+
+
+def _binned_moments_reduce(inbuf, inoutbuf, datatype):
+    """MPI user-defined reduction of conditional_moments() statistics"""
+    a = np.frombuffer(inbuf, dtype=np.float64)
+    b = np.frombuffer(inoutbuf, dtype=np.float64)
+    b[...] = _merge_binned_moments(a, b)
+
+
+# as for the partial moments, non-commutative so that every task gets
+# bitwise identical results
+_binned_moments_op = MPI.Op.Create(_binned_moments_reduce, commute=False)
+_binned_types = {}
+
+
 # def alt_local_moments(data, w=None, wbar=None, N=None, unbias=True):
 #     """
 #     Returns the mean and 2nd-4th central moments of a memory-local
@@ -0,0 +1,54 @@
+"""
+Description:
+------------
+Checks that the Akima spline flux derivatives of mpiAnalyzer along the
+MPI-decomposed z axis do not depend on the number of tasks, including
+fields whose Akima undefined-slope cutoff is set by a few planes.
+
+Run with `mpiexec -n 4 python teslacu/test/test_akima_decomposition.py`
+(or `python -m pytest`, which only checks the serial case).
+
+Authors:
+--------
+Colin Towery, colin.towery@colorado.edu
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+
+from mpi4py import MPI
+import numpy as np
+from teslacu import mpiAnalyzer
+comm = MPI.COMM_WORLD
+
+N = 16
+L = 2*np.pi
+
+
+def _analyzers():
+    kwargs = dict(odir='/tmp/teslacu_test/', pid='test', ndims=3, L=L, N=N,
+                  config='hit', method='spline_flux_diff')
+    return (mpiAnalyzer(comm, **kwargs),
+            mpiAnalyzer(MPI.COMM_SELF, **kwargs))
+
+
+def test_z_derivative_independent_of_tasks():
+    rng = np.random.RandomState(42)  # the same global field on every task
+    phi = 1.e-12*rng.rand(3, N, N, N)
+    phi[:, 5:7] = rng.rand(3, 2, N, N)
+
+    parallel, serial = _analyzers()
+    zs = slice(parallel.ixs[0], parallel.ixe[0])
+
+    expected = serial.deriv(phi, dim=2)[:, zs]
+    assert np.array_equal(parallel.deriv(phi[:, zs], dim=2), expected)
+    assert np.array_equal(parallel.deriv(phi[0, zs], dim=2), expected[0])
+
+
+if __name__ == "__main__":
+    test_z_derivative_independent_of_tasks()
+    if comm.rank == 0:
+        print('teslacu Akima decomposition test passed on %d tasks'
+              % comm.size)
@@ -0,0 +1,82 @@
+"""
+Description:
+------------
+Checks of the uniform-bin histograms of teslacu.stats against
+np.histogram() and np.histogramdd(), including values on the bin edges
+and constant fields.
+
+Run with `python -m pytest teslacu/test/test_histograms.py` or
+`mpiexec -n 2 python teslacu/test/test_histograms.py`.
+
+Authors:
+--------
+Colin Towery, colin.towery@colorado.edu
+
+Turbulence and Energy Systems Laboratory
+Department of Mechanical Engineering
+University of Colorado Boulder
+http://tesla.colorado.edu
+"""
+
+from mpi4py import MPI
+import numpy as np
+from teslacu import stats as tcstats
+comm = MPI.COMM_WORLD
+
+
+def test_bin_edges_match_numpy():
+    rng = np.random.RandomState(0)
+    cases = [(np.round(rng.randn(200000), 1), 30, (-3.1, 2.9)),
+             (np.linspace(-1, 1, 1001), 50, (-1, 1)),
+             (np.arange(100)*0.1, 10, (0, 9.9))]
+
+    for x, bins, range in cases:
+        hist = tcstats.uniform_histogram(x, bins, range)
+        assert np.array_equal(hist, np.histogram(x, bins, range)[0])
+
+        y = np.round(rng.randn(x.size), 1)
+        xy_range = [range, (-1.2, 1.3)]
+        hist = tcstats.uniform_histogram([x, y], bins, xy_range)
+        assert np.array_equal(hist, np.histogramdd((x, y), bins,
+                                                   xy_range)[0])
+
+
+def test_constant_field():
+    phi = np.full((4, 8, 8), 2.5)
+    N = phi.size*comm.size
+
+    hist = tcstats.histogram1(comm, N, phi, bins=10)[0]
+    assert hist[5] == 1.0 and hist.sum() == 1.0
+
+    hist = tcstats.histograms(comm, {'phi': phi}, bins=4)['phi'][0]
+    assert hist[2] == 1.0 and hist.sum() == 1.0
+
+    hist = tcstats.histogram2(comm, phi, 2*phi, bins=3)[0]
+    assert hist[1, 1] == 1.0 and hist.sum() == 1.0
+
+    hist = tcstats.uniform_histogram(phi, 5, (2.5, 2.5))
+    assert np.array_equal(hist, np.histogram(phi, 5, (2.5, 2.5))[0])
+
+
+def test_conditional_moments_constant_condition():
+    rng = np.random.RandomState(comm.rank)
+    phi = np.full((4, 8, 8), 2.5)
+    psi = rng.rand(4, 8, 8)
+    N = phi.size*comm.size
+
+    counts, stats, ranges = tcstats.conditional_moments(
+                                comm, phi, {'psi': psi}, bins=3)
+    assert np.array_equal(counts, [0, N, 0])
+    assert np.array_equal(ranges, [[2.0, 3.0]])
+
+    mean, var = stats['psi']
+    assert np.isnan(mean[0]) and np.isnan(mean[2])
+    assert np.isclose(mean[1], tcstats.gsum(comm, psi)/N)
+
+
+if __name__ == "__main__":
+    test_bin_edges_match_numpy()
+    test_constant_field()
+    test_conditional_moments_constant_condition()
+    if comm.rank == 0:
+        print('teslacu.stats histogram tests passed')